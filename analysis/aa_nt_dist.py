@@ -1,5 +1,7 @@
 import itertools as it
 
+import numpy as np
+
 _CODONS = {
     'A': ['GCT', 'GCC', 'GCA', 'GCG'],
     'R': ['CGT', 'CGC', 'CGA', 'CGG', 'AGA', 'AGG'],
@@ -33,6 +35,14 @@ for aa1, aa2 in it.product(_CODONS, _CODONS):
 def min_nt_dist(aa1, aa2):
     return _MIN_NT_DIST[aa1, aa2]
 
+# Amino acids (and stop) in the order of their integer codes, and the
+# matrix of minimum nucleotide distances between codes, for looking up
+# many variants at once.
+AMINO_ACIDS = ''.join(_CODONS)
+AA_INDEX = {aa : i for (i, aa) in enumerate(AMINO_ACIDS)}
+MIN_NT_DIST_MATRIX = np.array([[_MIN_NT_DIST[aa1, aa2] for aa2 in AMINO_ACIDS]
+                               for aa1 in AMINO_ACIDS], dtype=np.uint8)
+
 if __name__ == '__main__':
     examples = [('L', 'P', 1),
                 ('T', 'N', 1),
@@ -0,0 +1,57 @@
+import hashlib
+import os
+
+from dms.checkpoint import read_checkpoint, write_checkpoint
+
+# The analysis caches what it derives from the control (thresholds and
+# KDEs) and each antibody's annotated table, as dms checkpoints keyed by
+# hashes of the input files' contents and the parameters they depend on.
+# Changing only the significance cutoff then skips straight to writing
+# the output.
+CACHE_DIR = 'Cache'
+
+# Name of the cache entry of the control models. Antibody entries are
+# named by antibody_cache_name, so that no title can clash with it.
+CONTROL_CACHE_NAME = 'control'
+
+# Bumped whenever the format of the cached values changes.
+CACHE_VERSION = 5
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of the contents of a file."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def control_key(analysis, sizes):
+    """Return the cache key of the models derived from the control
+    files."""
+    return dict(version=CACHE_VERSION,
+                control=tuple(file_hash(p) for p in analysis.control_filepath),
+                FDR=analysis.FDR,
+                sizes=sizes,
+                kde_method=analysis.kde_method,
+                kde_grid_size=analysis.kde_grid_size)
+
+def antibody_key(models_key, a_file):
+    """Return the cache key of the annotated table of an antibody file,
+    given the key of the control models it was tested against."""
+    return dict(version=CACHE_VERSION, models=models_key,
+                antibody=file_hash(a_file))
+
+def antibody_cache_name(out):
+    """Return the name of the cache entry of the annotated table written
+    to <out>.csv."""
+    return f'antibody-{out}'
+
+def cache_path(prd, name):
+    return os.path.join(prd, CACHE_DIR, f'{name}.pkl')
+
+def read_cache(prd, name, key):
+    """Return the value cached under name with the given key, or None."""
+    return read_checkpoint(cache_path(prd, name), key)
+
+def write_cache(prd, name, key, value):
+    write_checkpoint(cache_path(prd, name), key, value)
@@ -91,13 +91,25 @@ def add_heatmap_aa_labels(ws):
         ws.cell(row, AA_LABEL_COL).value = aa
 
 
+def variant_lookup(data, hit_column='pval'):
+    """Return a dict mapping each variant of a dataset to its ER and
+    value of hit_column, or to None if the variant appears more than
+    once."""
+    lookup = {}
+    for variant, ER, pval in zip(data['variant'].astype(str),
+                                 data['ER'].to_numpy(),
+                                 data[hit_column].to_numpy()):
+        lookup[variant] = None if variant in lookup else (ER, pval)
+    return lookup
+
 def add_heatmap_data(ws, wt_seq, positions, datasets, significance,
-                     pos_label_colors, hit_color):
+                     pos_label_colors, hit_color, hit_column='pval'):
     thin_border = Border(left=Side(style='thin'),
                          right=Side(style='thin'),
                          top=Side(style='thin'),
                          bottom=Side(style='thin'))
     ws.row_dimensions[POS_LABEL_ROW].height = 24
+    lookups = [variant_lookup(data, hit_column) for data in datasets]
     for col, pos in enumerate(positions, DATA_START_COL):
         wt_aa = wt_seq[pos]
         label_font = Font(name='Helvetica',
@@ -120,13 +132,12 @@ def add_heatmap_data(ws, wt_seq, positions, datasets, significance,
             ws.cell(row, col).border = thin_border
             colors = []
             ER = None
-            for data in datasets:
-                d = data.loc[data['variant'] == f'{wt_aa}{pos}{aa}']
-                if len(d) == 0:
+            for lookup in lookups:
+                variant = f'{wt_aa}{pos}{aa}'
+                if variant not in lookup:
                     colors.append(MISSING_COLOR)
-                elif len(d) == 1:
-                    ER = d['ER'].to_numpy()[0]
-                    pval = d['pval'].to_numpy()[0]
+                elif lookup[variant] is not None:
+                    ER, pval = lookup[variant]
                     if pval <= significance:
                         colors.append(hit_color)
                     else:
@@ -150,12 +161,15 @@ def add_heatmap_data(ws, wt_seq, positions, datasets, significance,
 
 
 def write_heatmap(filename, wt_seq, positions, data, title, significance,
-                  pos_label_colors={}, hit_color='1F78B4'):
+                  pos_label_colors={}, hit_color='1F78B4', hit_column='pval'):
+    """Write an Excel heatmap of the ERs of each dataset in data, with
+    the variants whose hit_column (e.g. 'pval' or 'qval_bh') is at most
+    significance filled with hit_color."""
     wb = Workbook()
     ws = wb.active
     ws.title = title
     ws.sheet_view.showGridLines = False
     add_heatmap_aa_labels(ws)
     add_heatmap_data(ws, wt_seq, positions, data, significance,
-                     pos_label_colors, hit_color)
+                     pos_label_colors, hit_color, hit_column)
     wb.save(filename)
@@ -0,0 +1,131 @@
+from dataclasses import dataclass
+
+import numpy as np
+import scipy.optimize
+import scipy.signal
+import scipy.special
+import scipy.stats
+
+# Largest number of kernel evaluations done at once, to bound the memory
+# used when evaluating a KDE at many points.
+MAX_EVALUATIONS = 10**7
+
+@dataclass(frozen=True)
+class KDE:
+    """A one-dimensional Gaussian kernel density estimate.
+
+    points: the data points.
+    bandwidth: the standard deviation of the kernel.
+    """
+    points: np.ndarray
+    bandwidth: float
+
+    def _sum_ndtr(self, x, sign):
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        out = np.empty(len(x))
+        step = max(1, MAX_EVALUATIONS // len(self.points))
+        for i in range(0, len(x), step):
+            z = sign * (x[i:i+step, None] - self.points[None, :]) / self.bandwidth
+            out[i:i+step] = scipy.special.ndtr(z).mean(axis=1)
+        return out
+
+    def span(self):
+        """Return the interval outside which the CDF is 0 or 1 to within
+        floating point precision."""
+        margin = 10 * self.bandwidth
+        return self.points.min() - margin, self.points.max() + margin
+
+    def cdf(self, x):
+        """Return the CDF of the KDE at each of an array of points, i.e.
+        the same as gaussian_kde.integrate_box_1d(-np.inf, x)."""
+        return self._sum_ndtr(x, 1)
+
+    def sf(self, x):
+        """Return 1 - cdf(x), computed directly so that it keeps its
+        precision in the upper tail."""
+        return self._sum_ndtr(x, -1)
+
+@dataclass(frozen=True)
+class BinnedKDE:
+    """A Gaussian KDE approximated on an evenly spaced grid.
+
+    The data points are linearly binned onto the grid and the CDF at
+    every grid point is computed at once by convolving the bin weights
+    with the kernel's CDF using an FFT, so the cost grows with the
+    number of points plus grid_size * log(grid_size) rather than their
+    product. Between grid points the CDF is linearly interpolated.
+
+    grid: the grid points.
+    grid_cdf, grid_sf: the CDF and 1 - CDF at the grid points.
+    """
+    grid: np.ndarray
+    grid_cdf: np.ndarray
+    grid_sf: np.ndarray
+
+    def span(self):
+        return self.grid[0], self.grid[-1]
+
+    def cdf(self, x):
+        return np.interp(np.atleast_1d(x), self.grid, self.grid_cdf,
+                         left=0.0, right=1.0)
+
+    def sf(self, x):
+        return np.interp(np.atleast_1d(x), self.grid, self.grid_sf,
+                         left=1.0, right=0.0)
+
+def make_binned_kde(values, bandwidth, grid_size):
+    """Make a BinnedKDE of an array of values with a grid of grid_size
+    points extending 10 bandwidths beyond the data."""
+    margin = 10 * bandwidth
+    grid = np.linspace(values.min() - margin, values.max() + margin,
+                       grid_size)
+    dx = grid[1] - grid[0]
+    # Linear binning: each value is split between its two neighbouring
+    # grid points in proportion to how close it is to them.
+    t = (values - grid[0]) / dx
+    i = np.minimum(np.floor(t).astype(np.int64), grid_size - 2)
+    frac = t - i
+    weights = (np.bincount(i, 1 - frac, minlength=grid_size) +
+               np.bincount(i + 1, frac, minlength=grid_size)) / len(values)
+    # The CDF at grid point j is the sum over grid points k of
+    # weights[k] * ndtr((j - k) * dx / bandwidth), a convolution over
+    # lags j - k from -(grid_size - 1) to grid_size - 1.
+    lags = np.arange(-(grid_size - 1), grid_size) * dx / bandwidth
+    full = slice(grid_size - 1, 2 * grid_size - 1)
+    cdf = scipy.signal.fftconvolve(weights, scipy.special.ndtr(lags))[full]
+    sf = scipy.signal.fftconvolve(weights, scipy.special.ndtr(-lags))[full]
+    # Remove round-off from the FFT so that the CDF stays monotone.
+    cdf = np.maximum.accumulate(np.clip(cdf, 0, 1))
+    sf = np.minimum.accumulate(np.clip(sf, 0, 1))
+    return BinnedKDE(grid, cdf, sf)
+
+# Methods of make_kde.
+KDE_METHODS = ('exact', 'binned')
+
+def make_kde(values, method='exact', grid_size=2048):
+    """Make a KDE of an array of values with the same bandwidth as
+    scipy.stats.gaussian_kde (Scott's rule).
+
+    method: 'exact' for a KDE that sums over all the values whenever it
+    is evaluated, or 'binned' for a BinnedKDE with grid_size grid
+    points, which is much faster for large numbers of values.
+    """
+    values = np.asarray(values, dtype=float)
+    kde = scipy.stats.gaussian_kde(values)
+    bandwidth = float(np.sqrt(kde.covariance[0, 0]))
+    if method == 'binned':
+        return make_binned_kde(values, bandwidth, grid_size)
+    return KDE(values, bandwidth)
+
+def cdf_quantile(kde, q, grid_size=256, xtol=1e-12):
+    """Return the x at which the CDF of a KDE reaches q.
+
+    The CDF is evaluated once on a grid spanning the data, which is
+    monotone, so the grid interval containing q is found by a binary
+    search and the root is then polished within it with brentq.
+    """
+    grid = np.linspace(*kde.span(), grid_size)
+    cdf = kde.cdf(grid)
+    i = int(np.clip(np.searchsorted(cdf, q), 1, grid_size - 1))
+    return scipy.optimize.brentq(lambda x: kde.cdf(x)[0] - q,
+                                 grid[i - 1], grid[i], xtol=xtol)
@@ -1,26 +1,24 @@
 import itertools as it
+import multiprocessing
 import os
 import configparser
+from dataclasses import dataclass
+
 import numpy as np
 import pandas as pd
 import scipy.stats
-import scipy.optimize
 from statsmodels.stats.rates import test_poisson_2indep
 
-from matplotlib import pyplot as plt
-
-from analysis.aa_nt_dist import min_nt_dist
+from analysis.aa_nt_dist import AA_INDEX, MIN_NT_DIST_MATRIX
+from analysis.cache import (CONTROL_CACHE_NAME, antibody_cache_name,
+                            antibody_key, control_key, read_cache,
+                            write_cache)
 from analysis.heatmap import write_heatmap
+from analysis.kde import KDE_METHODS, cdf_quantile, make_kde
+from analysis.qvalues import HIT_COLUMNS, QVALUE_FUNCTIONS, hit_values
 from dms.dna import *
 from dms.arguments import *
-
-def variant_min_nt_dist(variant):
-    """Return the minimum number of nucleotide changes to get from one
-    amino acid to another.
-
-    variant: A string describing a mutation, e.g. 'A102W'.
-    """
-    return min_nt_dist(variant[0], variant[-1])
+from dms.tile import library_size
 
 def pois_exact_test(row, ratio_null=1):
     """Hypothesis test on the ratio of two Poisson rate parameters.
@@ -40,48 +38,129 @@ def pois_exact_test(row, ratio_null=1):
                             method='exact-cond')
     return p.pvalue
 
-def calculate_ER_threshold(d, fdr, size):
+def pois_exact_tests(d, ratio_null=1):
+    """Vectorized pois_exact_test over every row of a DataFrame.
+
+    This is the same conditional exact test: given the total number of
+    counts in both populations, sel_counts is binomial with success
+    probability r / (1 + r), where r is ratio_null times the ratio of
+    the totals, so the p-value is a binomial survival function.
+
+    d: DataFrame with columns sel_counts, sel_total, ref_counts, and
+       ref_total.
+    ratio_null: a number, or an array of them to test each row against
+       all of them at once.
+
+    Returns an array of p-values, with a row for each row of d and a
+    column for each value of ratio_null if it is an array.
+    """
+    ratio_null = np.asarray(ratio_null)
+    shape = (len(d),) + (1,) * ratio_null.ndim
+    y1 = d['sel_counts'].to_numpy().reshape(shape)
+    y2 = d['ref_counts'].to_numpy().reshape(shape)
+    r = ratio_null * (d['sel_total'].to_numpy() /
+                      d['ref_total'].to_numpy()).reshape(shape)
+    return scipy.stats.binom.sf(y1 - 1, y1 + y2, r / (1 + r))
+
+def calculate_ER_threshold(d, fdr, size, **kde_options):
     """Given a control experiment, compute an ER threshold that should
     correspond to a given FDR.
 
     d: DataFrame with column 'ER'.
     fdr: Target false detection rate.
     size: Number of variants in the experiment.
+    kde_options: passed on to make_kde.
 
     Returns an ER threshold.
     """
-    er_range = 10 # A big number definitely larger than the ER of interest.
-    p = fdr / size
-    kde = scipy.stats.gaussian_kde(d['ER'])
-    thresh = scipy.optimize.root_scalar(
-        lambda x: kde.integrate_box_1d(-np.inf, x) - (1-p),
-        bracket=[-er_range, er_range]).root
-    # Sanity check that the integration worked.
-    assert abs((1-p) - kde.integrate_box_1d(-np.inf, thresh)) < 1e-10
-    return thresh
-
-def make_FDR_calculator(d, size):
+    return calculate_ER_thresholds(d, [fdr], size, **kde_options)[0]
+
+def calculate_ER_thresholds(d, fdrs, size, **kde_options):
+    """Like calculate_ER_threshold, but for each of a sequence of FDRs,
+    fitting the KDE only once.
+
+    Returns an array of ER thresholds.
+    """
+    return make_FDR_calculator(d, size, **kde_options).ER_thresholds(fdrs)
+
+def make_FDR_calculator(d, size, **kde_options):
     """Given a control experiment, return a function that will compute the
-    FDR for a given ER.
+    FDR for an array of ERs.
 
     d: DataFrame with column 'ER'.
     size: Number of variants in the experiment.
+    kde_options: passed on to make_kde.
 
-    Returns a function.
+    Returns an FDRCalculator.
     """
-    kde = scipy.stats.gaussian_kde(d['ER'])
-    def calculate_FDR(ER, size=size, kde=kde):
-        return size * (1 - kde.integrate_box_1d(-np.inf, ER))
-    return calculate_FDR
+    return FDRCalculator(make_kde(d['ER'], **kde_options), size)
+
+@dataclass(frozen=True, eq=False)
+class FDRCalculator:
+    """Computes FDRs from the KDE of a control tile's ERs and the number
+    of variants in the tile. Unlike a closure, it can be sent to worker
+    processes and cached, and ER thresholds for any FDR can be derived
+    from its KDE without fitting it again."""
+    kde: object
+    size: int
+
+    def __call__(self, ER):
+        return self.size * self.kde.sf(ER)
+
+    def ER_thresholds(self, fdrs):
+        """Return an array of the ER thresholds for a sequence of FDRs."""
+        thresholds = []
+        for fdr in fdrs:
+            p = fdr / self.size
+            thresh = cdf_quantile(self.kde, 1-p)
+            # Sanity check that the integration worked.
+            assert abs((1-p) - self.kde.cdf(thresh)[0]) < 1e-10
+            thresholds.append(thresh)
+        return np.array(thresholds)
+
+# Columns added by read_table that encode each variant as integers:
+# its position (-1 for WT) and the codes (see analysis.aa_nt_dist.AA_INDEX)
+# of its wild type and mutant amino acids. They are left out of the CSV
+# files written by the analysis.
+VARIANT_CODE_COLUMNS = ['position', 'wt_code', 'aa_code']
+
+def parse_variants(variants):
+    """Parse a sequence of distinct variant names such as 'A102W' into
+    arrays of positions (int16) and wild type and mutant amino acid codes
+    (uint8). 'WT' is parsed as a W to T change at position -1, as it
+    was when min_nt_dist was looked up from the first and last letters
+    of each name."""
+    position = np.array([int(v[1:-1]) if v[1:-1] else -1 for v in variants],
+                        dtype=np.int16)
+    wt_code = np.array([AA_INDEX[v[0]] for v in variants], dtype=np.uint8)
+    aa_code = np.array([AA_INDEX[v[-1]] for v in variants], dtype=np.uint8)
+    return position, wt_code, aa_code
 
 def read_table(path):
-    """Read a CSV file generated by the dms code."""
-    d = pd.read_csv(path)
-    d[['tile', 'name']] = d['experiment'].str.split('_', expand=True)
-    d['tile'] = d['tile'].astype(int)
-    d['name'] = 'CC.' + d['name']
+    """Read a CSV file generated by the dms code.
+
+    The experiment and variant names are factorized into categoricals and
+    only parsed once per distinct name, into the tile and name columns
+    and the VARIANT_CODE_COLUMNS, and the counts are read as int32.
+    """
+    d = pd.read_csv(path, dtype={'sel_counts' : np.int32,
+                                 'ref_counts' : np.int32})
+    codes, experiments = pd.factorize(d['experiment'])
+    experiments = [e.split('_', 1) for e in experiments.tolist()]
+    d['tile'] = np.array([int(e[0]) for e in experiments],
+                         dtype=np.int32)[codes]
+    # Experiments of different tiles share names.
+    names, name_codes = np.unique(['CC.' + e[1] for e in experiments],
+                                  return_inverse=True)
+    d['name'] = pd.Categorical.from_codes(name_codes[codes], names)
+    codes, variants = pd.factorize(d['variant'])
+    d['variant'] = pd.Categorical.from_codes(codes, variants)
+    for column, values in zip(VARIANT_CODE_COLUMNS,
+                              parse_variants(variants.tolist())):
+        d[column] = values[codes]
     return d[['name', 'tile', 'variant', 'sel_counts',
-              'sel_total', 'ref_counts', 'ref_total', 'ER']]
+              'sel_total', 'ref_counts', 'ref_total', 'ER'] +
+             VARIANT_CODE_COLUMNS]
 
 def maybe_quoted_string(s):
     if len(s) > 0 and s[0] in ["'", '"']:
@@ -92,75 +171,322 @@ def maybe_quoted_string(s):
 def parse_args_again(args):
     positions = {}
     wt_seq = {}
+    sizes = {}
 
     params, tiles, samples, experiments, proteins = parse_args_and_read_config(args)
 
     for k in tiles.keys():
         t_seq = translate_sequence(tiles[k].wt_seq[tiles[k].cds_start:tiles[k].cds_end])
         positions[int(k[1:])] = [x for x in tiles[k].positions]
+        sizes[int(k[1:])] = library_size(tiles[k])
         for num in range(0, len(t_seq)):
             wt_seq[num + int(tiles[k].first_aa)] = t_seq[num]
 
-    return positions, wt_seq
-
-def parse_analysis(c):
+    return positions, wt_seq, sizes
+
+def kde_method(s):
+    s = maybe_quoted_string(s)
+    if s not in KDE_METHODS:
+        raise argparse.ArgumentTypeError(
+            f'Invalid value: {s}. Must be one of: {", ".join(KDE_METHODS)}.')
+    return s
+
+def hit_column(s):
+    s = maybe_quoted_string(s)
+    if s not in HIT_COLUMNS:
+        raise argparse.ArgumentTypeError(
+            f'Invalid value: {s}. Must be one of: {", ".join(HIT_COLUMNS)}.')
+    return s
+
+def filepaths(s):
+    """Parse one file path or a comma-separated sequence of quoted file
+    paths (one per replicate) into a tuple."""
+    if len(s) > 0 and s[0] in ["'", '"', '(', '[']:
+        paths = ast.literal_eval(s)
+    else:
+        paths = s
+    return (paths,) if isinstance(paths, str) else tuple(paths)
+
+# Options of the [Analysis] section. Options without a default are
+# required.
+ANALYSIS_ARGUMENTS = {
+    # Control file of each replicate.
+    'control_filepath' : {'type' : filepaths},
+    # A single antibody, for configurations without an [Antibodies]
+    # section.
+    'antibody_filepath' : {'type' : filepaths, 'default' : None},
+    'output_title' : {'type' : maybe_quoted_string, 'default' : None},
+    'FDR' : {'type' : float},
+    'significance' : {'type' : float},
+    # Column compared with significance to highlight hits in the
+    # heatmaps: 'pval', or the Benjamini-Hochberg ('qval_bh') or Storey
+    # ('qval_storey') q-values of each tile.
+    'hit_column' : {'type' : hit_column, 'default' : 'pval'},
+    # FDRs and significance cutoffs to tabulate the hits of every
+    # combination of (see sweep_hits).
+    'fdr_sweep' : {'type' : float, 'nargs' : '+', 'default' : None},
+    'significance_sweep' : {'type' : float, 'nargs' : '+', 'default' : None},
+    'use_multiprocessing' : {'type' : yes_or_no, 'default' : True},
+    # Reuse control models and annotated tables from Processed/Cache.
+    'cache' : {'type' : yes_or_no, 'default' : True},
+    # 'exact' or 'binned' (see analysis.kde.make_kde).
+    'kde_method' : {'type' : kde_method, 'default' : 'exact'},
+    # Number of grid points of binned KDEs.
+    'kde_grid_size' : {'type' : bounded_number(int, low=16),
+                       'default' : 2048},
+}
+
+def parse_analysis_args(argv, arguments=ANALYSIS_ARGUMENTS):
+    """Parse the [Analysis] options given on the command line, e.g.
+    --fdr-sweep 0.1 1 5.
+
+    Returns a tuple (namespace, remaining_argv) where namespace only has
+    the options that were given.
+    """
+    parser = argparse.ArgumentParser(allow_abbrev=False,
+                                     argument_default=argparse.SUPPRESS)
+    for name, arg in arguments.items():
+        kwargs = {k : v for (k, v) in arg.items() if k in ['type', 'nargs']}
+        parser.add_argument(f'--{name.replace("_", "-")}', **kwargs)
+    return parser.parse_known_args(argv)
+
+def parse_analysis(c, arguments=ANALYSIS_ARGUMENTS, overrides=None):
+    """Parse the [Analysis] section of a config into a namespace.
+
+    overrides: namespace of options from parse_analysis_args, which take
+    precedence over the config.
+    """
     if not c.has_section('Analysis'):
         raise argparse.ArgumentTypeError('config does not have a [Analysis]'
                                          ' section.')
 
+    analysis = argparse.Namespace(**{name : arg['default']
+                                     for (name, arg) in arguments.items()
+                                     if 'default' in arg})
     for name, value in c.items('Analysis'):
-        if name == 'control_filepath': c = maybe_quoted_string(value)
-        if name == 'antibody_filepath': a = maybe_quoted_string(value)
-        if name == 'FDR': f = float(value)
-        if name == 'significance': s = float(value)
-        if name == 'output_title': o = maybe_quoted_string(value)
+        if name not in arguments:
+            raise ValueError(f'unknown option: {name}')
+        try:
+            if arguments[name].get('nargs') in ['+', '*']:
+                value = [arguments[name]['type'](x) for x in value.split()]
+            else:
+                value = arguments[name]['type'](value)
+        except argparse.ArgumentTypeError as e:
+            print(f'Invalid value for option {name}: {value}')
+            raise e
+        setattr(analysis, name, value)
+    if overrides is not None:
+        vars(analysis).update(vars(overrides))
+    for name in arguments:
+        if not hasattr(analysis, name):
+            raise ValueError(f'[Analysis] does not specify {name}.')
+
+    return analysis
+
+ANTIBODIES_NAME = 'Antibodies'
+
+def parse_antibodies(c, analysis):
+    """Return a dict mapping output title to the tuple of files of each
+    antibody, one per replicate in the same order as the control files.
+
+    Antibodies are listed in the [Antibodies] section as e.g.
+    `12-1: 'rep1/CC12.1.csv', 'rep2/CC12.1.csv'`, and the
+    antibody_filepath and output_title options of [Analysis] add one
+    more.
+    """
+    antibodies = {}
+    if c.has_section(ANTIBODIES_NAME):
+        for title, value in c.items(ANTIBODIES_NAME):
+            antibodies[title] = filepaths(value)
+    if analysis.antibody_filepath is not None:
+        if analysis.output_title is None:
+            raise ValueError('[Analysis] specifies antibody_filepath but not'
+                             ' output_title.')
+        antibodies[analysis.output_title] = analysis.antibody_filepath
+    if len(antibodies) == 0:
+        raise ValueError('config does not specify any antibodies.')
+    n_replicates = len(analysis.control_filepath)
+    for title, files in antibodies.items():
+        if len(files) != n_replicates:
+            raise ValueError(f'antibody {title} has {len(files)} files but'
+                             f' there are {n_replicates} control files.')
+    return antibodies
+
+def annotated_table(a_file, rep, thresholds, FDR_calcs):
+    """Read the table of one replicate of an antibody and add the
+    min_nt_dist, ER_thresh, pval, qval_bh, qval_storey and FDR columns
+    for each tile. The q-values correct each tile's p-values for
+    multiple testing."""
+    dfs = []
+    for tile, d in read_table(a_file).groupby('tile'):
+        d = d.copy()
+        d['min_nt_dist'] = MIN_NT_DIST_MATRIX[d['wt_code'], d['aa_code']]
+        ER_thresh = thresholds[rep, tile]
+        d['ER_thresh'] = ER_thresh
+        ratio = 2**ER_thresh
+        pvals = pois_exact_tests(d, ratio_null=ratio)
+        d['pval'] = pvals
+        for column, qvalues in QVALUE_FUNCTIONS.items():
+            d[column] = qvalues(pvals)
+        d['FDR'] = FDR_calcs[rep, tile](d['ER'])
+        dfs.append(d)
+    return pd.concat(dfs) if dfs else None
+
+def analyze_antibody(title, files, thresholds, FDR_calcs, models_key,
+                     significance, hit_column, prd, all_positions, wt_seq):
+    """Test every variant of one antibody against the control thresholds
+    and write a CSV file and heatmap for each of its replicates.
+
+    files: the antibody's file for each replicate.
+    thresholds, FDR_calcs: the ER threshold and FDR calculator of each
+    (replicate, tile) of the control.
+    models_key: the cache key of the control models (see
+    analysis.cache.control_key), or None to not use the cache.
+    hit_column: the column compared with significance to call hits.
+    """
+    for rep, a_file in enumerate(files, 1):
+        if not os.path.exists(a_file):
+            continue
+        out = title if len(files) == 1 else f'{title}_rep{rep}'
+        d = None
+        if models_key is not None:
+            key = antibody_key(models_key, a_file)
+            d = read_cache(prd, antibody_cache_name(out), key)
+        if d is None:
+            d = annotated_table(a_file, rep, thresholds, FDR_calcs)
+            if models_key is not None:
+                write_cache(prd, antibody_cache_name(out), key, d)
+        if d is None: continue
+        d.drop(columns=VARIANT_CODE_COLUMNS)\
+         .to_csv(os.path.join(prd, f'{out}.csv'), index=False)
+        write_heatmap(os.path.join(prd, f'{out}_heatmap.xlsx'),
+                      wt_seq, all_positions, [d], 'ER', significance,
+                      hit_column=hit_column)
+
+def sweep_hits(d, fdrs, significances, thresholds, hit_column='pval'):
+    """Tabulate the hits of one replicate of an antibody for every
+    combination of FDR and significance cutoff.
 
-    return c, a, f, s, o
+    d: table of the replicate as returned by read_table.
+    thresholds: dict mapping each tile to an array of its ER thresholds
+    for fdrs (see calculate_ER_thresholds).
+    hit_column: the column compared with the significance cutoffs, as in
+    the heatmaps. q-values are computed per tile and FDR.
 
-def perform_analysis(c_file, a_file, fdr, significance, out, sizes, prd, all_positions, wt_seq):
-    Abs = ['nAb']
-    tiles = [1, 2, 3, 4, 5, 6, 7, 8]
-    replicates = [1]
+    The p-values of each tile's variants are computed against all of its
+    thresholds in one vectorized call.
+
+    Returns a DataFrame with a row per (FDR, significance) combination,
+    giving the number of hits and their variants separated by spaces.
+    """
+    values = []
+    variants = []
+    for tile, group in d.groupby('tile'):
+        values.append(hit_values(
+            pois_exact_tests(group, ratio_null=2**thresholds[tile]),
+            hit_column))
+        variants.append(group['variant'].to_numpy())
+    values = np.concatenate(values)
+    variants = np.concatenate(variants)
+    rows = []
+    for (i, fdr), significance in it.product(enumerate(fdrs), significances):
+        hits = variants[values[:, i] <= significance]
+        rows.append({'FDR' : fdr, 'significance' : significance,
+                     'hits' : len(hits), 'variants' : ' '.join(hits)})
+    return pd.DataFrame(rows)
+
+def write_sweeps(analysis, antibodies, FDR_calcs, prd):
+    """Write Processed/<title>_sweep.csv for each antibody replicate
+    (see sweep_hits), computing each control tile's threshold curve over
+    analysis.fdr_sweep once from the KDE of its FDR calculator (see
+    fit_control_models). Whichever of the FDR and significance isn't
+    swept keeps its usual value."""
+    fdrs = analysis.fdr_sweep or [analysis.FDR]
+    significances = analysis.significance_sweep or [analysis.significance]
+    for rep in range(1, len(analysis.control_filepath) + 1):
+        thresholds = {tile : FDR_calc.ER_thresholds(fdrs)
+                      for ((r, tile), FDR_calc) in FDR_calcs.items()
+                      if r == rep}
+        for title, files in antibodies.items():
+            if not os.path.exists(files[rep - 1]):
+                continue
+            out = title if len(files) == 1 else f'{title}_rep{rep}'
+            d = read_table(files[rep - 1])
+            sweep_hits(d, fdrs, significances, thresholds,
+                       analysis.hit_column)\
+                .to_csv(os.path.join(prd, f'{out}_sweep.csv'), index=False)
+
+def fit_tile_model(d, fdr, size, kde_options):
+    """Return the ER threshold and FDR calculator of one (replicate,
+    tile) of the control, both from a single KDE fit."""
+    FDR_calc = make_FDR_calculator(d, size, **kde_options)
+    return FDR_calc.ER_thresholds([fdr])[0], FDR_calc
+
+def fit_control_models(analysis, sizes):
+    """Return dicts (thresholds, FDR_calcs) mapping each (replicate,
+    tile) of the control to its ER threshold and FDR calculator.
+
+    The (replicate, tile)s are fitted in parallel if
+    analysis.use_multiprocessing is set. Only their ERs are sent to the
+    worker processes, and the results come back in the same order.
+    """
+    kde_options = dict(method=analysis.kde_method,
+                       grid_size=analysis.kde_grid_size)
 
     control = \
-        {(rep, tile) : group
+        {(rep, tile) : group[['ER']]
          for (rep, d) in [(rep, read_table(c_file))
-                          for rep in replicates]
-         for (tile, group) in d.groupby('tile')}
-
-    data = \
-        {(Ab, rep, tile) : group
-         for ((Ab, rep), d) in [((Ab, rep),
-                                 read_table(a_file))
-                                for (Ab, rep) in it.product(Abs, replicates)
-                                if os.path.exists(a_file)]
+                          for (rep, c_file)
+                          in enumerate(analysis.control_filepath, 1)]
          for (tile, group) in d.groupby('tile')}
 
-    thresholds = {(rep, tile) : calculate_ER_threshold(d, fdr, sizes[tile])
-                  for ((rep, tile), d) in control.items()}
-
-    FDR_calcs = {(rep, tile) : make_FDR_calculator(d, sizes[tile])
-                 for ((rep, tile), d) in control.items()}
+    tasks = [(d, analysis.FDR, sizes[tile], kde_options)
+             for ((rep, tile), d) in control.items()]
+    if analysis.use_multiprocessing and len(tasks) > 1:
+        with multiprocessing.Pool(min(len(tasks), os.cpu_count() or 1)) as pool:
+            models = pool.starmap(fit_tile_model, tasks)
+    else:
+        models = [fit_tile_model(*task) for task in tasks]
 
+    thresholds = {k : threshold
+                  for (k, (threshold, _)) in zip(control, models)}
+    FDR_calcs = {k : FDR_calc for (k, (_, FDR_calc)) in zip(control, models)}
 
-    for (Ab, rep, tile), d in data.items():
-        d['min_nt_dist'] = d['variant'].apply(variant_min_nt_dist)
-        ER_thresh = thresholds[rep, tile]
-        d['ER_thresh'] = ER_thresh
-        ratio = 2**ER_thresh
-        d['pval'] = d.apply(pois_exact_test, axis=1, ratio_null=ratio)
-        d['FDR'] = d['ER'].apply(FDR_calcs[rep, tile])
+    return thresholds, FDR_calcs
 
+def perform_analysis(analysis, antibodies, sizes, prd, all_positions, wt_seq):
+    """Analyze every antibody against the shared control.
 
-    for Ab, rep in it.product(Abs, replicates):
-        dfs = [data[Ab, rep, tile]
-               for tile in tiles
-               if (Ab, rep, tile) in data]
-        if len(dfs) == 0: continue
-        d = pd.concat(dfs)
-        d.to_csv(os.path.join(prd, f'{out}.csv'), index=False)
-        write_heatmap(os.path.join(prd, f'{out}_heatmap.xlsx'),
-                      wt_seq, all_positions, [d], 'ER', significance)
+    The control's ER thresholds and FDR calculators are computed once
+    per (replicate, tile), and both these fits and the antibodies are
+    processed in parallel if analysis.use_multiprocessing is set. If
+    analysis.cache is set, the control models and the antibodies'
+    annotated tables are cached in prd (see analysis.cache) and reused
+    while their inputs are unchanged.
+    """
+    models_key = control_key(analysis, sizes) if analysis.cache else None
+    models = None
+    if models_key is not None:
+        models = read_cache(prd, CONTROL_CACHE_NAME, models_key)
+    if models is None:
+        models = fit_control_models(analysis, sizes)
+        if models_key is not None:
+            write_cache(prd, CONTROL_CACHE_NAME, models_key, models)
+    thresholds, FDR_calcs = models
+
+    if analysis.fdr_sweep or analysis.significance_sweep:
+        write_sweeps(analysis, antibodies, FDR_calcs, prd)
+
+    tasks = [(title, files, thresholds, FDR_calcs, models_key,
+              analysis.significance, analysis.hit_column, prd,
+              all_positions, wt_seq)
+             for (title, files) in antibodies.items()]
+    if analysis.use_multiprocessing and len(tasks) > 1:
+        with multiprocessing.Pool() as pool:
+            pool.starmap(analyze_antibody, tasks)
+    else:
+        for task in tasks:
+            analyze_antibody(*task)
 
 def main(argv):
     if not os.path.exists('Processed'):
@@ -173,18 +499,19 @@ def main(argv):
     current_directory = os.getcwd()
     processed_directory = os.path.join(current_directory, 'Processed')
 
-    positions, wt_seq = parse_args_again(argv)
-    all_positions = sorted(it.chain(*positions.values()))
+    overrides, remaining_argv = parse_analysis_args(argv[2:])
 
-    # Library sizes for each tile. The libraries are NNKs that target all
-    # 20 mutations (19 AA mutations and a stop) at each position.
-    sizes = {tile : 20 * len(pos) for (tile, pos) in positions.items()}
+    # Library sizes for each tile come from the tiles' codon schemes.
+    positions, wt_seq, sizes = parse_args_again(argv[:2] + remaining_argv)
+    all_positions = sorted(it.chain(*positions.values()))
 
     config = configparser.ConfigParser(strict=True)
     config.optionxform = str # make the parser case-sensitive
     config.read(argv[1])
-    c_file, a_file, fdr, significance, out = parse_analysis(config)
+    analysis = parse_analysis(config, overrides=overrides)
+    antibodies = parse_antibodies(config, analysis)
 
-    perform_analysis(c_file, a_file, fdr, significance, out, sizes, processed_directory, all_positions, wt_seq)
+    perform_analysis(analysis, antibodies, sizes, processed_directory,
+                     all_positions, wt_seq)
 
     return
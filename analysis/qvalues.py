@@ -0,0 +1,64 @@
+import numpy as np
+
+# Columns of q-values added to the annotated tables, and the columns
+# that can be used to call hits (see write_heatmap).
+QVALUE_COLUMNS = ('qval_bh', 'qval_storey')
+HIT_COLUMNS = ('pval',) + QVALUE_COLUMNS
+
+def bh_qvalues(pvals, pi0=1.0):
+    """Return the Benjamini-Hochberg q-values of an array of p-values,
+    i.e. the smallest FDR at which each test would be called, scaled by
+    pi0, the estimated proportion of true null hypotheses.
+
+    The p-values are sorted once and the running minimum of
+    pi0 * p * m / rank is taken from the largest p-value down. NaN
+    p-values get NaN q-values and don't count towards m.
+    """
+    pvals = np.asarray(pvals, dtype=float)
+    qvals = np.full(pvals.shape, np.nan)
+    valid = ~np.isnan(pvals)
+    p = pvals[valid]
+    m = len(p)
+    if m == 0:
+        return qvals
+    order = np.argsort(p)
+    q = pi0 * p[order] * m / np.arange(1, m + 1)
+    q = np.minimum.accumulate(q[::-1])[::-1]
+    valid_qvals = np.empty(m)
+    valid_qvals[order] = np.minimum(q, 1)
+    qvals[valid] = valid_qvals
+    return qvals
+
+def storey_pi0(pvals, lam=0.5):
+    """Estimate the proportion of true null hypotheses among an array of
+    p-values from the density of p-values above lam relative to a
+    uniform distribution (Storey 2002), capped at 1.
+
+    One is added to the number of p-values above lam so that the
+    estimate is never 0, which would make every q-value 0.
+    """
+    p = np.asarray(pvals, dtype=float)
+    p = p[~np.isnan(p)]
+    if len(p) == 0:
+        return 1.0
+    return float(min(1.0, (np.count_nonzero(p > lam) + 1) /
+                          (len(p) * (1 - lam))))
+
+def storey_qvalues(pvals, lam=0.5):
+    """Return Storey's q-values of an array of p-values: the
+    Benjamini-Hochberg q-values scaled by storey_pi0(pvals, lam)."""
+    return bh_qvalues(pvals, pi0=storey_pi0(pvals, lam))
+
+# Functions computing the q-value columns from an array of p-values.
+QVALUE_FUNCTIONS = {'qval_bh' : bh_qvalues, 'qval_storey' : storey_qvalues}
+
+def hit_values(pvals, hit_column):
+    """Return the values of hit_column (see HIT_COLUMNS) for an array of
+    p-values of one tile, or for each column of a 2D array of them."""
+    if hit_column == 'pval':
+        return pvals
+    qvalues = QVALUE_FUNCTIONS[hit_column]
+    if np.ndim(pvals) == 1:
+        return qvalues(pvals)
+    return np.column_stack([qvalues(pvals[:, i])
+                            for i in range(pvals.shape[1])])
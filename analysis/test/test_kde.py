@@ -0,0 +1,91 @@
+import unittest
+
+import mock
+import numpy as np
+import pandas as pd
+import scipy.optimize
+import scipy.stats
+
+from analysis.kde import cdf_quantile, make_kde
+from analysis.main import (calculate_ER_threshold, fit_tile_model,
+                           make_FDR_calculator)
+
+def root_scalar_threshold(ers, fdr, size):
+    """The ER threshold as it was computed before cdf_quantile, with
+    gaussian_kde and root_scalar."""
+    kde = scipy.stats.gaussian_kde(ers)
+    return scipy.optimize.root_scalar(
+        lambda x: kde.integrate_box_1d(-np.inf, x) - (1 - fdr / size),
+        bracket=[-10, 10]).root
+
+class TestKDE(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.ers = np.concatenate([rng.normal(0, 0.5, 400),
+                                   rng.normal(1.5, 0.3, 100)])
+        self.x = np.linspace(-3, 4, 200)
+
+    def testing_cdf(self):
+        kde = make_kde(self.ers)
+        reference = scipy.stats.gaussian_kde(self.ers)
+        expected = [reference.integrate_box_1d(-np.inf, x) for x in self.x]
+        self.assertTrue(np.allclose(kde.cdf(self.x), expected, rtol=0,
+                                    atol=1e-12))
+        self.assertTrue(np.allclose(kde.sf(self.x), 1 - np.array(expected),
+                                    rtol=0, atol=1e-12))
+
+    def testing_ER_threshold(self):
+        d = pd.DataFrame({'ER' : self.ers})
+        for fdr, size in [(0.1, 6000), (1, 500), (5, 6000)]:
+            self.assertAlmostEqual(calculate_ER_threshold(d, fdr, size),
+                                   root_scalar_threshold(self.ers, fdr, size),
+                                   delta=1e-9)
+
+    def testing_FDR_calculator(self):
+        d = pd.DataFrame({'ER' : self.ers})
+        reference = scipy.stats.gaussian_kde(self.ers)
+        expected = [6000 * (1 - reference.integrate_box_1d(-np.inf, x))
+                    for x in self.x]
+        self.assertTrue(np.allclose(make_FDR_calculator(d, 6000)(self.x),
+                                    expected, rtol=1e-9, atol=1e-9))
+
+    def testing_fit_tile_model(self):
+        # The threshold and FDR calculator share one KDE fit.
+        d = pd.DataFrame({'ER' : self.ers})
+        with mock.patch('analysis.main.make_kde', wraps=make_kde) as fit:
+            threshold, FDR_calc = fit_tile_model(d, 0.1, 6000, {})
+        self.assertEqual(fit.call_count, 1)
+        self.assertEqual(threshold, calculate_ER_threshold(d, 0.1, 6000))
+        self.assertAlmostEqual(FDR_calc(np.array([threshold]))[0], 0.1,
+                               delta=1e-9)
+
+    def testing_quantile_near_one(self):
+        kde = make_kde(self.ers)
+        low, high = kde.span()
+        for q in [1 - 1e-6, 1 - 1e-10, 1 - 1e-13]:
+            x = cdf_quantile(kde, q)
+            self.assertTrue(low <= x <= high)
+            self.assertAlmostEqual(kde.cdf(x)[0], q, delta=1e-14)
+
+class TestBinnedKDE(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.ers = np.concatenate([rng.normal(0, 0.5, 4000),
+                                   rng.normal(1.5, 0.3, 1000)])
+
+    def testing_accuracy(self):
+        # At the default grid size the binned KDE is within about 2e-6
+        # of the exact CDF and its thresholds within about 3e-5.
+        exact = make_kde(self.ers)
+        binned = make_kde(self.ers, 'binned')
+        x = np.linspace(*exact.span(), 2000)
+        self.assertLess(np.abs(exact.cdf(x) - binned.cdf(x)).max(), 5e-6)
+        self.assertLess(np.abs(exact.sf(x) - binned.sf(x)).max(), 5e-6)
+        d = pd.DataFrame({'ER' : self.ers})
+        for fdr in [0.1, 1, 5]:
+            self.assertAlmostEqual(
+                calculate_ER_threshold(d, fdr, 6000, method='binned'),
+                calculate_ER_threshold(d, fdr, 6000), delta=1e-4)
+
+if __name__ == '__main__':
+    unittest.main()
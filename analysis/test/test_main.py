@@ -0,0 +1,367 @@
+import configparser
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from analysis.aa_nt_dist import MIN_NT_DIST_MATRIX, min_nt_dist
+from analysis.cache import (CONTROL_CACHE_NAME, antibody_cache_name,
+                            antibody_key, control_key, read_cache)
+from analysis.heatmap import variant_lookup
+from analysis.main import (annotated_table, calculate_ER_thresholds,
+                           fit_control_models, parse_analysis,
+                           parse_analysis_args, parse_antibodies,
+                           parse_variants, perform_analysis, pois_exact_test,
+                           pois_exact_tests, read_table, sweep_hits,
+                           VARIANT_CODE_COLUMNS, write_sweeps)
+
+def random_counts(n, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'sel_counts' : rng.integers(0, 200, n),
+                         'sel_total' : rng.integers(10**4, 10**6, n),
+                         'ref_counts' : rng.integers(1, 200, n),
+                         'ref_total' : rng.integers(10**4, 10**6, n)})
+
+class TestPoisExactTests(unittest.TestCase):
+    def setUp(self):
+        self.d = random_counts(300, seed=0)
+
+    def testing_scalar_ratio(self):
+        for ratio in [1, 2.5, 0.3]:
+            expected = [pois_exact_test(row, ratio_null=ratio)
+                        for row in self.d.itertuples()]
+            self.assertTrue(np.allclose(pois_exact_tests(self.d, ratio),
+                                        expected, rtol=0, atol=1e-12))
+
+    def testing_array_ratio(self):
+        ratios = np.array([0.5, 1, 4])
+        pvals = pois_exact_tests(self.d, ratio_null=ratios)
+        self.assertEqual(pvals.shape, (len(self.d), len(ratios)))
+        for j, ratio in enumerate(ratios):
+            expected = [pois_exact_test(row, ratio_null=ratio)
+                        for row in self.d.itertuples()]
+            self.assertTrue(np.allclose(pvals[:, j], expected, rtol=0,
+                                        atol=1e-12))
+
+class TestReadTable(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'counts.csv')
+        pd.DataFrame({'experiment' : ['1_x', '1_x', '2_x', '2_x'],
+                      'variant' : ['WT', 'L3P', 'T40N', 'M41*'],
+                      'sel_counts' : [10, 20, 30, 40],
+                      'sel_total' : 1000, 'ref_counts' : [5, 6, 7, 8],
+                      'ref_total' : 2000,
+                      'ER' : [0.1, 0.2, 0.3, 0.4]}).to_csv(self.path,
+                                                           index=False)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testing_parse_variants(self):
+        position, wt_code, aa_code = parse_variants(['A102W', 'WT', 'K7*'])
+        self.assertEqual(list(position), [102, -1, 7])
+        self.assertEqual(position.dtype, np.int16)
+        self.assertEqual(wt_code.dtype, np.uint8)
+        self.assertEqual(list(MIN_NT_DIST_MATRIX[wt_code, aa_code]),
+                         [min_nt_dist('A', 'W'), min_nt_dist('W', 'T'),
+                          min_nt_dist('K', '*')])
+
+    def testing_read_table(self):
+        d = read_table(self.path)
+        self.assertEqual(list(d['tile']), [1, 1, 2, 2])
+        self.assertEqual(d['tile'].dtype, np.int32)
+        self.assertEqual(d['sel_counts'].dtype, np.int32)
+        self.assertEqual(list(d['name'].astype(str)), ['CC.x'] * 4)
+        self.assertEqual(list(d['variant'].astype(str)),
+                         ['WT', 'L3P', 'T40N', 'M41*'])
+        self.assertEqual(list(d['position']), [-1, 3, 40, 41])
+        self.assertEqual(d.columns[-len(VARIANT_CODE_COLUMNS):].tolist(),
+                         VARIANT_CODE_COLUMNS)
+        self.assertEqual(list(MIN_NT_DIST_MATRIX[d['wt_code'], d['aa_code']]),
+                         [min_nt_dist(v[0], v[-1])
+                          for v in ['WT', 'L3P', 'T40N', 'M41*']])
+
+    def testing_variant_lookup(self):
+        d = read_table(self.path)
+        d['pval'] = [0.5, 0.01, 0.2, 0.3]
+        lookup = variant_lookup(d)
+        self.assertEqual(lookup['L3P'], (0.2, 0.01))
+        self.assertNotIn('A3P', lookup)
+        # Repeated variants are marked so that the heatmap rejects them.
+        self.assertIsNone(variant_lookup(pd.concat([d, d]))['L3P'])
+
+def read_config(s):
+    c = configparser.ConfigParser(strict=True)
+    c.optionxform = str
+    c.read_string(s)
+    return c
+
+ANALYSIS = """
+[Analysis]
+control_filepath: 'c1.csv', 'c2.csv'
+FDR: 0.1
+significance: 0.05
+"""
+
+class TestParseAnalysis(unittest.TestCase):
+    def testing_replicates(self):
+        c = read_config(ANALYSIS + """
+use_multiprocessing: no
+[Antibodies]
+12-1: 'a1.csv', 'a2.csv'
+12-2: 'b1.csv', 'b2.csv'
+""")
+        analysis = parse_analysis(c)
+        self.assertEqual(analysis.control_filepath, ('c1.csv', 'c2.csv'))
+        self.assertFalse(analysis.use_multiprocessing)
+        self.assertEqual(analysis.kde_method, 'exact')
+        self.assertEqual(parse_antibodies(c, analysis),
+                         {'12-1' : ('a1.csv', 'a2.csv'),
+                          '12-2' : ('b1.csv', 'b2.csv')})
+
+    def testing_single_antibody(self):
+        c = read_config("""
+[Analysis]
+control_filepath: 'c.csv'
+antibody_filepath: 'a.csv'
+output_title: 'CC12.1'
+FDR: 0.1
+significance: 0.05
+""")
+        analysis = parse_analysis(c)
+        self.assertEqual(analysis.control_filepath, ('c.csv',))
+        self.assertEqual(parse_antibodies(c, analysis),
+                         {'CC12.1' : ('a.csv',)})
+
+    def testing_errors(self):
+        c = read_config(ANALYSIS + """
+[Antibodies]
+12-1: 'a1.csv'
+""")
+        with self.assertRaises(ValueError):
+            parse_antibodies(c, parse_analysis(c))
+        c = read_config(ANALYSIS + "antibody_filepath: 'a1.csv', 'a2.csv'\n")
+        with self.assertRaises(ValueError):
+            parse_antibodies(c, parse_analysis(c))
+        c = read_config(ANALYSIS)
+        with self.assertRaises(ValueError):
+            parse_antibodies(c, parse_analysis(c))
+        with self.assertRaises(ValueError):
+            parse_analysis(read_config(ANALYSIS + 'unknown: 1\n'))
+        with self.assertRaises(ValueError):
+            parse_analysis(read_config('[Analysis]\nFDR: 0.1\n'))
+
+    def testing_command_line(self):
+        overrides, argv = parse_analysis_args(
+            ['--fdr-sweep', '0.1', '1', '--other', 'x'])
+        self.assertEqual(argv, ['--other', 'x'])
+        analysis = parse_analysis(read_config(ANALYSIS + """
+fdr_sweep: 5
+significance_sweep: 0.01 0.05
+"""), overrides=overrides)
+        self.assertEqual(analysis.fdr_sweep, [0.1, 1])
+        self.assertEqual(analysis.significance_sweep, [0.01, 0.05])
+
+def write_counts(path, seed, shift=0):
+    rng = np.random.default_rng(seed)
+    n = 200
+    ref_counts = rng.integers(50, 150, n)
+    ER = rng.normal(0, 0.3, n)
+    # The first tenth of each tile's variants are enriched by shift.
+    ER[(np.arange(n) % (n // 2)) < n // 20] += shift
+    sel_counts = rng.poisson(ref_counts * 2.0**ER)
+    pd.DataFrame({'experiment' : np.repeat(['1_x', '2_x'], n // 2),
+                  'variant' : [f'A{i}W' for i in range(1, n + 1)],
+                  'sel_counts' : sel_counts, 'sel_total' : 10**5,
+                  'ref_counts' : ref_counts, 'ref_total' : 10**5,
+                  'ER' : np.log2(np.maximum(sel_counts, 1) / ref_counts)})\
+      .to_csv(path, index=False)
+
+SIZES = {1 : 2000, 2 : 2000}
+
+class TestPerformAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        for rep in [1, 2]:
+            write_counts(os.path.join(self.dir.name, f'c{rep}.csv'), rep)
+            write_counts(os.path.join(self.dir.name, f'a{rep}.csv'), 10 + rep,
+                         shift=3)
+        self.wt_seq = {i : 'A' for i in range(1, 201)}
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def analyze(self, config):
+        c = read_config(config)
+        analysis = parse_analysis(c)
+        perform_analysis(analysis, parse_antibodies(c, analysis), SIZES,
+                         self.dir.name, list(range(1, 201)), self.wt_seq)
+        return analysis
+
+    def testing_single_antibody(self):
+        d = self.dir.name
+        self.analyze(f"""
+[Analysis]
+control_filepath: '{d}/c1.csv'
+antibody_filepath: '{d}/a1.csv'
+output_title: 'A'
+FDR: 0.1
+significance: 0.05
+use_multiprocessing: no
+cache: no
+""")
+        out = pd.read_csv(os.path.join(d, 'A.csv'))
+        self.assertEqual(len(out), 200)
+        self.assertFalse(set(VARIANT_CODE_COLUMNS) & set(out.columns))
+        self.assertTrue((out['qval_bh'] >= out['pval']).all())
+        # The enriched variants are the hits.
+        self.assertEqual(list(out.loc[out['pval'] <= 0.05, 'variant']),
+                         [f'A{i}W' for i in [*range(1, 11), *range(101, 111)]])
+        self.assertTrue(os.path.exists(os.path.join(d, 'A_heatmap.xlsx')))
+
+    def testing_replicates(self):
+        d = self.dir.name
+        self.analyze(f"""
+[Analysis]
+control_filepath: '{d}/c1.csv', '{d}/c2.csv'
+FDR: 0.1
+significance: 0.05
+use_multiprocessing: no
+cache: no
+[Antibodies]
+A: '{d}/a1.csv', '{d}/a2.csv'
+""")
+        for rep in [1, 2]:
+            self.assertTrue(os.path.exists(os.path.join(d, f'A_rep{rep}.csv')))
+
+    def testing_cache(self):
+        d = self.dir.name
+        config = f"""
+[Analysis]
+control_filepath: '{d}/c1.csv'
+antibody_filepath: '{d}/a1.csv'
+output_title: 'A'
+FDR: 0.1
+significance: 0.05
+use_multiprocessing: no
+"""
+        analysis = self.analyze(config)
+        models_key = control_key(analysis, SIZES)
+        models = read_cache(d, CONTROL_CACHE_NAME, models_key)
+        self.assertIsNotNone(models)
+        table = read_cache(d, antibody_cache_name('A'),
+                           antibody_key(models_key, f'{d}/a1.csv'))
+        first = pd.read_csv(os.path.join(d, 'A.csv'))
+        self.assertEqual(len(table), len(first))
+        # A rerun reuses the cache and writes the same output, while a
+        # changed antibody file is annotated again.
+        self.analyze(config)
+        pd.testing.assert_frame_equal(pd.read_csv(os.path.join(d, 'A.csv')),
+                                      first)
+        write_counts(os.path.join(d, 'a1.csv'), 20, shift=3)
+        self.assertIsNone(read_cache(d, antibody_cache_name('A'),
+                                     antibody_key(models_key,
+                                                  f'{d}/a1.csv')))
+
+    def testing_write_sweeps(self):
+        d = self.dir.name
+        analysis = parse_analysis(read_config(f"""
+[Analysis]
+control_filepath: '{d}/c1.csv', '{d}/c2.csv'
+FDR: 0.1
+significance: 0.05
+fdr_sweep: 0.1 1
+significance_sweep: 0.05 0.99
+use_multiprocessing: no
+"""))
+        antibodies = {'A' : (f'{d}/a1.csv', f'{d}/a2.csv')}
+        models = fit_control_models(analysis, SIZES)
+        # The thresholds come from the fitted models, without reading
+        # the control files again.
+        for rep in [1, 2]:
+            os.rename(f'{d}/c{rep}.csv', f'{d}/c{rep}.moved')
+        write_sweeps(analysis, antibodies, models[1], d)
+        sweep = pd.read_csv(os.path.join(d, 'A_rep1_sweep.csv'))
+        self.assertEqual(list(zip(sweep['FDR'], sweep['significance'])),
+                         [(0.1, 0.05), (0.1, 0.99), (1, 0.05), (1, 0.99)])
+        self.assertEqual(list(sweep['hits']),
+                         [len(v.split()) for v in sweep['variants']])
+        # The row of the configured FDR and significance gives the hits
+        # of the usual analysis.
+        table = annotated_table(f'{d}/a1.csv', 1, *models)
+        self.assertEqual(sweep['variants'][0].split(),
+                         list(table.loc[table['pval'] <= 0.05, 'variant']))
+        self.assertEqual(models[1][1, 1].ER_thresholds([0.1])[0],
+                         models[0][1, 1])
+        self.assertTrue(os.path.exists(os.path.join(d, 'A_rep2_sweep.csv')))
+
+    def testing_parallel_fit(self):
+        # Fitting the (replicate, tile)s in worker processes gives the
+        # same models, in the same order, as fitting them one by one.
+        d = self.dir.name
+        config = f"""
+[Analysis]
+control_filepath: '{d}/c1.csv', '{d}/c2.csv'
+FDR: 0.1
+significance: 0.05
+use_multiprocessing: %s
+"""
+        serial = fit_control_models(parse_analysis(read_config(config % 'no')),
+                                    SIZES)
+        parallel = fit_control_models(
+            parse_analysis(read_config(config % 'yes')), SIZES)
+        x = np.linspace(-2, 4, 50)
+        for s, p in zip(serial, parallel):
+            self.assertEqual(list(s), [(1, 1), (1, 2), (2, 1), (2, 2)])
+            self.assertEqual(list(s), list(p))
+        for k in serial[0]:
+            self.assertEqual(serial[0][k], parallel[0][k])
+            self.assertTrue(np.array_equal(serial[1][k](x), parallel[1][k](x)))
+
+    def testing_cache_names(self):
+        # An antibody titled 'control' must not replace the cached
+        # control models.
+        d = self.dir.name
+        config = f"""
+[Analysis]
+control_filepath: '{d}/c1.csv'
+FDR: 0.1
+significance: 0.05
+use_multiprocessing: no
+[Antibodies]
+control: '{d}/a1.csv'
+"""
+        analysis = self.analyze(config)
+        models = read_cache(d, CONTROL_CACHE_NAME,
+                            control_key(analysis, SIZES))
+        self.assertIsNotNone(models)
+
+    def testing_sweep_hit_column(self):
+        # The sweep calls the same hits as the annotated table for the
+        # selected hit column.
+        d = self.dir.name
+        analysis = parse_analysis(read_config(f"""
+[Analysis]
+control_filepath: '{d}/c1.csv'
+FDR: 0.1
+significance: 0.05
+use_multiprocessing: no
+"""))
+        table = annotated_table(f'{d}/a1.csv', 1,
+                                *fit_control_models(analysis, SIZES))
+        thresholds = {tile : calculate_ER_thresholds(group, [0.1],
+                                                     SIZES[tile])
+                      for (tile, group)
+                      in read_table(f'{d}/c1.csv').groupby('tile')}
+        for column in ['pval', 'qval_bh', 'qval_storey']:
+            sweep = sweep_hits(read_table(f'{d}/a1.csv'), [0.1], [0.05, 0.99],
+                               thresholds, column)
+            self.assertEqual(list(sweep['hits']),
+                             [(table[column] <= 0.05).sum(),
+                              (table[column] <= 0.99).sum()])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+from statsmodels.stats.multitest import multipletests
+
+from analysis.qvalues import (bh_qvalues, hit_values, storey_pi0,
+                              storey_qvalues)
+
+class TestQValues(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.pvals = np.concatenate([rng.random(2000),
+                                     rng.random(200) * 1e-3])
+
+    def testing_bh_qvalues(self):
+        expected = multipletests(self.pvals, method='fdr_bh')[1]
+        self.assertTrue(np.allclose(bh_qvalues(self.pvals), expected,
+                                    rtol=0, atol=1e-14))
+        # NaN p-values are left out of the correction.
+        pvals = self.pvals.copy()
+        pvals[[3, 50]] = np.nan
+        qvals = bh_qvalues(pvals)
+        self.assertTrue(np.isnan(qvals[[3, 50]]).all())
+        valid = ~np.isnan(pvals)
+        self.assertTrue(np.allclose(
+            qvals[valid], multipletests(pvals[valid], method='fdr_bh')[1],
+            rtol=0, atol=1e-14))
+        self.assertEqual(len(bh_qvalues([])), 0)
+
+    def testing_storey_pi0(self):
+        self.assertAlmostEqual(storey_pi0(self.pvals),
+                               (np.count_nonzero(self.pvals > 0.5) + 1) /
+                               (len(self.pvals) * 0.5))
+        # No p-values above lam must not make every q-value 0.
+        pvals = [0.001, 0.2, 0.3, 0.4, 0.45]
+        self.assertAlmostEqual(storey_pi0(pvals), 0.4)
+        self.assertTrue((storey_qvalues(pvals) > 0).all())
+        # The estimate is capped at 1, where it gives the BH q-values.
+        self.assertEqual(storey_pi0([0.6, 0.9, 0.99]), 1.0)
+        self.assertTrue(np.array_equal(storey_qvalues([0.6, 0.9, 0.99]),
+                                       bh_qvalues([0.6, 0.9, 0.99])))
+        self.assertEqual(storey_pi0([]), 1.0)
+
+    def testing_hit_values(self):
+        pvals = self.pvals.reshape(-1, 2)
+        self.assertIs(hit_values(pvals, 'pval'), pvals)
+        qvals = hit_values(pvals, 'qval_bh')
+        for i in range(2):
+            self.assertTrue(np.array_equal(qvals[:, i],
+                                           bh_qvalues(pvals[:, i])))
+
+if __name__ == '__main__':
+    unittest.main()
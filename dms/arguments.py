@@ -1,8 +1,10 @@
 import argparse
 import ast
 import configparser
+import re
 
 from dms.tile import Tile
+from dms.umi import MAX_UMI_LENGTH
 
 def bounded_number(converter, low=None, high=None):
     def f(s, converter=converter):
@@ -16,6 +18,7 @@ def bounded_number(converter, low=None, high=None):
     return f
 
 non_negative_int = bounded_number(int, low=0)
+proportion = bounded_number(float, low=0, high=1)
 
 def yes_or_no(s):
     s = s.lower()
@@ -28,12 +31,45 @@ def yes_or_no(s):
             f'Invalid value: {s}. Must be one of: True, T, Yes, Y,'
             ' False, F, No, N. (Not case sensitive.)')
 
+def regex(s):
+    s = maybe_quoted_string(s)
+    try:
+        re.compile(s)
+    except re.error as e:
+        raise argparse.ArgumentTypeError(f'Invalid regular expression: {s}'
+                                         f' ({e})')
+    return s
+
 def maybe_quoted_string(s):
     if len(s) > 0 and s[0] in ["'", '"']:
         return ast.literal_eval(s)
     else:
         return s
 
+SWEEP_PARAMETERS = ('max_mismatches', 'min_quality')
+
+def sweep_values(s):
+    """Parse a parameter sweep such as 'max_mismatches=0..10' (an
+    inclusive range) or 'min_quality=10,20,30' into a tuple (name,
+    values)."""
+    name, sep, spec = s.partition('=')
+    if not sep or name not in SWEEP_PARAMETERS:
+        raise argparse.ArgumentTypeError(
+            f"Invalid sweep: '{s}'. Must be of the form name=low..high or"
+            f" name=value1,value2,... where name is one of:"
+            f" {', '.join(SWEEP_PARAMETERS)}.")
+    try:
+        if '..' in spec:
+            low, high = spec.split('..')
+            values = range(int(low), int(high) + 1)
+        else:
+            values = [int(v) for v in spec.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Failed to convert '{s}'")
+    if len(values) == 0 or min(values) < 0:
+        raise argparse.ArgumentTypeError(f'Invalid value: {s}')
+    return name, tuple(sorted(set(values)))
+
 CLI_ONLY_ARGUMENTS = {
     'config' : {
         'help' : 'Configuration file to use.',
@@ -81,12 +117,148 @@ ARGUMENTS = {
                   ' reference but not the selected population.'),
         'type' : non_negative_int,
         'default' : 1
+    },
+    'checkpoint_dir' : {
+        'help' : ('Directory, relative to the output directory, where the'
+                  ' counts of each sample are saved as soon as they are'
+                  ' complete.'),
+        'type' : maybe_quoted_string,
+        'default' : 'Checkpoints'
+    },
+    'checkpoint_reads' : {
+        'help' : ('If given, also save the counts of each sample in chunks'
+                  ' of this many read pairs while it is being processed,'
+                  ' so an interrupted sample can be resumed part way'
+                  ' through.'),
+        'type' : non_negative_int,
+        'default' : None
+    },
+    'resume' : {
+        'help' : ('Reuse the saved counts of samples (and chunks of'
+                  ' samples) that were completed by a previous run with'
+                  ' the same input files and parameters.'),
+        'type' : yes_or_no,
+        'nargs' : '?',
+        'const' : True,
+        'default' : False
+    },
+    'sweep' : {
+        'help' : ('Write counts for every combination of the given'
+                  ' max_mismatches and min_quality values from a single'
+                  ' pass over the reads, e.g. --sweep max_mismatches=0..10'
+                  ' min_quality=10,20,30.'),
+        'type' : sweep_values,
+        'nargs' : '+',
+        'default' : None
+    },
+    'max_reads' : {
+        'help' : ('Only read the first N read pairs (or merged reads) of'
+                  ' each file, e.g. for a quick preview of a full'
+                  ' configuration.'),
+        'type' : non_negative_int,
+        'default' : None
+    },
+    'fraction' : {
+        'help' : ('Only count a deterministic random subsample of this'
+                  ' fraction of the reads, chosen by hashing the read IDs'
+                  ' so the forward and reverse reads of a pair are kept'
+                  ' together. Reads that are left out are not parsed.'),
+        'type' : proportion,
+        'default' : None
+    },
+    'rarefaction' : {
+        'help' : ('Also count nested subsamples of these fractions of the'
+                  ' reads in the same pass, e.g. --rarefaction 0.1 0.25'
+                  ' 0.5, and write the number of variants with at least'
+                  ' min_ref_counts counts at each depth to'
+                  ' Output/<sample>_rarefaction.tsv.'),
+        'type' : proportion,
+        'nargs' : '+',
+        'default' : None
+    },
+    'stop_coverage' : {
+        'help' : ('Stop reading a reference sample once the stop_quantile'
+                  ' quantile of the counts of its targeted variants (all'
+                  ' amino acid substitutions, including stops, at the'
+                  " tile's positions) reaches this many, e.g. 10 times"
+                  ' min_ref_counts.'),
+        'type' : non_negative_int,
+        'default' : None
+    },
+    'stop_quantile' : {
+        'help' : ('Quantile of the counts of the targeted variants that'
+                  ' must reach stop_coverage.'),
+        'type' : proportion,
+        'default' : 0.05
+    },
+    'stop_check_reads' : {
+        'help' : ('Number of read pairs between checks of the coverage of'
+                  ' a reference sample when stop_coverage is set.'),
+        'type' : bounded_number(int, low=1),
+        'default' : 100000
+    },
+    'max_memory' : {
+        'help' : ('Approximate memory budget in MiB for the table of'
+                  ' distinct reads of each task. When it is reached, the'
+                  ' table is written to a temporary file in the checkpoint'
+                  ' directory and emptied, and the files are merged at the'
+                  ' end. The counts are the same as without a budget.'),
+        'type' : bounded_number(int, low=1),
+        'default' : None
+    },
+    'umi_regex' : {
+        'help' : ('Regular expression that finds the UMI of each read pair'
+                  ' in the header of the forward read, as its first group'
+                  ' if it has one or else as the whole match. Each variant'
+                  ' is then counted once per distinct UMI.'),
+        'type' : regex,
+        'default' : None
+    },
+    'umi_length' : {
+        'help' : ('Length of a UMI at the start of each forward read (after'
+                  ' any barcode), which is trimmed off before merging. Each'
+                  ' variant is then counted once per distinct UMI.'),
+        'type' : bounded_number(int, low=1, high=MAX_UMI_LENGTH),
+        'default' : None
+    },
+    'umi_mismatches' : {
+        'help' : ('Count UMIs of a variant that differ by up to this many'
+                  ' mismatches (0 or 1) as one.'),
+        'type' : bounded_number(int, low=0, high=1),
+        'default' : 0
+    },
+    'double_mutants' : {
+        'help' : ('Also compute the enrichment ratios of double amino acid'
+                  ' mutants and write them to Output/<protein>_doubles.npz.'),
+        'type' : yes_or_no,
+        'nargs' : '?',
+        'const' : True,
+        'default' : False
+    },
+    'codon_counts' : {
+        'help' : ('Also write the counts of each sample by position and'
+                  ' codon, before collapsing codons into amino acids, to'
+                  ' Output/<sample>_codons.npz.'),
+        'type' : yes_or_no,
+        'nargs' : '?',
+        'const' : True,
+        'default' : False
+    },
+    'route_tiles' : {
+        'help' : ('Process samples of different tiles that list the same'
+                  ' FASTQ files in a single pass, assigning each read pair'
+                  ' to the sample whose tile it matches.'),
+        'type' : yes_or_no,
+        'nargs' : '?',
+        'const' : True,
+        'default' : False
     }
 }
 
 PARAMS_NAME = 'Parameters'
 TILE_PREFIX = 'Tile:'
 SAMPLES_NAME = 'Samples'
+BARCODES_NAME = 'Barcodes'
 EXPERIMENTS_NAME = 'Experiments'
 PROTEINS_NAME = 'Proteins'
 
@@ -99,7 +271,10 @@ def parse_params(arguments, config):
             raise ValueError(f'unknown option: {param}')
         try:
             raw = config.get(PARAMS_NAME, param)
-            value = arguments[param]['type'](raw)
+            if arguments[param].get('nargs') in ['+', '*']:
+                value = [arguments[param]['type'](x) for x in raw.split()]
+            else:
+                value = arguments[param]['type'](raw)
         except argparse.ArgumentTypeError as e:
             print(f'Invalid value for option {param}: {raw}')
             raise e
@@ -113,6 +288,9 @@ def parse_tile(config, section):
                   first_aa=config.getint(section, 'first_aa'))
     if config.has_option(section, 'positions'):
         kwargs['positions'] = ast.literal_eval(config.get(section, 'positions'))
+    if config.has_option(section, 'codon_scheme'):
+        kwargs['codon_scheme'] = \
+            maybe_quoted_string(config.get(section, 'codon_scheme'))
     return Tile(**kwargs)
 
 def parse_tiles(config):
@@ -124,22 +302,107 @@ def parse_tiles(config):
         raise argparse.ArgumentTypeError('config does not define any tiles.')
     return tiles
 
+def read_pairs(files):
+    """Return the pairs of FASTQ files of a sample as a tuple of (file1,
+    file2) tuples, or (file,) tuples for files of merged reads.
+
+    files: The files of a sample as stored by parse_samples, either a
+    single (file1, file2) pair or (file,) or a tuple of such pairs.
+    """
+    if all(isinstance(f, str) for f in files):
+        return (files,)
+    return files
+
 def parse_samples(config, tiles):
+    """Parse the [Samples] section.
+
+    Each sample is given as a tile followed by either two FASTQ files
+    (forward and reverse reads) or one or more (forward, reverse)
+    tuples, e.g. 'T1', ('run1_R1.fastq.gz', 'run1_R2.fastq.gz'),
+    ('run2_R1.fastq.gz', 'run2_R2.fastq.gz') for a sample that was
+    sequenced twice. The tuples may also be given as a single list.
+    File names may be glob patterns such as 'Ref_L00*_R1_001.fastq.gz'
+    to include all lanes of a run; these are expanded when the sample
+    is processed. Reads that were already merged can be given as a
+    single file instead of a pair, either a FASTQ or FASTA file of
+    merged reads or a table of unique sequences and their counts (see
+    dms.main.merged_read_counts), e.g. 'T1', 'Ref_merged.fastq.gz'.
+
+    Returns a dict mapping sample_name -> (tile_name, files), where
+    files is (file1, file2) or (file,) for a single source of reads or
+    a tuple of such tuples otherwise. Use read_pairs to get the pairs in
+    either case.
+    """
     if not config.has_section(SAMPLES_NAME):
         raise argparse.ArgumentTypeError('config does not have a [Samples]'
                                          ' section.')
     samples = {}
     for name, value in config.items(SAMPLES_NAME):
         elements = ast.literal_eval(value)
-        if len(elements) != 3:
-            raise ValueError(f'sample {name} does not specify a tile and two'
-                             f' files.')
-        tile, file1, file2 = elements
+        if len(elements) == 2 and isinstance(elements[1], list):
+            elements = (elements[0], *elements[1])
+        if len(elements) in [2, 3] and \
+           all(isinstance(e, str) for e in elements):
+            tile = elements[0]
+            files = tuple(elements[1:])
+        elif len(elements) >= 2 and \
+             all(isinstance(e, tuple) and len(e) in [1, 2] and
+                 all(isinstance(f, str) for f in e)
+                 for e in elements[1:]):
+            tile = elements[0]
+            files = tuple(elements[1:])
+        else:
+            raise ValueError(f'sample {name} does not specify a tile and one'
+                             f' or two files.')
         if tile not in tiles:
             raise ValueError(f'sample {name} specifies undefined tile {tile}.')
-        samples[name] = (tile, (file1, file2))
+        samples[name] = (tile, files)
     return samples
 
+def sample_barcode(sample):
+    """Return the inline barcode of a sample as stored by parse_barcodes,
+    or None if its reads are not barcoded."""
+    return sample[2] if len(sample) > 2 else None
+
+def parse_barcodes(config, samples):
+    """Parse the optional [Barcodes] section.
+
+    Each entry maps an inline barcode at the start of the forward reads
+    to a sample, or to a tuple of samples of different tiles that were
+    sequenced together with the same barcode, e.g. ACGTAC: '1_Ref'. The
+    barcoded samples list the undemultiplexed FASTQ files as usual.
+
+    Updates samples in place, mapping each barcoded sample_name ->
+    (tile_name, files, barcode). Use sample_barcode to get the barcode
+    of any sample.
+    """
+    if not config.has_section(BARCODES_NAME):
+        return
+    barcodes = {}
+    for barcode, value in config.items(BARCODES_NAME):
+        barcode = barcode.upper()
+        names = ast.literal_eval(value)
+        if isinstance(names, str):
+            names = (names,)
+        if len(barcode) == 0 or any(b not in 'ACGT' for b in barcode):
+            raise ValueError(f'barcode {barcode} is not a DNA sequence.')
+        tiles = set()
+        for name in names:
+            if name not in samples:
+                raise ValueError(f'barcode {barcode} specifies undefined'
+                                 f' sample {name}.')
+            if name in barcodes:
+                raise ValueError(f'sample {name} has more than one barcode.')
+            if samples[name][0] in tiles:
+                raise ValueError(f'barcode {barcode} specifies more than one'
+                                 f' sample with tile {samples[name][0]}.')
+            tiles.add(samples[name][0])
+            barcodes[name] = barcode
+    if len({len(barcode) for barcode in barcodes.values()}) > 1:
+        raise ValueError('barcodes must all have the same length.')
+    for name, barcode in barcodes.items():
+        samples[name] = (*samples[name], barcode)
+
 def parse_experiments(config, samples):
     if not config.has_section(EXPERIMENTS_NAME):
         raise argparse.ArgumentTypeError('config does not have an [Experiments]'
@@ -193,7 +456,8 @@ def parse_config(path, args):
     mapping param_name -> value.  tiles is a dict mapping tile_name ->
     Tile. samples is a dict mapping sample_name -> (tile_name, (path1,
     path2)), where path1 and path2 are the forward and reverse
-    paired-end reads for a single sample. experiments is a dict
+    paired-end reads for a single sample (see parse_samples and
+    parse_barcodes for the other forms). experiments is a dict
     mapping experiment_name -> (ref_sample_name, sel_sample_name).
     """
     config = configparser.ConfigParser(strict=True)
@@ -202,6 +466,7 @@ def parse_config(path, args):
     params = parse_params(args, config)
     tiles = parse_tiles(config)
     samples = parse_samples(config, tiles)
+    parse_barcodes(config, samples)
     experiments = parse_experiments(config, samples)
     proteins = parse_proteins(config, tiles, samples, experiments)
     return params, tiles, samples, experiments, proteins
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+# Checkpoints are pickled (key, value) pairs. The key records everything
+# the value was computed from, so a checkpoint left over from a run with
+# different input files, tiles or filtering parameters is never reused.
+
+def file_signature(path):
+    """Return a tuple identifying the contents of a file without reading
+    it: its absolute path, size and modification time."""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+def checkpoint_key(paths, targets, params, **extra):
+    """Build the key describing counts computed from the files in paths.
+
+    paths: iterable of input file paths.
+    targets: dict mapping the samples the reads were counted for to
+    their Tiles.
+    params: parameter namespace.
+    extra: anything else the counts depend on (e.g. a chunk index).
+    """
+    key = dict(files=tuple(file_signature(p) for p in paths),
+               targets=targets,
+               max_mismatches=params.max_mismatches,
+               min_quality=params.min_quality,
+               sweep=params.sweep,
+               max_reads=params.max_reads,
+               fraction=params.fraction,
+               rarefaction=params.rarefaction)
+    key.update(extra)
+    return key
+
+def checkpoint_path(params, samples, paths, chunk=None):
+    """Return the path of the checkpoint for the counts of one or more
+    samples from the input files in paths, or for one chunk of them if
+    chunk is not None."""
+    # Name checkpoints after the input files rather than their position
+    # in the sample, so adding files to a sample doesn't invalidate the
+    # checkpoints of the files that were already there.
+    digest = hashlib.sha1('\0'.join(os.path.abspath(p) for p in paths)
+                          .encode()).hexdigest()[:12]
+    name = '+'.join(sorted(samples))
+    if len(name) > 100:
+        # Keep the names of checkpoints of many samples (e.g. all the
+        # barcodes of a lane) within file name limits.
+        name = 'samples-' + hashlib.sha1(name.encode()).hexdigest()[:12]
+    name = f'{name}.{digest}'
+    if chunk is not None:
+        name += f'.chunk{chunk:06d}'
+    return os.path.join(params.output_dir, params.checkpoint_dir,
+                        f'{name}.pkl')
+
+def write_checkpoint(path, key, value):
+    """Atomically write a checkpoint.
+
+    The data is written to a temporary file in the same directory which
+    is then renamed over path, so a run that dies part way through a
+    write never leaves a truncated checkpoint behind.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def read_checkpoint(path, key):
+    """Return the value stored in a checkpoint, or None if there is no
+    checkpoint at path, it cannot be read, or it was written with a
+    different key."""
+    try:
+        with open(path, 'rb') as f:
+            stored_key, value = pickle.load(f)
+    except Exception:
+        return None
+    if stored_key != key:
+        return None
+    return value
+
+def remove_checkpoint(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
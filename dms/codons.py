@@ -0,0 +1,87 @@
+import numpy as np
+
+from dms.dna import AMINO_ACIDS_PLUS_STOP, translate_sequence
+from dms.mutation import Mutation
+
+# All 64 codons in a fixed order, indexing the columns of codon count
+# tensors.
+CODONS = tuple(a + b + c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT')
+CODON_INDEX = {codon : i for (i, codon) in enumerate(CODONS)}
+
+# 64 x 21 matrix mapping each codon to the amino acid (or stop) it
+# encodes, with columns in AMINO_ACIDS_PLUS_STOP order.
+CODON_AA_MATRIX = np.array([[int(translate_sequence(codon) == aa)
+                             for aa in AMINO_ACIDS_PLUS_STOP]
+                            for codon in CODONS], dtype=np.int64)
+
+def _expand_codons(pattern):
+    """Expand a codon pattern with IUPAC degenerate bases, e.g. 'NNK'."""
+    bases = dict(A='A', C='C', G='G', T='T', N='ACGT', K='GT', S='CG',
+                 D='AGT', V='ACG', H='ACT')
+    return [a + b + c for a in bases[pattern[0]] for b in bases[pattern[1]]
+            for c in bases[pattern[2]]]
+
+# Codons in the degenerate codon schemes used to make libraries. 22c is
+# the 22-codon NDT/VHG/TGG scheme, which encodes every amino acid once
+# or twice but no stops.
+CODON_SCHEMES = {
+    'NNN' : tuple(_expand_codons('NNN')),
+    'NNK' : tuple(_expand_codons('NNK')),
+    'NNS' : tuple(_expand_codons('NNS')),
+    '22c' : tuple(_expand_codons('NDT') + _expand_codons('VHG') + ['TGG']),
+}
+
+def codon_scheme_mask(scheme):
+    """Return a 64-entry boolean array (in CODONS order) of the codons in
+    a codon scheme."""
+    mask = np.zeros(len(CODONS), dtype=bool)
+    mask[[CODON_INDEX[codon] for codon in CODON_SCHEMES[scheme]]] = True
+    return mask
+
+def scheme_amino_acids(scheme):
+    """Return the set of amino acids (and stop) encoded by a codon
+    scheme."""
+    return {translate_sequence(codon) for codon in CODON_SCHEMES[scheme]}
+
+def codon_count_tensor(tile, raw_counts):
+    """Count the reads of a sample with a single codon change, by CDS
+    position and codon.
+
+    raw_counts: dict as returned by mutation_counts.
+
+    Returns a dict of arrays:
+    positions: the amino acid positions of the tile's CDS.
+    counts: positions x 64 array of the number of reads with a single
+    codon change at each position to each codon (in CODONS order).
+    wt: the number of reads without any changes.
+    other: the number of reads with any other combination of changes.
+    total: the total number of reads.
+
+    Unlike collapsed_and_filtered_counts this covers all CDS positions
+    rather than only the tile's positions, and keeps synonymous codons
+    apart.
+    """
+    positions = np.arange(tile.first_aa, tile.first_aa + tile.cds_length // 3)
+    counts = np.zeros((len(positions), len(CODONS)), dtype=np.int64)
+    wt = 0
+    other = 0
+    for muts, n in raw_counts.items():
+        if len(muts) == 0:
+            wt += n
+        elif len(muts) == 1 and isinstance(muts[0], Mutation):
+            counts[muts[0].pos - tile.first_aa, CODON_INDEX[muts[0].codon]] += n
+        else:
+            other += n
+    return dict(positions=positions, counts=counts, wt=wt, other=other,
+                total=wt + other + int(counts.sum()))
+
+def amino_acid_counts(codon_counts):
+    """Collapse a positions x 64 codon count array from
+    codon_count_tensor into a positions x 21 array of amino acid counts
+    (in AMINO_ACIDS_PLUS_STOP order).
+
+    The counts of the wild type amino acid at a position are the reads
+    with a synonymous change there, which collapsed_and_filtered_counts
+    adds to the wild type.
+    """
+    return codon_counts @ CODON_AA_MATRIX
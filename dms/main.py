@@ -1,5 +1,9 @@
+import collections
+import contextlib
+import glob
 import gzip
 import itertools
+import math
 import multiprocessing
 from operator import itemgetter
 import os
@@ -7,10 +11,23 @@ import os
 import numpy as np
 import pandas as pd
 
-from dms.arguments import parse_args_and_read_config
-from dms.merge import merge_all_reads
+from dms.arguments import (parse_args_and_read_config, read_pairs,
+                           sample_barcode)
+from dms.checkpoint import (checkpoint_key, checkpoint_path, read_checkpoint,
+                            remove_checkpoint, write_checkpoint)
+from dms.merge import (filter_merged_reads, filter_merged_seqs,
+                       in_subsample, merge_read_pairs, read_fasta, read_seqs,
+                       skip_seqs, subsample_count, subsample_level,
+                       subsample_level_counts)
+from dms.codons import CODONS, codon_count_tensor
 from dms.mutation import AminoAcidMutation, Mutation, WildType, is_wt
-from dms.tile import mutations_in_seq
+from dms.pairs import (double_mutant_enrichment, double_mutants,
+                       targeted_mutations)
+from dms.registry import make_registry
+from dms.route import make_barcode_lookup, make_tile_router
+from dms.spill import SpillingCounter
+from dms.tile import library_mutations_in_seq
+from dms.umi import UMICounter, UMISet, umi_extractor
 
 
 def open_by_extension(path, mode):
@@ -18,6 +35,27 @@ def open_by_extension(path, mode):
     use open."""
     return (gzip.open if path.endswith('gz') else open)(path, mode)
 
+def read_counts(reads):
+    """Count the occurrences of each distinct read in an iterable."""
+    counts = {}
+    for read in reads:
+        counts[read] = counts.get(read, 0) + 1
+    return counts
+
+def read_counter(params, n_samples=1):
+    """Return a SpillingCounter for the distinct reads of one of
+    n_samples samples counted together, which share the
+    params.max_memory budget (in MiB) between them.
+
+    Runs are spilled to the checkpoint directory, next to the output
+    rather than in the system's temporary directory. Use the counter as
+    a context manager so that they are removed if counting fails.
+    """
+    directory = os.path.join(params.output_dir, params.checkpoint_dir)
+    if params.max_memory is None:
+        return SpillingCounter(directory=directory)
+    return SpillingCounter(params.max_memory * 2**20 // n_samples, directory)
+
 def mutation_counts(seqs, tile):
     """Count up mutation sets in an iterable of sequences.
 
@@ -27,15 +65,329 @@ def mutation_counts(seqs, tile):
     Returns: A dict mapping a tuple of Mutations and
     NontargetMutations to count.
     """
-    seq_counts = {}
-    for seq in seqs:
-        seq_counts[seq] = seq_counts.get(seq, 0) + 1
+    return seq_mutation_counts(read_counts(seqs), tile)
+
+def seq_mutation_counts(seq_counts, tile):
+    """Like mutation_counts, but for a dict mapping each distinct
+    sequence to its count."""
     counts = {}
     for seq, n in seq_counts.items():
-        muts = mutations_in_seq(tile, seq)
+        muts = library_mutations_in_seq(tile, seq)
         counts[muts] = counts.get(muts, 0) + n
     return counts
 
+def mutation_histograms(reads, tile):
+    """Count up mutation sets in an iterable of annotated reads, keeping a
+    joint histogram of the reads' mismatches and minimum qualities.
+
+    reads: An iterable of tuples (seq, mismatches, min_qual) as
+    generated by merge_read_pairs with annotate=True.
+    tile: Tile object describing the DNA sequences.
+
+    Returns: A dict mapping a tuple of Mutations and NontargetMutations
+    to a Counter mapping (mismatches, min_qual) to count.
+    """
+    return read_mutation_histograms(read_counts(reads), tile)
+
+def read_mutation_histograms(read_counts, tile):
+    """Like mutation_histograms, but for a dict mapping each distinct
+    annotated read to its count."""
+    seq_muts = {}
+    hists = {}
+    for (seq, mismatches, min_qual), n in read_counts.items():
+        if seq not in seq_muts:
+            seq_muts[seq] = library_mutations_in_seq(tile, seq)
+        muts = seq_muts[seq]
+        if muts not in hists:
+            hists[muts] = collections.Counter()
+        hists[muts][mismatches, min_qual] += n
+    return hists
+
+def read_mutation_levels(read_counts, tile):
+    """Count up mutation sets in a dict mapping each distinct read,
+    annotated with its subsample level (see rarefaction_reads), to its
+    count.
+
+    Returns: A dict mapping a tuple of Mutations and NontargetMutations
+    to a Counter mapping subsample level to count.
+    """
+    seq_muts = {}
+    levels = {}
+    for (seq, level), n in read_counts.items():
+        if seq not in seq_muts:
+            seq_muts[seq] = library_mutations_in_seq(tile, seq)
+        muts = seq_muts[seq]
+        if muts not in levels:
+            levels[muts] = collections.Counter()
+        levels[muts][level] += n
+    return levels
+
+def read_mutation_umis(read_umis, tile):
+    """Like seq_mutation_counts, but for a dict mapping each distinct
+    read to a UMISet of the UMIs it was seen with (see
+    UMICounter.read_umis).
+
+    Returns: A dict mapping a tuple of Mutations and NontargetMutations
+    to a UMISet.
+    """
+    umis = {}
+    for seq, seq_umis in read_umis.items():
+        muts = library_mutations_in_seq(tile, seq)
+        umis.setdefault(muts, []).append(seq_umis)
+    # Many reads can share a mutation set (e.g. all off-scheme reads), so
+    # their UMIs are merged once per set rather than read by read.
+    return {muts : UMISet.union(umi_sets) for (muts, umi_sets) in umis.items()}
+
+def uses_umis(params):
+    """Return whether reads are deduplicated by their UMIs."""
+    return params.umi_regex is not None or params.umi_length is not None
+
+def umi_counts(umis, params):
+    """Turn the UMISets from read_mutation_umis into mutation counts of
+    distinct UMIs, collapsing UMIs with params.umi_mismatches
+    mismatches."""
+    return {muts : umi_set.count(params.umi_mismatches)
+            for (muts, umi_set) in umis.items()}
+
+def flat_counts(raw_counts, params):
+    """Return the counts of a sample as a dict as returned by
+    mutation_counts, whatever kind of counts params asks for, except
+    for sweeps."""
+    if params.rarefaction:
+        return rarefied_counts(raw_counts, rarefaction_depths(params), 1.0)
+    if uses_umis(params):
+        return umi_counts(raw_counts, params)
+    return raw_counts
+
+def rarefaction_depths(params):
+    """Return the sorted fractions of the reads at which params.rarefaction
+    asks for counts, always including all of the reads."""
+    return sorted(set(params.rarefaction) | {1.0})
+
+def rarefied_counts(levels, depths, depth):
+    """Turn the subsample level counts from read_mutation_levels into
+    mutation counts of the subsample of the given depth."""
+    max_level = depths.index(depth)
+    counts = {}
+    for muts, level_counts in levels.items():
+        n = sum(k for (level, k) in level_counts.items() if level <= max_level)
+        if n > 0:
+            counts[muts] = n
+    return counts
+
+def rarefaction_reads(reads, params, tagged=False):
+    """Annotate the reads generated by merge_read_pairs with ids=True
+    with their subsample levels (see dms.merge.subsample_level), as
+    tuples (read, level), keeping their tags if tagged is True."""
+    depths = rarefaction_depths(params)
+    if tagged:
+        return ((tag, (read, subsample_level(seq_id, depths)))
+                for (tag, (seq_id, read)) in reads)
+    return ((read, subsample_level(seq_id, depths)) for (seq_id, read) in reads)
+
+def filtered_histogram_counts(hists, max_mismatches, min_quality):
+    """Turn histograms from mutation_histograms into mutation counts,
+    keeping only reads that pass the given filters (either of which
+    may be None)."""
+    counts = {}
+    for muts, hist in hists.items():
+        n = sum(k for ((mismatches, min_qual), k) in hist.items()
+                if (max_mismatches is None or mismatches <= max_mismatches)
+                and (min_quality is None or min_qual >= min_quality))
+        if n > 0:
+            counts[muts] = n
+    return counts
+
+def sweep_combinations(params):
+    """Return a list of (max_mismatches, min_quality) pairs covered by
+    params.sweep. Parameters that are not swept take their usual
+    values."""
+    swept = dict(params.sweep)
+    return list(itertools.product(
+        swept.get('max_mismatches', [params.max_mismatches]),
+        swept.get('min_quality', [params.min_quality])))
+
+def merge_filters(params):
+    """Return the (max_mismatches, min_quality) filters to apply while
+    merging reads. When sweeping, these are the most permissive values
+    in the sweep and the remaining filtering happens after counting."""
+    if not params.sweep:
+        return params.max_mismatches, params.min_quality
+    max_mms, min_quals = zip(*sweep_combinations(params))
+    max_mm = None if None in max_mms else max(max_mms)
+    min_qual = None if None in min_quals else min(min_quals)
+    return max_mm, min_qual
+
+def counted_read_mutations(counts, tile, params):
+    """Count the mutation sets in a dict mapping each distinct merged read
+    to its count, as histograms if params.sweep is set or as subsample
+    level counts if params.rarefaction is set. If reads have UMIs, counts
+    maps each distinct read to a UMISet instead (see
+    read_mutation_umis)."""
+    if uses_umis(params):
+        return read_mutation_umis(counts, tile)
+    if params.sweep:
+        return read_mutation_histograms(counts, tile)
+    if params.rarefaction:
+        return read_mutation_levels(counts, tile)
+    return seq_mutation_counts(counts, tile)
+
+def merged_reads(pairs, amplen, params, tagged=False):
+    """Merge pairs of FASTQ records with merge_read_pairs, annotating the
+    reads as needed by counted_read_mutations. If tagged is True, the
+    pairs and reads are tagged as for merge_read_pairs."""
+    max_mm, min_qual = merge_filters(params)
+    reads = merge_read_pairs(pairs, amplen, max_mm, min_qual,
+                             annotate=bool(params.sweep),
+                             ids=bool(params.rarefaction), tagged=tagged)
+    if params.rarefaction:
+        return rarefaction_reads(reads, params, tagged)
+    return reads
+
+def count_merged_reads(pairs, tile, params):
+    """Merge pairs of FASTQ records and count the mutation sets in them
+    (see counted_read_mutations)."""
+    reads = merged_reads(pairs, tile.length, params)
+    if params.max_memory is None:
+        return counted_read_mutations(read_counts(reads), tile, params)
+    with read_counter(params) as counts:
+        for read in reads:
+            counts.add(read)
+        return counted_read_mutations(counts, tile, params)
+
+def count_assigned_read_pairs(pairs, targets, assign, params):
+    """Merge and count pairs of FASTQ records belonging to several samples.
+
+    targets: dict mapping sample name to Tile.
+    assign: function that takes a pair of FASTQ records and returns a
+    tuple (i, pair) of the index of the sample in targets the pair
+    belongs to and the pair to merge, or None if it doesn't belong to
+    any of them.
+
+    If reads have UMIs (see umi_extractor), each read is only counted
+    once per UMI, and read pairs without a valid UMI are skipped.
+
+    Returns a dict mapping sample name to counts as returned by
+    count_merged_reads.
+    """
+    samples = list(targets)
+    tiles = [targets[sample] for sample in samples]
+    lengths = [tile.length for tile in tiles]
+    extract = umi_extractor(params)
+    unassigned = 0
+    no_umi = 0
+    def assigned_pairs():
+        # Tag each pair with the index of its sample and its UMI, so that
+        # the pairs of all the samples are merged in one pass.
+        nonlocal unassigned, no_umi
+        for pair in pairs:
+            assigned = assign(pair)
+            if assigned is None:
+                unassigned += 1
+                continue
+            i, pair = assigned
+            umi = None
+            if extract is not None:
+                umi, pair = extract(pair)
+                if umi is None:
+                    no_umi += 1
+                    continue
+            yield (i, umi), pair
+    reads = merged_reads(assigned_pairs(), lambda tag: lengths[tag[0]],
+                         params, tagged=True)
+    with contextlib.ExitStack() as stack:
+        counts = [stack.enter_context(read_counter(params, len(samples)))
+                  if extract is None else UMICounter() for _ in samples]
+        for (i, umi), read in reads:
+            if extract is not None:
+                counts[i].add(read, umi)
+            else:
+                counts[i].add(read)
+        if unassigned > 0:
+            print(f'WARNING: {unassigned} read pairs could not be assigned'
+                  f' to any of the samples {", ".join(samples)}.')
+        if no_umi > 0:
+            print(f'WARNING: {no_umi} read pairs of the samples'
+                  f' {", ".join(samples)} had no valid UMI.')
+        if extract is not None:
+            counts = [c.read_umis() for c in counts]
+        return {sample : counted_read_mutations(c, tile, params)
+                for (sample, tile, c) in zip(samples, tiles, counts)}
+
+def count_routed_read_pairs(pairs, targets, params):
+    """Merge and count pairs of FASTQ records from several tiles sequenced
+    together, routing each pair to the sample of the tile it belongs
+    to.
+
+    targets: dict mapping sample name to Tile.
+
+    Returns a dict mapping sample name to counts as returned by
+    count_merged_reads.
+    """
+    router = make_tile_router(list(targets.values()))
+    def assign(pair):
+        i = router.route(pair[0][1], pair[1][1])
+        return None if i is None else (i, pair)
+    return count_assigned_read_pairs(pairs, targets, assign, params)
+
+def count_barcoded_read_pairs(pairs, targets, barcodes, params):
+    """Merge and count pairs of undemultiplexed FASTQ records, assigning
+    each pair to a sample by the inline barcode at the start of the
+    forward read, allowing one mismatch.
+
+    targets: dict mapping sample name to Tile.
+    barcodes: dict mapping sample name to barcode. Samples of different
+    tiles with the same barcode are routed between by their tiles.
+
+    The barcode is trimmed from the forward read before merging.
+
+    Returns a dict mapping sample name to counts as returned by
+    count_merged_reads.
+    """
+    samples = list(targets)
+    groups = {}
+    for i, sample in enumerate(samples):
+        groups.setdefault(barcodes[sample], []).append(i)
+    routers = {barcode : make_tile_router([targets[samples[i]]
+                                           for i in indices])
+               for (barcode, indices) in groups.items() if len(indices) > 1}
+    lookup = make_barcode_lookup(groups)
+    length = len(next(iter(groups)))
+    def assign(pair):
+        (id1, seq1, qual_id1, qual1), read2 = pair
+        barcode = lookup.get(seq1[:length].tobytes())
+        if barcode is None:
+            return None
+        pair = ((id1, seq1[length:], qual_id1, qual1[length:]), read2)
+        indices = groups[barcode]
+        if len(indices) == 1:
+            return indices[0], pair
+        i = routers[barcode].route(pair[0][1], pair[1][1])
+        return None if i is None else (indices[i], pair)
+    return count_assigned_read_pairs(pairs, targets, assign, params)
+
+def count_read_pairs(pairs, targets, params, barcodes=None):
+    """Merge pairs of FASTQ records and count the mutation sets in them.
+
+    targets: dict mapping the name of each sample the reads belong to
+    to its Tile. If there is more than one sample, the reads are routed
+    between them (see count_routed_read_pairs).
+    barcodes: if given, a dict mapping each sample name in targets to
+    its inline barcode (see count_barcoded_read_pairs).
+
+    Returns a dict mapping sample name to counts as returned by
+    count_merged_reads.
+    """
+    if barcodes:
+        return count_barcoded_read_pairs(pairs, targets, barcodes, params)
+    if len(targets) > 1:
+        return count_routed_read_pairs(pairs, targets, params)
+    if uses_umis(params):
+        return count_assigned_read_pairs(pairs, targets,
+                                         lambda pair: (0, pair), params)
+    (sample, tile), = targets.items()
+    return {sample : count_merged_reads(pairs, tile, params)}
+
 def library_statistics(tile, counts):
     n_muts = {}
     others = 0
@@ -72,77 +424,588 @@ def collapsed_and_filtered_counts(tile, counts):
         new_counts[mut] = new_counts.get(mut, 0) + n
     return total, new_counts
 
-def get_stats_and_counts(path1, path2, tile, params):
-    """Get statistics and mutation counts from two paired-end read FASTQ
-    files.
+def merge_counts(*counts):
+    """Sum dicts of counts, such as those returned by mutation_counts."""
+    merged = {}
+    for c in counts:
+        for key, n in c.items():
+            # The counts may be Counters rather than numbers.
+            merged[key] = merged[key] + n if key in merged else n
+    return merged
+
+def merge_sample_counts(*counts):
+    """Sum dicts mapping sample name to counts, such as those returned by
+    count_read_pairs."""
+    merged = {}
+    for c in counts:
+        for sample, sample_counts in c.items():
+            merged[sample] = merge_counts(merged.get(sample, {}),
+                                          sample_counts)
+    return merged
+
+def read_pair_records(f1, f2, params):
+    """Generate pairs of FASTQ records from open forward and reverse read
+    files. If params.fraction is set, (None, None) is generated for
+    pairs that are not in the subsample (see dms.merge.in_subsample)."""
+    return zip(read_seqs(f1, params.fraction), read_seqs(f2, params.fraction))
 
-    path1: path to forward read FASTQ file.
-    path2: path to reverse read FASTQ file.
+def sampled_pairs(pairs):
+    """Drop the pairs that are not in the subsample from pairs generated
+    by read_pair_records."""
+    return (pair for pair in pairs if pair[0] is not None)
+
+def coverage_quantile(tile, raw_counts, quantile):
+    """Return the given quantile of the counts of the targeted variants
+    of a tile (see dms.pairs.targeted_mutations).
+
+    raw_counts: dict as returned by mutation_counts.
+    """
+    _, counts = collapsed_and_filtered_counts(tile, raw_counts)
+    coverage = [counts.get(m, 0) for m in targeted_mutations(tile)]
+    return np.quantile(coverage, quantile)
+
+def coverage_reached(targets, raw_counts, stop, params):
+    """Return whether every sample in targets has at least stop counts
+    at the params.stop_quantile quantile of its targeted variants (see
+    coverage_quantile)."""
+    return all(coverage_quantile(tile, raw_counts.get(sample, {}),
+                                 params.stop_quantile) >= stop
+               for (sample, tile) in targets.items())
+
+def stopped_read_pair_counts(targets, pairs, params, barcodes, stop):
+    """Count mutation sets in batches of params.stop_check_reads read
+    pairs, stopping once the coverage target stop is reached (see
+    coverage_reached).
+
+    Returns a tuple (counts, n_pairs) where counts is a dict as returned
+    by count_read_pairs and n_pairs is the number of read pairs read.
+    """
+    raw_counts = {}
+    n_pairs = 0
+    while True:
+        batch = itertools.islice(pairs, params.stop_check_reads)
+        first = next(batch, None)
+        if first is None:
+            return raw_counts, n_pairs
+        batch = list(itertools.chain([first], batch))
+        n_pairs += len(batch)
+        raw_counts = merge_sample_counts(
+            raw_counts,
+            count_read_pairs(sampled_pairs(batch), targets, params, barcodes))
+        if coverage_reached(targets, raw_counts, stop, params):
+            return raw_counts, n_pairs
+
+def chunked_read_pair_counts(targets, paths, f1, f2, params, key,
+                             barcodes=None, stop=None):
+    """Count mutation sets in chunks of params.checkpoint_reads read pairs,
+    checkpointing each chunk as it finishes.
+
+    If params.resume is set, chunks that already have a valid checkpoint
+    are skipped over in the FASTQ files without being parsed. If stop
+    is given, no more chunks are read once the coverage target stop is
+    reached (see coverage_reached).
+
+    Returns a tuple (counts, chunk_paths, n_pairs) where counts is a
+    dict as returned by count_read_pairs, chunk_paths are the chunk
+    checkpoint paths and n_pairs is the number of read pairs read,
+    which is less than a whole number of chunks if the last one was cut
+    short by params.max_reads or the end of the files.
+    """
+    size = params.checkpoint_reads
+    remaining = params.max_reads
+    raw_counts = {}
+    chunk_paths = []
+    n_pairs = 0
+    for chunk in itertools.count():
+        n = size if remaining is None else min(size, remaining)
+        if n == 0:
+            break
+        chunk_key = dict(key, chunk=chunk, checkpoint_reads=size)
+        path = checkpoint_path(params, targets, paths, chunk)
+        counts = read_checkpoint(path, chunk_key) if params.resume else None
+        if counts is not None:
+            n_pairs += skip_seqs(f1, n)
+            skip_seqs(f2, n)
+        else:
+            pairs = itertools.islice(read_pair_records(f1, f2, params), n)
+            first = next(pairs, None)
+            if first is None:
+                break
+            # zip stops at the end of the chunk without taking another
+            # number from chunk_pairs, which then counts the pairs read.
+            chunk_pairs = itertools.count(1)
+            counts = count_read_pairs(
+                sampled_pairs(pair for (pair, _)
+                              in zip(itertools.chain([first], pairs),
+                                     chunk_pairs)),
+                targets, params, barcodes)
+            n_pairs += next(chunk_pairs) - 1
+            write_checkpoint(path, chunk_key, counts)
+        chunk_paths.append(path)
+        raw_counts = merge_sample_counts(raw_counts, counts)
+        if remaining is not None:
+            remaining -= n
+        if stop is not None and \
+           coverage_reached(targets, raw_counts, stop, params):
+            break
+    return raw_counts, chunk_paths, n_pairs
+
+def pair_mutation_counts(targets, path1, path2, params, barcodes=None,
+                         stop=None):
+    """Count mutation sets in one pair of FASTQ files, checkpointing the
+    result.
+
+    targets: dict mapping the name of each sample the reads belong to
+    to its Tile (see count_read_pairs).
+    barcodes: if given, a dict mapping each sample name in targets to
+    its inline barcode.
+    stop: if given, stop reading the files once the params.stop_quantile
+    quantile of the counts of the targeted variants of every sample
+    reaches this many. This is checked every params.stop_check_reads
+    read pairs, or after every chunk if params.checkpoint_reads is set.
+    The number of read pairs read is saved in the checkpoint along with
+    the counts, and printed.
+
+    The counts for the pair of files are written to a checkpoint as
+    soon as they are complete. If params.checkpoint_reads is set, they
+    are also checkpointed in chunks of that many read pairs while they
+    are being processed. Existing checkpoints are only used if
+    params.resume is set. Since each pair of files is checkpointed
+    separately, files added to a sample are the only ones processed
+    when resuming.
+
+    Returns a dict mapping sample name to a dict as returned by
+    mutation_counts, or by mutation_histograms if params.sweep is set.
+    """
+    extra = dict(barcodes=barcodes) if barcodes else {}
+    if uses_umis(params):
+        extra.update(umi_regex=params.umi_regex, umi_length=params.umi_length)
+    if stop is not None:
+        # Checkpoints of early stopped files also hold the number of
+        # read pairs read (see below).
+        extra.update(stop=(stop, params.stop_quantile,
+                           params.stop_check_reads))
+    key = checkpoint_key((path1, path2), targets, params, **extra)
+    path = checkpoint_path(params, targets, (path1, path2))
+    if params.resume:
+        checkpoint = read_checkpoint(path, key)
+        if checkpoint is not None:
+            if stop is None:
+                return checkpoint
+            raw_counts, n_pairs = checkpoint
+            print_read_pairs_used(targets, raw_counts, stop, params, n_pairs)
+            return raw_counts
+    chunk_paths = []
+    n_pairs = None
+    with open_by_extension(path1, 'rt') as f1, \
+         open_by_extension(path2, 'rt') as f2:
+        if params.checkpoint_reads:
+            raw_counts, chunk_paths, n_pairs = \
+                chunked_read_pair_counts(targets, (path1, path2), f1, f2,
+                                         params, key, barcodes, stop)
+        else:
+            pairs = itertools.islice(read_pair_records(f1, f2, params),
+                                     params.max_reads)
+            if stop is not None:
+                raw_counts, n_pairs = \
+                    stopped_read_pair_counts(targets, pairs, params,
+                                             barcodes, stop)
+            else:
+                raw_counts = count_read_pairs(sampled_pairs(pairs), targets,
+                                              params, barcodes)
+    # Samples that no reads were routed to still need an entry.
+    raw_counts = {sample : raw_counts.get(sample, {}) for sample in targets}
+    if stop is None:
+        write_checkpoint(path, key, raw_counts)
+    else:
+        write_checkpoint(path, key, (raw_counts, n_pairs))
+        print_read_pairs_used(targets, raw_counts, stop, params, n_pairs)
+    # The chunks are no longer needed once the whole pair is saved.
+    for chunk_path in chunk_paths:
+        remove_checkpoint(chunk_path)
+    return raw_counts
+
+def print_read_pairs_used(targets, raw_counts, stop, params, n_pairs):
+    """Report how many read pairs of a pair of files were read to reach
+    the coverage target stop (see pair_mutation_counts)."""
+    if coverage_reached(targets, raw_counts, stop, params):
+        print(f'{", ".join(targets)}: coverage target reached after'
+              f' {n_pairs} read pairs.')
+    else:
+        print(f'{", ".join(targets)}: coverage target not reached after'
+              f' {n_pairs} read pairs.')
+
+# File name extensions (before any '.gz') of the supported kinds of
+# single-file sample input.
+MERGED_FASTQ_EXTENSIONS = ('.fq', '.fastq')
+MERGED_FASTA_EXTENSIONS = ('.fa', '.fasta', '.fna')
+SEQ_COUNT_EXTENSIONS = ('.tsv', '.txt')
+
+def read_seq_count_table(f):
+    """Generate (seq, count) tuples from an open file handle of a table
+    with a sequence and a count in the first two tab-separated columns
+    of each line. A header line is skipped."""
+    for i, line in enumerate(f):
+        fields = line.rstrip('\r\n').split('\t')
+        if fields == ['']:
+            continue
+        try:
+            count = int(fields[1])
+        except (IndexError, ValueError):
+            if i == 0:
+                continue
+            raise ValueError(f'line {i + 1} is not a sequence and a count.')
+        yield fields[0], count
+
+def merged_read_counts(path, tile, params, counts):
+    """Count the distinct reads in a file of reads that were already
+    merged or collapsed, filtered as for merge_read_pairs.
+
+    counts: the SpillingCounter (see read_counter) to add the reads to.
+
+    The kind of file is determined by its extension: merged reads in
+    FASTQ (MERGED_FASTQ_EXTENSIONS) or FASTA (MERGED_FASTA_EXTENSIONS)
+    format, or a table of unique sequences and their counts
+    (SEQ_COUNT_EXTENSIONS, see read_seq_count_table). The quality
+    filter only applies to FASTQ files.
+
+    params.max_reads and params.fraction limit the reads counted as for
+    pairs of FASTQ files. Since sequence count tables have no read IDs,
+    their counts are subsampled binomially (see
+    dms.merge.subsample_count).
+
+    Returns counts, which maps each distinct read, annotated if
+    params.sweep is set, to its count.
+    """
+    annotate = bool(params.sweep)
+    rarefy = bool(params.rarefaction)
+    depths = rarefaction_depths(params) if rarefy else None
+    _, min_qual = merge_filters(params)
+    fraction = params.fraction
+    ext = os.path.splitext(path[:-len('.gz')] if path.endswith('.gz')
+                           else path)[1].lower()
+    with open_by_extension(path, 'rt') as f:
+        if ext in MERGED_FASTQ_EXTENSIONS:
+            reads = itertools.islice(read_seqs(f, fraction), params.max_reads)
+            reads = filter_merged_reads((read for read in reads
+                                         if read is not None),
+                                        tile.length, min_qual, annotate,
+                                        ids=rarefy)
+            if rarefy:
+                reads = rarefaction_reads(reads, params)
+            for read in reads:
+                counts.add(read)
+            return counts
+        if ext in MERGED_FASTA_EXTENSIONS:
+            for seq_id, seq in itertools.islice(read_fasta(f),
+                                                params.max_reads):
+                if fraction is not None and not in_subsample(seq_id, fraction):
+                    continue
+                for read in filter_merged_seqs([seq], tile.length, annotate):
+                    if rarefy:
+                        read = read, subsample_level(seq_id, depths)
+                    counts.add(read)
+            return counts
+        if ext in SEQ_COUNT_EXTENSIONS:
+            remaining = params.max_reads
+            for seq, n in read_seq_count_table(f):
+                if remaining is not None:
+                    if remaining == 0:
+                        break
+                    n = min(n, remaining)
+                    remaining -= n
+                if fraction is not None:
+                    n = subsample_count(seq, n, fraction)
+                for read in filter_merged_seqs([seq], tile.length, annotate):
+                    if not rarefy:
+                        counts.add(read, n)
+                        continue
+                    level_counts = subsample_level_counts(seq, n, depths)
+                    for level, k in enumerate(level_counts):
+                        if k > 0:
+                            counts.add((read, level), int(k))
+            return counts
+    raise ValueError(f'unknown kind of merged read file: {path}')
+
+def file_mutation_counts(targets, path, params):
+    """Count mutation sets in one file of merged reads or sequence counts
+    (see merged_read_counts), checkpointing the result.
+
+    targets: dict mapping the name of the sample the reads belong to to
+    its Tile. Unlike read pairs, merged reads can't be shared between
+    samples.
+
+    Returns the same as pair_mutation_counts.
+    """
+    (sample, tile), = targets.items()
+    key = checkpoint_key((path,), targets, params)
+    checkpoint = checkpoint_path(params, targets, (path,))
+    if params.resume:
+        raw_counts = read_checkpoint(checkpoint, key)
+        if raw_counts is not None:
+            return raw_counts
+    with read_counter(params) as counts:
+        counts = merged_read_counts(path, tile, params, counts)
+        raw_counts = {sample : counted_read_mutations(counts, tile, params)}
+    write_checkpoint(checkpoint, key, raw_counts)
+    return raw_counts
+
+def source_mutation_counts(targets, paths, params, barcodes=None,
+                           stop=None):
+    """Count mutation sets in one source of reads: either a pair of
+    FASTQ files (see pair_mutation_counts) or a single file of merged
+    reads (see file_mutation_counts). Early stopping only applies to
+    pairs of FASTQ files."""
+    if len(paths) == 1:
+        return file_mutation_counts(targets, paths[0], params)
+    path1, path2 = paths
+    return pair_mutation_counts(targets, path1, path2, params, barcodes,
+                                stop)
+
+def stats_and_counts(tile, raw_counts):
+    """Return a tuple (stats, total, counts) where stats is a tuple from
+    library_statistics, total is the total number of reads in the
+    sample, and counts is a dict mapping mutation => count."""
+    stats = library_statistics(tile, raw_counts)
+    total, counts = collapsed_and_filtered_counts(tile, raw_counts)
+    return stats, total, counts
+
+def sample_stats_and_counts(tile, raw_counts, params):
+    """Get statistics and mutation counts from the combined raw counts
+    of a sample.
+
+    Returns a tuple (stats, total, counts) as returned by
+    stats_and_counts. If params.sweep is set, returns a dict mapping
+    each (max_mismatches, min_quality) pair in the sweep to such a
+    tuple instead, and if params.rarefaction is set, a dict mapping
+    each depth in rarefaction_depths to such a tuple.
+    """
+    if uses_umis(params):
+        return stats_and_counts(tile, umi_counts(raw_counts, params))
+    if params.rarefaction:
+        depths = rarefaction_depths(params)
+        return {depth : stats_and_counts(tile, rarefied_counts(raw_counts,
+                                                               depths, depth))
+                for depth in depths}
+    if not params.sweep:
+        return stats_and_counts(tile, raw_counts)
+    return {(max_mm, min_qual) :
+            stats_and_counts(tile, filtered_histogram_counts(raw_counts,
+                                                             max_mm,
+                                                             min_qual))
+            for (max_mm, min_qual) in sweep_combinations(params)}
+
+def get_stats_and_counts(sample, paths, tile, params):
+    """Get statistics and mutation counts from pairs of paired-end read
+    FASTQ files.
+
+    sample: name of the sample, used to name its checkpoints.
+    paths: list of (path1, path2) tuples, where path1 and path2 are
+    paths to the forward and reverse read FASTQ files, or (path,)
+    tuples of files of merged reads (see merged_read_counts). The
+    counts from all the files are added together.
     tile: a Tile object describing the amplicon.
     params: parameter dict.
 
-    Returns a tuple (stats, total, counts) where stats is a tuple from
-    library_statistics, total is the total number of reads in the
-    sample, and counts is a dict mapping mutation => count.
+    Returns the same as sample_stats_and_counts.
 
     If a filename ends in '.gz' it will be assumed to be gzipped,
     otherwise it will be assumed to be plain text.
     """
-    f1 = open_by_extension(path1, 'rt')
-    f2 = open_by_extension(path2, 'rt')
-    reads = merge_all_reads(f1, f2,
-                            tile.length,
-                            params.max_mismatches,
-                            params.min_quality)
-    #reads = itertools.islice(reads, 10000)
-    raw_counts = mutation_counts(reads, tile)
-    stats = library_statistics(tile, raw_counts)
-    total, counts = collapsed_and_filtered_counts(tile, raw_counts)
-    f1.close()
-    f2.close()
-    return stats, total, counts
+    raw_counts = merge_counts(*[source_mutation_counts({sample : tile},
+                                                       source, params)[sample]
+                                for source in paths])
+    return sample_stats_and_counts(tile, raw_counts, params)
+
+def expand_read_pairs(params, files):
+    """Return a list of (path1, path2) tuples for the files of a sample
+    (see parse_samples), with paths relative to params.fastq_file_dir.
+    Single files of merged reads are returned as (path,) tuples.
+
+    Files given as glob patterns, e.g. 'Ref_L00*_R1_001.fastq.gz', are
+    expanded and the sorted forward and reverse matches are paired up.
+    """
+    paths = []
+    for source in read_pairs(files):
+        source_paths = [os.path.join(params.fastq_file_dir, f)
+                        for f in source]
+        if not any(glob.has_magic(path) for path in source_paths):
+            paths.append(tuple(source_paths))
+            continue
+        matches = [sorted(glob.glob(path)) for path in source_paths]
+        counts = [len(m) for m in matches]
+        if counts[0] == 0 or len(set(counts)) > 1:
+            raise ValueError(f'{" and ".join(source)} match'
+                             f' {" and ".join(map(str, counts))} files'
+                             ' respectively.')
+        paths.extend(zip(*matches))
+    return paths
+
+def count_all_samples(params, tiles, samples, references=()):
+    """Count the mutation sets in the reads of every sample.
 
-def process_all_samples(params, tiles, samples):
+    Each pair of FASTQ files (e.g. each sequencing lane) or file of
+    merged reads is processed as a separate task, in parallel if
+    params.use_multiprocessing is set, and the counts of a sample's
+    files are added together. If params.route_tiles is set, samples
+    with different tiles that list the same pair of files are
+    processed together in a single pass over the files. Likewise, all
+    samples with inline barcodes (see parse_barcodes) that list the
+    same pair of files are demultiplexed in a single pass.
+
+    If params.stop_coverage is set, reading the files of the samples in
+    references stops early once their targeted variants are covered
+    well enough (see pair_mutation_counts). The target is split evenly
+    between the pairs of files of a sample.
+
+    Returns a dict mapping sample name to a dict as returned by
+    counted_read_mutations.
+    """
+    if params.sweep and params.rarefaction:
+        raise ValueError('sweep and rarefaction cannot be used together.')
+    if params.stop_coverage is not None and \
+       (params.sweep or params.rarefaction):
+        raise ValueError('stop_coverage cannot be used with sweep or'
+                         ' rarefaction.')
+    if params.codon_counts and params.sweep:
+        raise ValueError('codon_counts cannot be used with sweep.')
+    if params.double_mutants and params.sweep:
+        raise ValueError('double_mutants cannot be used with sweep.')
+    if uses_umis(params):
+        if params.umi_regex is not None and params.umi_length is not None:
+            raise ValueError('umi_regex and umi_length cannot be used'
+                             ' together.')
+        if params.sweep or params.rarefaction or \
+           params.stop_coverage is not None:
+            raise ValueError('UMIs cannot be used with sweep, rarefaction'
+                             ' or stop_coverage.')
+        if params.max_memory is not None:
+            raise ValueError('UMIs cannot be used with max_memory.')
+    tasks = {}
+    stops = {}
+    for sample, (tile_name, filenames, *_) in samples.items():
+        barcode = sample_barcode(samples[sample])
+        sources = expand_read_pairs(params, filenames)
+        for paths in sources:
+            if len(paths) == 1:
+                if barcode is not None:
+                    raise ValueError(f'sample {sample} has a barcode but'
+                                     f' {paths[0]} has merged reads.')
+                if uses_umis(params):
+                    raise ValueError(f'UMIs are taken from read pairs but'
+                                     f' {paths[0]} has merged reads.')
+                task = (paths, sample)
+            elif barcode is not None:
+                # All barcoded samples in a pair of files are
+                # demultiplexed in one task.
+                task = (paths, None)
+            elif params.route_tiles:
+                task = (paths,)
+            else:
+                task = (paths, sample)
+            targets, barcodes = tasks.setdefault(task, ({}, {}))
+            for other, tile in targets.items():
+                if tile == tiles[tile_name] and \
+                   barcodes.get(other) == barcode:
+                    raise ValueError(f'samples {other} and {sample} read'
+                                     f' {" and ".join(paths)} with the same'
+                                     ' tile.')
+            targets[sample] = tiles[tile_name]
+            if barcode is not None:
+                barcodes[sample] = barcode
+            if params.stop_coverage is not None and sample in references:
+                stops[task, sample] = math.ceil(params.stop_coverage
+                                                / len(sources))
     inputs = []
-    for sample, (tile_name, filenames) in samples.items():
-        tile = tiles[tile_name]
-        path1, path2 = [os.path.join(params.fastq_file_dir, f)
-                        for f in filenames]
-        inputs.append((path1, path2, tile, params))
+    for task, (targets, barcodes) in tasks.items():
+        # Only stop early if every sample read from the files can.
+        task_stops = [stops.get((task, sample)) for sample in targets]
+        stop = None if None in task_stops else max(task_stops)
+        inputs.append((targets, task[0], params, barcodes or None, stop))
     if params.use_multiprocessing:
         with multiprocessing.Pool() as pool:
-            results = pool.starmap(get_stats_and_counts, inputs)
+            pair_counts = pool.starmap(source_mutation_counts, inputs,
+                                       chunksize=1)
     else:
-        results = list(itertools.starmap(get_stats_and_counts, inputs))
+        pair_counts = list(itertools.starmap(source_mutation_counts, inputs))
+    return merge_sample_counts({sample : {} for sample in samples},
+                               *pair_counts)
+
+def all_sample_stats_and_counts(params, tiles, samples, raw_counts):
+    """Get statistics and mutation counts of every sample from the raw
+    counts returned by count_all_samples.
+
+    Returns the same as process_all_samples.
+    """
+    results = [sample_stats_and_counts(tiles[tile_name], raw_counts[sample],
+                                       params)
+               for sample, (tile_name, *_) in samples.items()]
+    if params.sweep:
+        return {filters : split_results(samples, [r[filters] for r in results])
+                for filters in sweep_combinations(params)}
+    if params.rarefaction:
+        return {depth : split_results(samples, [r[depth] for r in results])
+                for depth in rarefaction_depths(params)}
+    return split_results(samples, results)
+
+def process_all_samples(params, tiles, samples, references=()):
+    """Process the reads of every sample (see count_all_samples).
+
+    Returns a tuple (stats, counts) of dicts mapping sample name to the
+    sample's statistics and (total, counts) respectively. If
+    params.sweep is set, returns a dict mapping each (max_mismatches,
+    min_quality) pair in the sweep to such a tuple instead. If
+    params.rarefaction is set, returns a dict mapping each depth in
+    rarefaction_depths to such a tuple.
+    """
+    raw_counts = count_all_samples(params, tiles, samples, references)
+    return all_sample_stats_and_counts(params, tiles, samples, raw_counts)
+
+def split_results(samples, results):
     stats = dict(zip(samples, map(itemgetter(0), results)))
     counts = dict(zip(samples, map(itemgetter(1, 2), results)))
     return stats, counts
 
-def process_all_experiments(params, tiles, samples, experiments, counts):
+def process_all_experiments(params, tiles, samples, experiments, counts,
+                            registry=None):
+    """Compute the enrichment ratio of each variant in every experiment.
+
+    counts: dict mapping sample name to (total, counts) as returned by
+    process_all_samples.
+    registry: VariantRegistry covering the variants in counts. One is
+    made if not given.
+
+    Returns a dict mapping experiment name to a DataFrame with a row per
+    variant with enough reference counts, in variant order. The
+    'variant' column holds registry ids; use VariantRegistry.names to
+    turn them into names.
+    """
+    if registry is None:
+        registry = make_registry(c for (_, c) in counts.values())
+    vectors = {}
+    for sample in {s for pair in experiments.values() for s in pair}:
+        total, sample_counts = counts[sample]
+        vectors[sample] = total, registry.vector(sample_counts)
     results = {}
     for experiment, (ref_sample, sel_sample) in experiments.items():
-        tile_name = samples[ref_sample][0]
-        tile = tiles[tile_name]
-
-        ref_total, ref_counts = counts[ref_sample]
-        sel_total, sel_counts = counts[sel_sample]
+        ref_total, ref_counts = vectors[ref_sample]
+        sel_total, sel_counts = vectors[sel_sample]
 
         # Remove mutations that don't have enough reference counts.
-        muts = sorted([m for (m, n) in ref_counts.items()
-                       if n >= params.min_ref_counts],
-                      key=AminoAcidMutation.sort_key)
+        ids = np.flatnonzero((ref_counts >= params.min_ref_counts)
+                             & (ref_counts > 0))
 
-        if not any(is_wt(m) for m in muts):
+        if len(ids) == 0 or ids[0] != registry.ids[WildType]:
             print('WARNING: The wild-type sequence will not appear in'
                   f' experiment {experiment}.')
 
+        sel = sel_counts[ids]
         d = pd.DataFrame({
             'experiment' : experiment,
-            'variant' : muts,
-            'sel_counts' : [sel_counts.get(m, params.pseudocount)
-                            for m in muts],
+            'variant' : ids,
+            'sel_counts' : np.where(sel > 0, sel, params.pseudocount),
             'sel_total' : sel_total,
-            'ref_counts' : [ref_counts[m] for m in muts],
+            'ref_counts' : ref_counts[ids],
             'ref_total' : ref_total})
         d['ER'] = np.log2((d['sel_counts'] / d['sel_total'])
                           / (d['ref_counts'] / d['ref_total']))
@@ -161,14 +1024,19 @@ def write_stats(stats, path):
         print(f'total\t{total}', file=f)
 
 
-def main(argv):
-    if not os.path.exists('Output'):
-        os.makedirs('Output')
-
-    params, tiles, samples, experiments, proteins = \
-        parse_args_and_read_config(argv)
+def sweep_suffix(params, max_mismatches, min_quality):
+    """Return a suffix for output files identifying a combination of
+    swept parameters."""
+    swept = dict(params.sweep)
+    suffix = ''
+    if 'max_mismatches' in swept:
+        suffix += f'_mm{max_mismatches}'
+    if 'min_quality' in swept:
+        suffix += f'_q{min_quality}'
+    return suffix
 
-    stats, counts = process_all_samples(params, tiles, samples)
+def write_counts(params, tiles, samples, experiments, proteins, stats,
+                 counts, suffix=''):
     # stats and counts both have total reads as their first elements,
     # this is just a sanity check.
     assert set(stats.keys()) == set(counts.keys())
@@ -179,9 +1047,111 @@ def main(argv):
 #         out_path = os.path.join(params.output_dir, 'Output', f'{sample}_stats.tsv')
 #         write_stats(stats[sample], out_path)
 
-    data = process_all_experiments(params, tiles, samples, experiments, counts)
+    registry = make_registry(c for (_, c) in counts.values())
+    data = process_all_experiments(params, tiles, samples, experiments, counts,
+                                   registry)
     for protein, exps in proteins.items():
-        out_path = os.path.join(params.output_dir, 'Output', f'{protein}_counts.csv')
+        out_path = os.path.join(params.output_dir, 'Output',
+                                f'{protein}{suffix}_counts.csv')
         d = pd.concat([data[exp] for exp in exps])\
-              .reset_index(drop=True)\
-              .to_csv(out_path, index=False)
+              .reset_index(drop=True)
+        d['variant'] = registry.names(d['variant'])
+        d.to_csv(out_path, index=False)
+
+def write_codon_counts(params, tiles, samples, raw_counts):
+    """Write the codon count tensor (see codon_count_tensor) of each
+    sample to Output/<sample>_codons.npz, along with the CODONS order of
+    its columns."""
+    for sample, (tile_name, *_) in samples.items():
+        sample_counts = flat_counts(raw_counts[sample], params)
+        tensor = codon_count_tensor(tiles[tile_name], sample_counts)
+        out_path = os.path.join(params.output_dir, 'Output',
+                                f'{sample}_codons.npz')
+        np.savez_compressed(out_path, codons=np.array(CODONS), **tensor)
+
+def write_double_mutants(params, tiles, samples, experiments, proteins,
+                         raw_counts):
+    """Write the enrichment ratios of the double amino acid mutants of
+    each protein's experiments to Output/<protein>_doubles.npz.
+
+    The file holds an entry per double mutant and experiment: the ids of
+    its two mutations ('first' and 'second', indexing 'variants'), the
+    index of its experiment (indexing 'experiments'), and its
+    'ref_counts', 'sel_counts' and 'ER'.
+    """
+    # The registry holds every targeted mutation up front, so that each
+    # sample's counts can be turned into id arrays as soon as it is read.
+    used = {s for pair in experiments.values() for s in pair}
+    registry = make_registry(
+        dict.fromkeys(targeted_mutations(tiles[tile_name]), 0)
+        for tile_name in {samples[sample][0] for sample in used})
+    doubles = {}
+    for sample in used:
+        tile = tiles[samples[sample][0]]
+        doubles[sample] = double_mutants(registry, tile,
+                                         flat_counts(raw_counts[sample],
+                                                     params))
+    for protein, exps in proteins.items():
+        data = [double_mutant_enrichment(params, registry,
+                                         doubles[experiments[exp][0]],
+                                         doubles[experiments[exp][1]])
+                for exp in exps]
+        out_path = os.path.join(params.output_dir, 'Output',
+                                f'{protein}_doubles.npz')
+        np.savez_compressed(
+            out_path,
+            variants=registry.names(np.arange(len(registry))).astype(str),
+            experiments=np.array(exps, dtype=str),
+            experiment=np.repeat(np.arange(len(exps)),
+                                 [len(d['ER']) for d in data]),
+            **{name : np.concatenate([d[name] for d in data])
+               for name in ('first', 'second', 'ref_counts', 'sel_counts',
+                            'ER')})
+
+def write_rarefaction(params, depth_counts):
+    """Write a table for each sample of the number of reads and of the
+    variants with at least params.min_ref_counts counts in subsamples of
+    increasing depth.
+
+    depth_counts: dict mapping each depth in rarefaction_depths to a
+    dict of counts as returned by process_all_samples.
+    """
+    depths = rarefaction_depths(params)
+    for sample in depth_counts[1.0]:
+        out_path = os.path.join(params.output_dir, 'Output',
+                                f'{sample}_rarefaction.tsv')
+        with open(out_path, 'wt') as f:
+            print('depth\treads\tvariants', file=f)
+            for depth in depths:
+                total, counts = depth_counts[depth][sample]
+                n_variants = sum(1 for n in counts.values()
+                                 if n >= params.min_ref_counts)
+                print(f'{depth:g}\t{total}\t{n_variants}', file=f)
+
+def main(argv):
+    if not os.path.exists('Output'):
+        os.makedirs('Output')
+
+    params, tiles, samples, experiments, proteins = \
+        parse_args_and_read_config(argv)
+
+    raw_counts = count_all_samples(params, tiles, samples,
+                                   all_reference_samples(experiments))
+    if params.codon_counts:
+        write_codon_counts(params, tiles, samples, raw_counts)
+    if params.double_mutants:
+        write_double_mutants(params, tiles, samples, experiments, proteins,
+                             raw_counts)
+    results = all_sample_stats_and_counts(params, tiles, samples, raw_counts)
+    if params.rarefaction:
+        write_rarefaction(params, {depth : counts for (depth, (_, counts))
+                                   in results.items()})
+        results = results[1.0]
+    if not params.sweep:
+        stats, counts = results
+        write_counts(params, tiles, samples, experiments, proteins,
+                     stats, counts)
+        return
+    for (max_mm, min_qual), (stats, counts) in results.items():
+        write_counts(params, tiles, samples, experiments, proteins,
+                     stats, counts, sweep_suffix(params, max_mm, min_qual))
@@ -1,3 +1,7 @@
+import bisect
+import hashlib
+import zlib
+
 import numpy as np
 
 # ASCII values of DNA characters.
@@ -130,8 +134,53 @@ def merge_reads(s1, s2, q1, q2, amplen):
 
     return s, q, mismatches
 
-def read_seqs(f):
-    """Generate FASTQ records as tuples from an open file handle."""
+def in_subsample(seq_id, fraction):
+    """Decide deterministically whether a read belongs to a subsample of
+    the given fraction of all reads, by hashing the part of its ID
+    before the first space (after the leading '@' or '>'). The forward
+    and reverse reads of a pair are always kept or dropped together."""
+    key = seq_id[1:].split(' ', 1)[0].encode()
+    return zlib.crc32(key) < fraction * 2**32
+
+def subsample_level(seq_id, depths):
+    """Assign a read to nested subsamples deterministically.
+
+    depths: sorted list of fractions of all reads.
+
+    Returns the index of the smallest fraction in depths whose
+    subsample the read belongs to, or len(depths) if it is in none of
+    them. Like in_subsample, this only depends on the read ID prefix,
+    but a different hash is used so the subsamples are independent of
+    the one chosen by in_subsample.
+    """
+    key = seq_id[1:].split(' ', 1)[0].encode()
+    digest = hashlib.blake2b(key, digest_size=8, person=b'rarefaction')
+    u = int.from_bytes(digest.digest(), 'big') / 2**64
+    return bisect.bisect_right(depths, u)
+
+def subsample_level_counts(seq, n, depths):
+    """Split n identical reads of a sequence between the levels returned
+    by subsample_level, returning an array of counts per level. This is
+    a multinomial sample, seeded by the sequence so that it is
+    deterministic."""
+    rng = np.random.default_rng([zlib.crc32(seq.encode()), 1])
+    probs = np.diff([0, *depths, 1])
+    return rng.multinomial(n, probs)
+
+def subsample_count(seq, n, fraction):
+    """Return how many of n identical reads of a sequence belong to a
+    subsample of the given fraction of all reads. This is a binomial
+    sample, seeded by the sequence so that it is deterministic."""
+    rng = np.random.default_rng(zlib.crc32(seq.encode()))
+    return int(rng.binomial(n, fraction))
+
+def read_seqs(f, fraction=None):
+    """Generate FASTQ records as tuples from an open file handle.
+
+    If fraction is given, only records in a subsample of that fraction
+    of the reads (see in_subsample) are parsed and None is generated
+    for the others.
+    """
     while True:
         # Read the sequence ID. If there's nothing to read, then we're done.
         try:
@@ -139,6 +188,14 @@ def read_seqs(f):
         except EOFError:
             return
 
+        # Skip records that aren't in the subsample without parsing them.
+        if fraction is not None and not in_subsample(seq_id, fraction):
+            for _ in range(3):
+                if len(f.readline()) == 0:
+                    raise EOFError('EOF while reading sequence.')
+            yield None
+            continue
+
         # If we successfully read a sequence ID, then running out of stuff to
         # read means a truncated record.
         try:
@@ -181,6 +238,17 @@ def compare_seq_ids(id1, id2):
     prefix = l1 if match else None
     return match, prefix
 
+def skip_seqs(f, n):
+    """Skip up to n FASTQ records in an open file handle without parsing
+    them and return the number of records actually skipped."""
+    for i in range(n):
+        if len(f.readline()) == 0:
+            return i
+        for _ in range(3):
+            if len(f.readline()) == 0:
+                raise EOFError('EOF while skipping sequence.')
+    return n
+
 def merge_all_reads(f1, f2, amplen, max_mm=None, min_qual=None):
     """Merge fixed-length paired-end reads from two FASTQ files.
 
@@ -190,7 +258,34 @@ def merge_all_reads(f1, f2, amplen, max_mm=None, min_qual=None):
     max_mm: maximum number of mismatches allowed
     min_qual: reads with any quality score lower than this are discarded
     """
-    for i, (r1, r2) in enumerate(zip(read_seqs(f1), read_seqs(f2)), 1):
+    return merge_read_pairs(zip(read_seqs(f1), read_seqs(f2)),
+                            amplen, max_mm, min_qual)
+
+def merge_read_pairs(pairs, amplen, max_mm=None, min_qual=None,
+                     annotate=False, ids=False, tagged=False):
+    """Merge fixed-length paired-end reads from an iterable of pairs of
+    FASTQ records as generated by read_seqs.
+
+    See merge_all_reads for a description of the other arguments. If
+    annotate is True, tuples (seq, mismatches, min_qual) are generated
+    instead of sequences, where mismatches is the number of mismatches
+    between the reads and min_qual is the lowest quality score in the
+    merged read, so that stricter filters can be applied later. If ids
+    is True, tuples (seq_id, read) of the merged sequence ID and the
+    sequence or tuple are generated.
+
+    If tagged is True, pairs are (tag, pair) tuples, amplen is a
+    function returning the amplicon length of a tag, and (tag, read)
+    tuples are generated, so that reads of several amplicons can be
+    merged in one pass.
+    """
+    for item in pairs:
+        if tagged:
+            tag, (r1, r2) = item
+            length = amplen(tag)
+        else:
+            r1, r2 = item
+            length = amplen
         seq_id1, seq1, qual_id1, qual1 = r1
         seq_id2, seq2, qual_id2, qual2 = r2
 
@@ -199,7 +294,7 @@ def merge_all_reads(f1, f2, amplen, max_mm=None, min_qual=None):
             raise ValueError('Reads do not appear to match.')
         seq_id = prefix + ' merged'
 
-        s, q, n_mm = merge_reads(seq1, seq2, qual1, qual2, amplen)
+        s, q, n_mm = merge_reads(seq1, seq2, qual1, qual2, length)
 
         # Discard merged reads with too many mismatches.
         if max_mm is not None and n_mm > max_mm:
@@ -214,4 +309,71 @@ def merge_all_reads(f1, f2, amplen, max_mm=None, min_qual=None):
             continue
 
         # s is encoded as a byte array. Convert it to a string before returning.
-        yield byte_array_to_str(s)
+        if annotate:
+            read = byte_array_to_str(s), int(n_mm), int(q.min()) - MIN_QUAL
+        else:
+            read = byte_array_to_str(s)
+        if ids:
+            read = seq_id, read
+        yield (tag, read) if tagged else read
+
+# Quality reported for reads from files without quality scores, so they
+# pass any quality filter.
+NO_QUAL = 1000
+
+def read_fasta(f):
+    """Generate FASTA records as (seq_id, seq) tuples from an open file
+    handle. Sequences may span several lines."""
+    seq_id = None
+    lines = []
+    for line in f:
+        line = line.rstrip()
+        if line.startswith('>'):
+            if seq_id is not None:
+                yield seq_id, ''.join(lines)
+            seq_id = line
+            lines = []
+        elif line:
+            if seq_id is None:
+                raise ValueError("Sequence ID doesn't begin with '>'.")
+            lines.append(line)
+    if seq_id is not None:
+        yield seq_id, ''.join(lines)
+
+def filter_merged_seqs(seqs, amplen, annotate=False):
+    """Filter sequences of reads that were already merged, such as those
+    read by read_fasta, keeping those of length amplen that contain only
+    A, C, G and T.
+
+    If annotate is True, tuples (seq, 0, NO_QUAL) are generated instead
+    of sequences, as for merge_read_pairs.
+    """
+    for seq in seqs:
+        seq = seq.upper()
+        if len(seq) != amplen or not set(seq) <= set('ACGT'):
+            continue
+        yield (seq, 0, NO_QUAL) if annotate else seq
+
+def filter_merged_reads(reads, amplen, min_qual=None, annotate=False,
+                        ids=False):
+    """Filter FASTQ records of reads that were already merged, as
+    generated by read_seqs, the same way merge_read_pairs filters merged
+    pairs: reads must have length amplen, no quality score lower than
+    min_qual and no Ns.
+
+    If annotate is True, tuples (seq, 0, min_qual) are generated instead
+    of sequences, and if ids is True, they are paired with the sequence
+    IDs, as for merge_read_pairs.
+    """
+    for seq_id, s, qual_id, q in reads:
+        if len(s) != amplen:
+            continue
+        if min_qual is not None and q.min() < min_qual + MIN_QUAL:
+            continue
+        if bN in s:
+            continue
+        if annotate:
+            read = byte_array_to_str(s), 0, int(q.min()) - MIN_QUAL
+        else:
+            read = byte_array_to_str(s)
+        yield (seq_id, read) if ids else read
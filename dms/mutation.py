@@ -57,6 +57,17 @@ WildType = _WildType()
 def is_wt(m):
     return isinstance(m, _WildType)
 
+@dataclass(frozen=True)
+class _OffScheme(object):
+    def __repr__(self):
+        return 'OffScheme'
+OffScheme = _OffScheme()
+"""Value to represent sequences with a codon that their library's codon
+scheme can't produce."""
+
+def is_off_scheme(m):
+    return isinstance(m, _OffScheme)
+
 @dataclass(frozen=True)
 class AminoAcidMutation:
     """An abstract amino acid mutation without codon information."""
@@ -0,0 +1,121 @@
+import array
+from dataclasses import dataclass
+
+import numpy as np
+
+from dms.codons import scheme_amino_acids
+from dms.dna import AMINO_ACIDS_PLUS_STOP
+from dms.mutation import AminoAcidMutation, Mutation, is_wt
+
+@dataclass(frozen=True)
+class DoubleMutantCounts:
+    """Counts of double amino acid mutants in sparse COO form.
+
+    first, second: arrays of the VariantRegistry ids of the two
+    mutations of each double mutant, with first < second.
+    counts: array of the number of reads of each double mutant.
+    total: the total number of reads in the sample.
+
+    Entries are sorted by (first, second) and unique.
+    """
+    first: np.ndarray
+    second: np.ndarray
+    counts: np.ndarray
+    total: int
+
+    def __len__(self):
+        return len(self.counts)
+
+    def keys(self, n_variants):
+        """Return an array packing each (first, second) pair into a
+        single integer, in the same sorted order as the entries."""
+        return self.first * np.int64(n_variants) + self.second
+
+def targeted_mutations(tile):
+    """Return the AminoAcidMutations a tile targets: every substitution
+    (including stops) at each of its positions that its codon scheme
+    encodes, or all of them if it has no scheme."""
+    aas = AMINO_ACIDS_PLUS_STOP
+    if tile.codon_scheme is not None:
+        scheme_aas = scheme_amino_acids(tile.codon_scheme)
+        aas = [aa for aa in aas if aa in scheme_aas]
+    return [AminoAcidMutation(pos, tile.wt_aa[pos], aa)
+            for pos in tile.positions
+            for aa in aas if aa != tile.wt_aa[pos]]
+
+def double_mutant_counts(n_variants, total, first, second, counts):
+    """Make a DoubleMutantCounts from arrays of the ids of the two
+    mutations and the count of each read, summing the counts of
+    repeated pairs.
+
+    n_variants: the number of variants in the VariantRegistry the ids
+    belong to.
+    """
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    keys, inverse = np.unique(first * np.int64(n_variants) + second,
+                              return_inverse=True)
+    summed = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(summed, inverse, np.asarray(counts, dtype=np.int64))
+    return DoubleMutantCounts(keys // n_variants, keys % n_variants, summed,
+                              total)
+
+def double_mutants(registry, tile, counts):
+    """Collect the double amino acid mutants in a sample.
+
+    registry: VariantRegistry that covers the tile's targeted_mutations.
+    counts: dict as returned by mutation_counts.
+
+    Returns a DoubleMutantCounts whose total is the number of reads in
+    counts. As with collapsed_and_filtered_counts, only reads whose
+    changes are all within the tile's positions count, and synonymous
+    codon changes are ignored, so reads with a single amino acid change
+    are left out.
+    """
+    first = array.array('q')
+    second = array.array('q')
+    pair_counts = array.array('q')
+    total = 0
+    for muts, n in counts.items():
+        total += n
+        if len(muts) < 2 or not all(isinstance(m, Mutation) for m in muts):
+            continue
+        aa_muts = [AminoAcidMutation.from_mutation(m) for m in muts]
+        aa_muts = [m for m in aa_muts if not is_wt(m)]
+        if len(aa_muts) != 2 or \
+           not all(m.pos in tile.positions for m in aa_muts):
+            continue
+        # Ids are in AminoAcidMutation.sort_key order.
+        a, b = sorted(registry.ids[m] for m in aa_muts)
+        first.append(a)
+        second.append(b)
+        pair_counts.append(n)
+    return double_mutant_counts(len(registry), total, first, second,
+                                pair_counts)
+
+def double_mutant_enrichment(params, registry, ref, sel):
+    """Compute the enrichment ratio of each double mutant.
+
+    ref, sel: DoubleMutantCounts of the reference and selected samples.
+
+    Returns a dict of arrays with an entry per double mutant with at
+    least params.min_ref_counts reference counts: 'first', 'second',
+    'ref_counts', 'sel_counts' and 'ER'. As for single mutants, double
+    mutants missing from the selected sample get params.pseudocount
+    counts.
+    """
+    keep = (ref.counts >= params.min_ref_counts) & (ref.counts > 0)
+    ref_keys = ref.keys(len(registry))[keep]
+    ref_counts = ref.counts[keep]
+    # Both sets of keys are sorted, so the selected counts can be
+    # aligned with a binary search.
+    sel_keys = sel.keys(len(registry))
+    sel_counts = np.zeros(len(ref_keys), dtype=np.int64)
+    if len(sel_keys) > 0:
+        i = np.minimum(np.searchsorted(sel_keys, ref_keys), len(sel_keys) - 1)
+        found = sel_keys[i] == ref_keys
+        sel_counts[found] = sel.counts[i[found]]
+    sel_counts = np.where(sel_counts > 0, sel_counts, params.pseudocount)
+    er = np.log2((sel_counts / sel.total) / (ref_counts / ref.total))
+    return dict(first=ref.first[keep], second=ref.second[keep],
+                ref_counts=ref_counts, sel_counts=sel_counts, ER=er)
@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import numpy as np
+
+from dms.mutation import AminoAcidMutation, WildType
+
+@dataclass(frozen=True)
+class VariantRegistry:
+    """Dense integer ids for amino acid variants.
+
+    WildType always has id 0 and the other variants follow in
+    AminoAcidMutation.sort_key order, so sorting ids sorts the variants
+    they stand for. Counts of variants are stored as NumPy vectors
+    indexed by id.
+    """
+    variants: Tuple
+    ids: Dict
+
+    def __len__(self):
+        return len(self.variants)
+
+    def vector(self, counts):
+        """Return a vector of the counts in a dict mapping variant to
+        count, with 0 for variants that aren't in the dict."""
+        v = np.zeros(len(self), dtype=np.int64)
+        if counts:
+            v[[self.ids[m] for m in counts]] = list(counts.values())
+        return v
+
+    def names(self, ids):
+        """Return an array of the names of the variants with the given
+        ids, e.g. 'WT' or 'N501Y'."""
+        names = np.array([repr(m) for m in self.variants], dtype=object)
+        return names[np.asarray(ids, dtype=np.int64)]
+
+def make_registry(all_counts):
+    """Make a VariantRegistry of the variants in an iterable of dicts
+    mapping variant to count, such as those returned by
+    collapsed_and_filtered_counts."""
+    variants = {WildType}
+    for counts in all_counts:
+        variants.update(counts)
+    variants = tuple(sorted(variants, key=AminoAcidMutation.sort_key))
+    return VariantRegistry(variants, {m : i for (i, m) in enumerate(variants)})
@@ -0,0 +1,105 @@
+import collections
+from dataclasses import dataclass
+from typing import Dict
+
+from dms.dna import reverse_complement
+
+# Value stored in the signature dicts for sequences shared by several
+# tiles, which therefore can't be used to tell them apart.
+AMBIGUOUS = -1
+
+@dataclass(frozen=True)
+class TileRouter:
+    """Assigns read pairs to one of several tiles sequenced together.
+
+    Reads are matched against precomputed signatures of each tile's
+    wild type sequence: the first k bases of the forward and reverse
+    reads, falling back to a vote over k-mers that occur in only one
+    tile for reads with sequencing errors near their start. Since the
+    signatures only look at the start of the reads, this works for
+    tiles of different lengths before the reads are merged.
+    """
+    k: int
+    prefixes1: Dict[bytes, int]
+    prefixes2: Dict[bytes, int]
+    kmers1: Dict[bytes, int]
+    kmers2: Dict[bytes, int]
+
+    def route(self, seq1, seq2):
+        """Return the index of the tile a read pair belongs to, or None
+        if it can't be determined.
+
+        seq1, seq2: forward and reverse reads as byte arrays, as
+        generated by dms.merge.read_seqs.
+        """
+        k = self.k
+        hits = {self.prefixes1.get(seq1[:k].tobytes()),
+                self.prefixes2.get(seq2[:k].tobytes())}
+        hits -= {None, AMBIGUOUS}
+        if len(hits) == 1:
+            return hits.pop()
+        if len(hits) > 1:
+            return None
+        votes = collections.Counter()
+        for seq, kmers in [(seq1, self.kmers1), (seq2, self.kmers2)]:
+            for i in range(0, len(seq) - k + 1, k):
+                tile = kmers.get(seq[i:i+k].tobytes(), AMBIGUOUS)
+                if tile != AMBIGUOUS:
+                    votes[tile] += 1
+        best = votes.most_common(2)
+        if len(best) == 0 or (len(best) == 2 and best[0][1] == best[1][1]):
+            return None
+        return best[0][0]
+
+def _add_signature(signatures, key, tile):
+    if signatures.get(key, tile) != tile:
+        signatures[key] = AMBIGUOUS
+    else:
+        signatures[key] = tile
+
+def make_tile_router(tiles, k=12):
+    """Precompute the signatures of a list of Tiles and return a
+    TileRouter that assigns read pairs to indices into the list."""
+    if any(tile.length < k for tile in tiles):
+        raise ValueError(f'tiles must be at least {k} bases long to be'
+                         ' routed.')
+    prefixes1 = {}
+    prefixes2 = {}
+    kmers1 = {}
+    kmers2 = {}
+    for i, tile in enumerate(tiles):
+        fwd = tile.wt_seq.encode('ascii')
+        rev = reverse_complement(tile.wt_seq).encode('ascii')
+        _add_signature(prefixes1, fwd[:k], i)
+        _add_signature(prefixes2, rev[:k], i)
+        for j in range(len(fwd) - k + 1):
+            _add_signature(kmers1, fwd[j:j+k], i)
+            _add_signature(kmers2, rev[j:j+k], i)
+    return TileRouter(k, prefixes1, prefixes2, kmers1, kmers2)
+
+def make_barcode_lookup(barcodes):
+    """Precompute a dict mapping each barcode, and every sequence one
+    mismatch away from it, to the barcode.
+
+    barcodes: iterable of barcode strings, all of the same length.
+
+    Sequences within one mismatch of more than one barcode are left out
+    so they are never assigned to the wrong one, but an exact match
+    always wins.
+    """
+    exact = {barcode.encode('ascii') : barcode for barcode in barcodes}
+    lookup = {}
+    for seq, barcode in exact.items():
+        for i in range(len(seq)):
+            for base in b'ACGTN':
+                if base == seq[i]:
+                    continue
+                variant = seq[:i] + bytes([base]) + seq[i+1:]
+                if lookup.get(variant, barcode) != barcode:
+                    lookup[variant] = AMBIGUOUS
+                else:
+                    lookup[variant] = barcode
+    lookup = {seq : barcode for (seq, barcode) in lookup.items()
+              if barcode != AMBIGUOUS}
+    lookup.update(exact)
+    return lookup
@@ -0,0 +1,105 @@
+import heapq
+import itertools
+from operator import itemgetter
+import os
+import pickle
+import sys
+import tempfile
+
+# Rough number of bytes a dict entry takes besides its key, used to
+# turn a memory budget into a number of entries.
+ENTRY_BYTES = 100
+
+# Number of items pickled together in a run file.
+RUN_BATCH = 10000
+
+def key_bytes(key):
+    """Estimate the memory taken by a read used as a dict key."""
+    if isinstance(key, tuple):
+        return sys.getsizeof(key) + sum(sys.getsizeof(k) for k in key)
+    return sys.getsizeof(key)
+
+def read_run(path):
+    """Generate the (read, count) items of a run file written by
+    SpillingCounter.spill."""
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+
+class SpillingCounter:
+    """Counts the occurrences of distinct reads like read_counts, within a
+    memory budget.
+
+    max_bytes: approximate memory budget for the table of distinct
+    reads, or None for no limit. When the table reaches it, it is
+    written to a temporary file in directory (created if needed, or the
+    system's temporary directory if None) as a run sorted by read and
+    emptied. items() merges the runs back together and removes them.
+
+    Used as a context manager, it also removes any runs left over if
+    counting fails before they are merged.
+    """
+    def __init__(self, max_bytes=None, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.counts = {}
+        self.runs = []
+        self.max_entries = None
+
+    def add(self, read, n=1):
+        self.counts[read] = self.counts.get(read, 0) + n
+        if self.max_bytes is None:
+            return
+        if self.max_entries is None:
+            self.max_entries = max(1, self.max_bytes //
+                                   (key_bytes(read) + ENTRY_BYTES))
+        if len(self.counts) >= self.max_entries:
+            self.spill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Remove the runs written so far."""
+        for path in self.runs:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.runs = []
+
+    def spill(self):
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix='dms-run-', suffix='.pickle',
+                                    dir=self.directory)
+        self.runs.append(path)
+        with os.fdopen(fd, 'wb') as f:
+            items = sorted(self.counts.items())
+            for i in range(0, len(items), RUN_BATCH):
+                pickle.dump(items[i:i + RUN_BATCH], f, pickle.HIGHEST_PROTOCOL)
+        self.counts = {}
+
+    def items(self):
+        """Generate (read, count) items for each distinct read. If any runs
+        were written, this is a k-way merge of the runs and what is still
+        in memory, in read order, and can only be done once."""
+        if not self.runs:
+            yield from self.counts.items()
+            return
+        runs = [read_run(path) for path in self.runs]
+        runs.append(iter(sorted(self.counts.items())))
+        self.counts = {}
+        try:
+            merged = heapq.merge(*runs, key=itemgetter(0))
+            for read, group in itertools.groupby(merged, key=itemgetter(0)):
+                yield read, sum(n for (_, n) in group)
+        finally:
+            self.close()
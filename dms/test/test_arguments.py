@@ -10,6 +10,9 @@ from dms.arguments import (ARGUMENTS,
                        parse_params,
                        parse_tiles,
                        parse_samples,
+                       read_pairs,
+                       parse_barcodes,
+                       sample_barcode,
                        parse_experiments,
                        parse_proteins,
                        parse_config,
@@ -397,6 +400,88 @@ class TestArguments(unittest.TestCase):
             tiles = parse_tiles(config)
             print(parse_samples(config, tiles))
 
+        # samples sequenced more than once
+        f4 = io.StringIO(textwrap.dedent(
+        """\
+        [Tile:T1]
+        wt_seq: 'GCTAGCTAGA'
+        first_aa: 1
+        cds_start: 0
+        cds_end: 9
+        positions: 1, 2, 3
+
+        [Samples]
+        1_Display: 'T1', ('Run1_R1.fastq.gz', 'Run1_R2.fastq.gz'), ('Run2_R1.fastq.gz', 'Run2_R2.fastq.gz')
+        1_Control: 'T1', ('Run1_R1.fastq.gz', 'Run1_R2.fastq.gz')
+        1_Lanes: 'T1', [('L001_R1.fastq.gz', 'L001_R2.fastq.gz'), ('L002_R1.fastq.gz', 'L002_R2.fastq.gz')]
+        1_Merged: 'T1', 'Merged.fastq.gz'
+        1_Mixed: 'T1', ('Run1_R1.fastq.gz', 'Run1_R2.fastq.gz'), ('Counts.tsv',)
+        1_Bad: 'T1', ('Run1_R1.fastq.gz', 'Run1_R2.fastq.gz'), 'Run2_R1.fastq.gz'
+        """
+        ))
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config.read_file(f4)
+        tiles = parse_tiles(config)
+        config.remove_option('Samples', '1_Bad')
+        samples = parse_samples(config, tiles)
+        self.assertEqual(samples['1_Display'], ('T1', (('Run1_R1.fastq.gz', 'Run1_R2.fastq.gz'), ('Run2_R1.fastq.gz', 'Run2_R2.fastq.gz'))))
+        self.assertEqual(read_pairs(samples['1_Display'][1]), (('Run1_R1.fastq.gz', 'Run1_R2.fastq.gz'), ('Run2_R1.fastq.gz', 'Run2_R2.fastq.gz')))
+        self.assertEqual(read_pairs(samples['1_Control'][1]), (('Run1_R1.fastq.gz', 'Run1_R2.fastq.gz'),))
+        self.assertEqual(read_pairs(samples['1_Lanes'][1]), (('L001_R1.fastq.gz', 'L001_R2.fastq.gz'), ('L002_R1.fastq.gz', 'L002_R2.fastq.gz')))
+        self.assertEqual(read_pairs(samples['1_Merged'][1]), (('Merged.fastq.gz',),))
+        self.assertEqual(read_pairs(samples['1_Mixed'][1]), (('Run1_R1.fastq.gz', 'Run1_R2.fastq.gz'), ('Counts.tsv',)))
+        config.set('Samples', '1_Bad', "'T1', ('Run1_R1.fastq.gz', 'Run1_R2.fastq.gz'), 'Run2_R1.fastq.gz'")
+        with self.assertRaises(ValueError):
+            parse_samples(config, tiles)
+
+    def testing_parse_barcodes(self):
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config.read_string(textwrap.dedent(
+        """\
+        [Tile:T1]
+        wt_seq: 'GCTAGCTAGA'
+        first_aa: 1
+        cds_start: 0
+        cds_end: 9
+
+        [Tile:T2]
+        wt_seq: 'GCTAGCTAGC'
+        first_aa: 4
+        cds_start: 0
+        cds_end: 9
+
+        [Samples]
+        1_Ref: 'T1', 'Lane1_R1.fastq.gz', 'Lane1_R2.fastq.gz'
+        2_Ref: 'T2', 'Lane1_R1.fastq.gz', 'Lane1_R2.fastq.gz'
+        1_Sel: 'T1', 'Lane1_R1.fastq.gz', 'Lane1_R2.fastq.gz'
+        1_Other: 'T1', 'Other_R1.fastq.gz', 'Other_R2.fastq.gz'
+
+        [Barcodes]
+        ACGTAC: '1_Ref', '2_Ref'
+        tgcatg: '1_Sel'
+        """
+        ))
+        tiles = parse_tiles(config)
+        samples = parse_samples(config, tiles)
+        parse_barcodes(config, samples)
+        self.assertEqual(samples['1_Ref'], ('T1', ('Lane1_R1.fastq.gz', 'Lane1_R2.fastq.gz'), 'ACGTAC'))
+        self.assertEqual(sample_barcode(samples['2_Ref']), 'ACGTAC')
+        self.assertEqual(sample_barcode(samples['1_Sel']), 'TGCATG')
+        self.assertIsNone(sample_barcode(samples['1_Other']))
+        for barcode, value in [('ACGTAC', "'1_Ref', '1_Sel'"),  # same tile
+                               ('ACGTAN', "'1_Other'"),         # not DNA
+                               ('ACGTA', "'1_Other'"),          # wrong length
+                               ('ACGTAA', "'3_Ref'"),           # undefined
+                               ('ACGTAA', "'1_Sel'")]:          # two barcodes
+            config.remove_section('Barcodes')
+            config.add_section('Barcodes')
+            config.set('Barcodes', 'TGCATG', "'1_Sel'")
+            config.set('Barcodes', barcode, value)
+            with self.assertRaises(ValueError):
+                parse_barcodes(config, parse_samples(config, tiles))
+
 
     @mock.patch('configparser.open')
     def testing_parse_experiments(self, mockFileOpen: mock.MagicMock):
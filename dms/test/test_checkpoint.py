@@ -0,0 +1,162 @@
+import argparse
+import os
+import random
+import tempfile
+import unittest
+
+from dms.checkpoint import (checkpoint_key, checkpoint_path, read_checkpoint,
+                            write_checkpoint)
+from dms.dna import reverse_complement
+from dms.main import get_stats_and_counts, mutation_counts, pair_mutation_counts
+from dms.tile import Tile
+
+WT_SEQ = 'ATGGCTAGCAAAGGTGAAGAACTGTTCACCGGTGTTGTTCCGATC'
+
+def write_fastq_pair(path1, path2, seqs, read_len=30):
+    with open(path1, 'wt') as f1, open(path2, 'wt') as f2:
+        for i, s in enumerate(seqs):
+            r1 = s[:read_len]
+            r2 = reverse_complement(s[len(s)-read_len:])
+            print(f'@{i} 1\n{r1}\n+\n{"I"*len(r1)}', file=f1)
+            print(f'@{i} 2\n{r2}\n+\n{"I"*len(r2)}', file=f2)
+
+def random_seqs(n, seed=0):
+    rng = random.Random(seed)
+    seqs = []
+    for _ in range(n):
+        s = list(WT_SEQ)
+        for _ in range(rng.randint(0, 2)):
+            i = rng.randrange(len(s))
+            s[i] = rng.choice('ACGT')
+        seqs.append(''.join(s))
+    return seqs
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.tile = Tile(wt_seq=WT_SEQ, first_aa=1, cds_start=0, cds_end=45)
+        self.params = argparse.Namespace(output_dir=self.dir.name,
+                                         checkpoint_dir='Checkpoints',
+                                         checkpoint_reads=None,
+                                         resume=False,
+                                         max_mismatches=None,
+                                         min_quality=None,
+                                         sweep=None,
+                                         max_reads=None,
+                                         fraction=None,
+                                         rarefaction=None,
+                                         umi_regex=None,
+                                         umi_length=None,
+                                         max_memory=None)
+        self.path1 = os.path.join(self.dir.name, 'R1.fastq')
+        self.path2 = os.path.join(self.dir.name, 'R2.fastq')
+        self.targets = {'S' : self.tile}
+        self.seqs = random_seqs(250)
+        write_fastq_pair(self.path1, self.path2, self.seqs)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testing_write_and_read(self):
+        path = os.path.join(self.dir.name, 'sub', 'x.pkl')
+        write_checkpoint(path, {'a' : 1}, {'b' : 2})
+        self.assertEqual(read_checkpoint(path, {'a' : 1}), {'b' : 2})
+        # A different key invalidates the checkpoint.
+        self.assertIsNone(read_checkpoint(path, {'a' : 2}))
+        # No temporary files are left behind.
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['x.pkl'])
+        # Missing and truncated checkpoints are ignored.
+        self.assertIsNone(read_checkpoint(path + '.missing', {'a' : 1}))
+        with open(path, 'r+b') as f:
+            f.truncate(5)
+        self.assertIsNone(read_checkpoint(path, {'a' : 1}))
+
+    def testing_key_depends_on_inputs(self):
+        key = checkpoint_key((self.path1, self.path2), self.targets,
+                             self.params)
+        self.assertEqual(key, checkpoint_key((self.path1, self.path2),
+                                             self.targets, self.params))
+        params = argparse.Namespace(**vars(self.params))
+        params.max_mismatches = 3
+        self.assertNotEqual(key, checkpoint_key((self.path1, self.path2),
+                                                self.targets, params))
+        write_fastq_pair(self.path1, self.path2, self.seqs[:10])
+        self.assertNotEqual(key, checkpoint_key((self.path1, self.path2),
+                                                self.targets, self.params))
+
+    def testing_chunked_counts(self):
+        expected = mutation_counts(self.seqs, self.tile)
+        self.params.checkpoint_reads = 40
+        counts = pair_mutation_counts(self.targets, self.path1, self.path2,
+                                      self.params)
+        self.assertEqual(counts, {'S' : expected})
+        # Chunk checkpoints are removed once the pair of files is complete.
+        path = checkpoint_path(self.params, 'S', (self.path1, self.path2))
+        self.assertEqual(os.listdir(os.path.dirname(path)),
+                         [os.path.basename(path)])
+
+    def testing_subsampled_chunked_counts(self):
+        self.params.fraction = 0.5
+        self.params.max_reads = 200
+        expected = pair_mutation_counts(self.targets, self.path1, self.path2,
+                                        self.params)
+        self.assertLess(sum(expected['S'].values()), 150)
+        self.params.checkpoint_reads = 40
+        self.assertEqual(pair_mutation_counts(self.targets, self.path1,
+                                              self.path2, self.params),
+                         expected)
+
+    def testing_resume(self):
+        self.params.checkpoint_reads = 40
+        expected = mutation_counts(self.seqs, self.tile)
+        key = checkpoint_key((self.path1, self.path2), self.targets,
+                             self.params)
+        # Pretend that a previous run finished the first two chunks, with
+        # deliberately wrong counts so we can tell they were reused.
+        marker = {'S' : {('marker',) : 1}}
+        for chunk in range(2):
+            write_checkpoint(checkpoint_path(self.params, 'S',
+                                             (self.path1, self.path2), chunk),
+                             dict(key, chunk=chunk, checkpoint_reads=40),
+                             marker)
+        self.params.resume = True
+        counts = pair_mutation_counts(self.targets, self.path1, self.path2,
+                                      self.params)['S']
+        rest = mutation_counts(self.seqs[80:], self.tile)
+        self.assertEqual(counts.pop(('marker',)), 2)
+        self.assertEqual(counts, rest)
+        # The completed sample is reused as a whole.
+        self.assertEqual(pair_mutation_counts(self.targets, self.path1,
+                                              self.path2, self.params)
+                         ['S'][('marker',)], 2)
+        # Without resume, everything is recounted.
+        self.params.resume = False
+        self.assertEqual(pair_mutation_counts(self.targets, self.path1,
+                                              self.path2, self.params),
+                         {'S' : expected})
+
+    def testing_top_up(self):
+        path3 = os.path.join(self.dir.name, 'R1_more.fastq')
+        path4 = os.path.join(self.dir.name, 'R2_more.fastq')
+        more_seqs = random_seqs(100, seed=1)
+        write_fastq_pair(path3, path4, more_seqs)
+        self.params.resume = True
+        # Counts of the first pair of files from a previous run, again
+        # with a marker so we can tell they were reused.
+        key = checkpoint_key((self.path1, self.path2), self.targets,
+                             self.params)
+        write_checkpoint(checkpoint_path(self.params, 'S',
+                                         (self.path1, self.path2)),
+                         key, {'S' : {('marker',) : 7}})
+        _, total, counts = get_stats_and_counts(
+            'S', [(self.path1, self.path2), (path3, path4)],
+            self.tile, self.params)
+        self.assertEqual(total, 7 + len(more_seqs))
+        self.params.resume = False
+        _, total, counts = get_stats_and_counts(
+            'S', [(self.path1, self.path2), (path3, path4)],
+            self.tile, self.params)
+        self.assertEqual(total, len(self.seqs) + len(more_seqs))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+
+import numpy as np
+
+from dms.codons import (CODONS, CODON_SCHEMES, amino_acid_counts,
+                        codon_count_tensor, codon_scheme_mask)
+from dms.dna import AMINO_ACIDS_PLUS_STOP
+from dms.main import (collapsed_and_filtered_counts, coverage_quantile,
+                      library_statistics, mutation_counts)
+from dms.mutation import AminoAcidMutation, OffScheme, WildType
+from dms.test.test_checkpoint import WT_SEQ, random_seqs
+from dms.tile import Tile, library_size
+
+class TestCodons(unittest.TestCase):
+    def testing_codon_count_tensor(self):
+        tile = Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                    positions=[6, 7, 10])
+        seqs = random_seqs(2000) + [WT_SEQ[:3] + 'GCC' + WT_SEQ[6:]] * 3
+        raw_counts = mutation_counts(seqs, tile)
+        tensor = codon_count_tensor(tile, raw_counts)
+        self.assertEqual(list(tensor['positions']), list(range(5, 20)))
+        self.assertEqual(tensor['counts'].shape, (15, 64))
+        self.assertEqual(tensor['total'], len(seqs))
+        # The synonymous change GCT -> GCC at position 6.
+        self.assertGreaterEqual(tensor['counts'][1, CODONS.index('GCC')], 3)
+
+        # The amino acid counts are a matrix multiply away.
+        total, counts = collapsed_and_filtered_counts(tile, raw_counts)
+        aa_counts = amino_acid_counts(tensor['counts'])
+        synonymous = 0
+        for i, pos in enumerate(tensor['positions'].tolist()):
+            for j, aa in enumerate(AMINO_ACIDS_PLUS_STOP):
+                if aa == tile.wt_aa[pos]:
+                    synonymous += aa_counts[i, j]
+                elif pos in tile.positions:
+                    self.assertEqual(aa_counts[i, j],
+                                     counts.get(AminoAcidMutation(pos, tile.wt_aa[pos], aa), 0))
+        self.assertEqual(tensor['wt'] + synonymous, counts[WildType])
+        self.assertTrue(np.all(aa_counts.sum(axis=1) == tensor['counts'].sum(axis=1)))
+
+    def testing_codon_schemes(self):
+        self.assertEqual(codon_scheme_mask('NNN').sum(), 64)
+        self.assertEqual(codon_scheme_mask('NNK').sum(), 32)
+        self.assertEqual(codon_scheme_mask('NNS').sum(), 32)
+        self.assertEqual(len(set(CODON_SCHEMES['22c'])), 22)
+        self.assertTrue(codon_scheme_mask('NNK')[CODONS.index('TAG')])
+        self.assertFalse(codon_scheme_mask('NNK')[CODONS.index('TAA')])
+        with self.assertRaises(ValueError):
+            Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                 codon_scheme='NNX')
+
+    def testing_off_scheme_counts(self):
+        tile = Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                    codon_scheme='NNK')
+        # GCC (NNS, not NNK) and GCG (both) at position 6.
+        off = WT_SEQ[:3] + 'GCC' + WT_SEQ[6:]
+        on = WT_SEQ[:3] + 'GCG' + WT_SEQ[6:]
+        raw_counts = mutation_counts([off, off, on, WT_SEQ], tile)
+        self.assertEqual(raw_counts[(OffScheme,)], 2)
+        self.assertEqual(library_statistics(tile, raw_counts)[2], 2)
+        total, counts = collapsed_and_filtered_counts(tile, raw_counts)
+        self.assertEqual(total, 4)
+        self.assertEqual(counts, {WildType : 2})
+
+        # Only codons at the tile's positions are held to the scheme.
+        tile = Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                    positions=[7, 10], codon_scheme='NNK')
+        raw_counts = mutation_counts([off, on], tile)
+        self.assertNotIn((OffScheme,), raw_counts)
+        self.assertEqual(sum(raw_counts.values()), 2)
+
+    def testing_coverage_quantile(self):
+        # Every amino acid of the 22c scheme is covered at position 6, but
+        # the stop it doesn't encode isn't.
+        tile = Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                    positions=[6], codon_scheme='22c')
+        seqs = [WT_SEQ[:3] + codon + WT_SEQ[6:]
+                for codon in CODON_SCHEMES['22c']]
+        raw_counts = mutation_counts(seqs, tile)
+        self.assertEqual(coverage_quantile(tile, raw_counts, 0), 1)
+        tile = Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                    positions=[6])
+        self.assertEqual(coverage_quantile(tile, raw_counts, 0), 0)
+
+    def testing_library_size(self):
+        tile = Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                    positions=[6, 7, 10])
+        self.assertEqual(library_size(tile), 60)
+        for scheme, size in [('NNN', 60), ('NNK', 60), ('22c', 57)]:
+            tile = Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                        positions=[6, 7, 10], codon_scheme=scheme)
+            self.assertEqual(library_size(tile), size)
+
+if __name__ == '__main__':
+    unittest.main()
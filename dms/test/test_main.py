@@ -0,0 +1,166 @@
+import argparse
+import contextlib
+import io
+import os
+import pickle
+import random
+import tempfile
+import unittest
+
+from dms.arguments import ARGUMENTS
+from dms.checkpoint import checkpoint_path
+from dms.dna import AMINO_ACIDS_PLUS_STOP, aa_codons
+from dms.main import expand_read_pairs, mutation_counts, process_all_samples
+from dms.test.test_checkpoint import WT_SEQ, random_seqs, write_fastq_pair
+from dms.tile import Tile
+
+def default_params(**kwargs):
+    params = argparse.Namespace(**{name : arg['default']
+                                   for (name, arg) in ARGUMENTS.items()})
+    params.use_multiprocessing = False
+    for name, value in kwargs.items():
+        setattr(params, name, value)
+    return params
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.tile = Tile(wt_seq=WT_SEQ, first_aa=1, cds_start=0, cds_end=45)
+        self.params = default_params(fastq_file_dir=self.dir.name,
+                                     output_dir=self.dir.name)
+        self.lanes = [random_seqs(100, seed=lane) for lane in range(3)]
+        for lane, seqs in enumerate(self.lanes, 1):
+            write_fastq_pair(os.path.join(self.dir.name, f'S_L00{lane}_R1.fastq'),
+                             os.path.join(self.dir.name, f'S_L00{lane}_R2.fastq'),
+                             seqs)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testing_expand_read_pairs(self):
+        path = lambda f: os.path.join(self.dir.name, f)
+        self.assertEqual(expand_read_pairs(self.params, ('a_R1.fastq', 'a_R2.fastq')),
+                         [(path('a_R1.fastq'), path('a_R2.fastq'))])
+        self.assertEqual(expand_read_pairs(self.params, ('S_L*_R1.fastq', 'S_L*_R2.fastq')),
+                         [(path(f'S_L00{lane}_R1.fastq'), path(f'S_L00{lane}_R2.fastq'))
+                          for lane in range(1, 4)])
+        self.assertEqual(expand_read_pairs(self.params, (('S_L001_R1.fastq', 'S_L001_R2.fastq'),
+                                                         ('S_L00[23]_R1.fastq', 'S_L00[23]_R2.fastq'))),
+                         [(path(f'S_L00{lane}_R1.fastq'), path(f'S_L00{lane}_R2.fastq'))
+                          for lane in range(1, 4)])
+        with self.assertRaises(ValueError):
+            expand_read_pairs(self.params, ('S_L*_R1.fastq', 'S_L00[12]_R2.fastq'))
+        with self.assertRaises(ValueError):
+            expand_read_pairs(self.params, ('X_L*_R1.fastq', 'X_L*_R2.fastq'))
+
+    def testing_lanes(self):
+        samples = {'1_Lanes' : ('T1', ('S_L*_R1.fastq', 'S_L*_R2.fastq')),
+                   '1_Lane1' : ('T1', ('S_L001_R1.fastq', 'S_L001_R2.fastq'))}
+        stats, counts = process_all_samples(self.params, {'T1' : self.tile}, samples)
+        raw_counts = mutation_counts(sum(self.lanes, []), self.tile)
+        self.assertEqual(stats['1_Lanes'][0], 300)
+        self.assertEqual(counts['1_Lanes'][0], 300)
+        self.assertEqual(counts['1_Lane1'][0], 100)
+        self.assertEqual(sum(counts['1_Lanes'][1].values()),
+                         sum(n for (muts, n) in raw_counts.items() if len(muts) <= 1))
+
+    def testing_merged_reads(self):
+        seqs = self.lanes[0] + ['ACGT' * 11, WT_SEQ[:-1] + 'N']
+        with open(os.path.join(self.dir.name, 'M.fastq'), 'wt') as f:
+            for i, s in enumerate(seqs):
+                print(f'@{i}\n{s}\n+\n{"I"*len(s)}', file=f)
+        with open(os.path.join(self.dir.name, 'M.fasta'), 'wt') as f:
+            for i, s in enumerate(seqs):
+                print(f'>{i}\n{s[:20]}\n{s[20:].lower()}', file=f)
+        distinct = mutation_counts(self.lanes[0], self.tile)
+        with open(os.path.join(self.dir.name, 'M.tsv'), 'wt') as f:
+            print('sequence\tcount', file=f)
+            for s in set(seqs):
+                print(f'{s}\t{seqs.count(s)}', file=f)
+        samples = {'1_Pairs' : ('T1', ('S_L001_R1.fastq', 'S_L001_R2.fastq')),
+                   '1_FASTQ' : ('T1', ('M.fastq',)),
+                   '1_FASTA' : ('T1', ('M.fasta',)),
+                   '1_Table' : ('T1', ('M.tsv',))}
+        stats, counts = process_all_samples(self.params, {'T1' : self.tile}, samples)
+        for sample in ['1_FASTQ', '1_FASTA', '1_Table']:
+            self.assertEqual(stats[sample], stats['1_Pairs'])
+            self.assertEqual(counts[sample], counts['1_Pairs'])
+        self.assertEqual(stats['1_Table'][0], sum(distinct.values()))
+
+    def testing_rarefaction(self):
+        samples = {'1_Lanes' : ('T1', ('S_L*_R1.fastq', 'S_L*_R2.fastq'))}
+        stats, counts = process_all_samples(self.params, {'T1' : self.tile}, samples)
+        self.params.rarefaction = [0.5, 0.25]
+        results = process_all_samples(self.params, {'T1' : self.tile}, samples)
+        self.assertEqual(sorted(results), [0.25, 0.5, 1.0])
+        self.assertEqual(results[1.0], (stats, counts))
+        totals = [results[depth][1]['1_Lanes'][0] for depth in [0.25, 0.5, 1.0]]
+        self.assertTrue(40 < totals[0] < 110 < totals[1] < 190)
+        # The subsamples are nested.
+        for (depth1, depth2) in [(0.25, 0.5), (0.5, 1.0)]:
+            counts1 = results[depth1][1]['1_Lanes'][1]
+            counts2 = results[depth2][1]['1_Lanes'][1]
+            self.assertTrue(all(n <= counts2[m] for (m, n) in counts1.items()))
+        self.params.sweep = [('max_mismatches', (0, 1))]
+        with self.assertRaises(ValueError):
+            process_all_samples(self.params, {'T1' : self.tile}, samples)
+
+    def testing_stop_coverage(self):
+        # A library of every substitution at position 2, in a random order.
+        tile = Tile(wt_seq=WT_SEQ, first_aa=1, cds_start=0, cds_end=45,
+                    positions=[2])
+        variants = [WT_SEQ[:3] + aa_codons(aa)[0] + WT_SEQ[6:]
+                    for aa in AMINO_ACIDS_PLUS_STOP]
+        seqs = variants * 50
+        random.Random(0).shuffle(seqs)
+        write_fastq_pair(os.path.join(self.dir.name, 'Lib_R1.fastq'),
+                         os.path.join(self.dir.name, 'Lib_R2.fastq'),
+                         seqs)
+        samples = {'1_Ref' : ('T1', ('Lib_R1.fastq', 'Lib_R2.fastq')),
+                   '1_Sel' : ('T1', ('Lib_R1.fastq', 'Lib_R2.fastq'))}
+        self.params.stop_coverage = 10
+        self.params.stop_quantile = 0
+        self.params.stop_check_reads = 100
+        stats, counts = process_all_samples(self.params, {'T1' : tile},
+                                            samples, ['1_Ref'])
+        # Only the reference sample stops early, once every variant has
+        # at least 10 counts.
+        self.assertLess(stats['1_Ref'][0], len(seqs))
+        self.assertEqual(stats['1_Ref'][0] % 100, 0)
+        self.assertGreaterEqual(min(counts['1_Ref'][1].values()), 10)
+        self.assertEqual(stats['1_Sel'][0], len(seqs))
+        # The same applies when checkpointing in chunks.
+        self.params.checkpoint_reads = 200
+        stats, counts = process_all_samples(self.params, {'T1' : tile},
+                                            samples, ['1_Ref'])
+        self.assertLess(stats['1_Ref'][0], len(seqs))
+        self.assertEqual(stats['1_Ref'][0] % 200, 0)
+        self.assertGreaterEqual(min(counts['1_Ref'][1].values()), 10)
+        # The read pairs used are counted as read, also when --max-reads
+        # cuts the last chunk short, and saved in the checkpoint.
+        self.params.max_reads = 350
+        self.params.stop_coverage = 1000
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            stats, counts = process_all_samples(self.params, {'T1' : tile},
+                                                samples, ['1_Ref'])
+        self.assertEqual(stats['1_Ref'][0], 350)
+        self.assertIn('1_Ref: coverage target not reached after 350 read'
+                      ' pairs.', out.getvalue())
+        path = checkpoint_path(self.params, ['1_Ref'],
+                               [os.path.join(self.dir.name, 'Lib_R1.fastq'),
+                                os.path.join(self.dir.name, 'Lib_R2.fastq')])
+        with open(path, 'rb') as f:
+            _, (raw_counts, n_pairs) = pickle.load(f)
+        self.assertEqual(n_pairs, 350)
+        # Resuming reports the saved number.
+        self.params.resume = True
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(process_all_samples(self.params, {'T1' : tile},
+                                                 samples, ['1_Ref']),
+                             (stats, counts))
+        self.assertIn('after 350 read pairs.', out.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,8 +10,10 @@ from dms.merge import (
     byte_array_to_str,
     str_to_byte_array,
     compare_seq_ids,
+    in_subsample,
     merge_reads,
     merge_all_reads,
+    merge_read_pairs,
     read_line,
     read_seqs,
     reverse_complement,
@@ -461,11 +463,81 @@ class TestMerge(unittest.TestCase):
             for res, ans in zip(results, answers):
                 self.assertEqual(res, ans)
 
-
-
-
-
-
+    def test_merge_read_pairs_annotate(self):
+        amplen = 200
+        seqs = []
+        quals = []
+        for i in range(500):
+            s, q, s1, s2, q1, q2, mm_positions = \
+                random_merge_reads_test_case(min_len=amplen, max_len=amplen)
+            seqs.append((s1, s2))
+            quals.append((q1, q2))
+        s1s, s2s = zip(*seqs)
+        q1s, q2s = zip(*quals)
+        f1 = fastq_string(s1s, q1s, 1)
+        f2 = fastq_string(s2s, q2s, 2)
+        pairs = list(zip(read_seqs(io.StringIO(f1)), read_seqs(io.StringIO(f2))))
+        annotated = list(merge_read_pairs(pairs, amplen, annotate=True))
+        # Filtering the annotated reads gives the same result as
+        # filtering while merging.
+        for max_mm, min_qual in [(0, 0), (3, 10), (10, 20), (None, 15)]:
+            expected = list(merge_read_pairs(pairs, amplen, max_mm, min_qual))
+            results = [s for (s, mm, q) in annotated
+                       if (max_mm is None or mm <= max_mm) and q >= min_qual]
+            self.assertEqual(results, expected)
+
+    def test_merge_read_pairs_tagged(self):
+        # Pairs of two amplicon lengths merged in one pass give the same
+        # reads as merging each length separately.
+        amplens = [150, 200]
+        tagged_pairs = []
+        for i in range(200):
+            tag = i % 2
+            s, q, s1, s2, q1, q2, mm_positions = \
+                random_merge_reads_test_case(min_len=amplens[tag],
+                                             max_len=amplens[tag])
+            r1, = read_seqs(io.StringIO(fastq_string([s1], [q1], 1)))
+            r2, = read_seqs(io.StringIO(fastq_string([s2], [q2], 2)))
+            tagged_pairs.append((tag, (r1, r2)))
+        merged = list(merge_read_pairs(tagged_pairs, amplens.__getitem__, 5,
+                                       10, ids=True, tagged=True))
+        for tag, amplen in enumerate(amplens):
+            pairs = [pair for (t, pair) in tagged_pairs if t == tag]
+            self.assertEqual([read for (t, read) in merged if t == tag],
+                             list(merge_read_pairs(pairs, amplen, 5, 10,
+                                                   ids=True)))
+
+    def test_read_seqs_fraction(self):
+        amplen = 100
+        seqs = []
+        quals = []
+        for i in range(1000):
+            s, q, s1, s2, q1, q2, mm_positions = \
+                random_merge_reads_test_case(min_len=amplen, max_len=amplen)
+            seqs.append((s1, s2))
+            quals.append((q1, q2))
+        s1s, s2s = zip(*seqs)
+        q1s, q2s = zip(*quals)
+        f1 = fastq_string(s1s, q1s, 1)
+        f2 = fastq_string(s2s, q2s, 2)
+        all_pairs = list(zip(read_seqs(io.StringIO(f1)),
+                             read_seqs(io.StringIO(f2))))
+        pairs = list(zip(read_seqs(io.StringIO(f1), 0.25),
+                         read_seqs(io.StringIO(f2), 0.25)))
+        self.assertEqual(len(pairs), len(all_pairs))
+        kept = [i for (i, (r1, r2)) in enumerate(pairs) if r1 is not None]
+        # The reads of a pair are kept or dropped together, and the same
+        # reads are kept every time.
+        self.assertTrue(all((r1 is None) == (r2 is None) for (r1, r2) in pairs))
+        self.assertEqual(kept, [i for (i, (r1, _)) in enumerate(all_pairs)
+                                if in_subsample(r1[0], 0.25)])
+        self.assertTrue(150 < len(kept) < 350)
+        for i in kept:
+            self.assertEqual(pairs[i][0][0], all_pairs[i][0][0])
+            self.assertTrue((pairs[i][1][1] == all_pairs[i][1][1]).all())
+        # Subsamples are nested.
+        self.assertTrue(all(in_subsample(r1[0], 0.5) for (r1, _)
+                            in (all_pairs[i] for i in kept)))
 
 
 if __name__ == '__main__':
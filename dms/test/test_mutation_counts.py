@@ -2,7 +2,8 @@ import unittest
 
 from dms.tile import Tile
 from dms.mutation import Mutation
-from dms.main import mutation_counts
+from dms.main import (filtered_histogram_counts, mutation_counts,
+                      mutation_histograms)
 
 class TestMutCounts(unittest.TestCase):
     def testing_uncommon_iterables(self):
@@ -202,5 +203,21 @@ class TestMutCounts(unittest.TestCase):
         self.assertEqual(mutation_counts(seqs, tile_four)[(Mutation(pos=1, wt_aa='I', aa='L', codon='CTC')),], 91)
         self.assertEqual(mutation_counts(seqs, tile_five)[(Mutation(pos=2, wt_aa='I', aa='M', codon='ATG')),], 12)
 
+    def testing_histograms(self):
+        tile = Tile(wt_seq='AATCCCAAG', cds_start=0, cds_end=9, first_aa=1, positions=None)
+        # reads annotated with (mismatches, min quality)
+        reads = 5*[('AATCCCAAG', 0, 30)] + 3*[('AATCCCAAG', 4, 12)] + \
+                7*[('TCTCCCAAG', 1, 25)] + 2*[('TCTCCCAAG', 2, 8)] + \
+                [('AATCAAAAG', 9, 40)]
+        hists = mutation_histograms(reads, tile)
+        self.assertEqual(sum(sum(h.values()) for h in hists.values()), len(reads))
+        for max_mm in [None, 0, 1, 2, 4, 9]:
+            for min_qual in [None, 8, 12, 25, 30, 40]:
+                seqs = [s for (s, mm, q) in reads
+                        if (max_mm is None or mm <= max_mm)
+                        and (min_qual is None or q >= min_qual)]
+                self.assertEqual(filtered_histogram_counts(hists, max_mm, min_qual),
+                                 mutation_counts(seqs, tile))
+
 if __name__ == '__main__':
     unittest.main()
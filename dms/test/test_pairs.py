@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+
+from dms.codons import CODONS, scheme_amino_acids
+from dms.dna import translate_sequence
+from dms.main import mutation_counts
+from dms.mutation import AminoAcidMutation
+from dms.pairs import (double_mutant_counts, double_mutant_enrichment,
+                       double_mutants, targeted_mutations)
+from dms.registry import make_registry
+from dms.test.test_checkpoint import WT_SEQ
+from dms.test.test_main import default_params
+from dms.tile import Tile, library_size
+
+def mutate(seq, i, codon):
+    return seq[:i] + codon + seq[i+3:]
+
+class TestPairs(unittest.TestCase):
+    def setUp(self):
+        self.tile = Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                         positions=[6, 7, 10])
+        self.a = AminoAcidMutation(6, self.tile.wt_aa[6], 'W')
+        self.b = AminoAcidMutation(7, self.tile.wt_aa[7], 'W')
+        self.c = AminoAcidMutation(10, self.tile.wt_aa[10], 'W')
+        self.ab = mutate(mutate(WT_SEQ, 3, 'TGG'), 6, 'TGG')
+        self.ac = mutate(mutate(WT_SEQ, 3, 'TGG'), 15, 'TGG')
+
+    def testing_double_mutants(self):
+        # A synonymous third change leaves a double mutant, while a
+        # change outside the tile's positions drops the read.
+        wt_codon = WT_SEQ[30:33]
+        syn = next(c for c in CODONS if c != wt_codon and
+                   translate_sequence(c) == translate_sequence(wt_codon))
+        seqs = [self.ab, mutate(self.ab, 30, syn), self.ac, WT_SEQ,
+                mutate(WT_SEQ, 3, 'TGG'), mutate(self.ab, 36, 'TGG')]
+        registry = make_registry([dict.fromkeys(targeted_mutations(self.tile),
+                                                0)])
+        self.assertEqual(len(registry), 1 + 3 * 20)
+        doubles = double_mutants(registry, self.tile,
+                                 mutation_counts(seqs, self.tile))
+        ids = registry.ids
+        self.assertEqual(list(doubles.first), [ids[self.a], ids[self.a]])
+        self.assertEqual(list(doubles.second), [ids[self.b], ids[self.c]])
+        self.assertEqual(list(doubles.counts), [2, 1])
+        self.assertEqual(doubles.total, len(seqs))
+
+    def testing_targeted_mutations(self):
+        self.assertEqual(len(targeted_mutations(self.tile)), 3 * 20)
+        # With a codon scheme, only the amino acids it encodes.
+        for scheme in ['NNK', '22c']:
+            tile = Tile(wt_seq=WT_SEQ, first_aa=5, cds_start=0, cds_end=45,
+                        positions=[6, 7, 10], codon_scheme=scheme)
+            muts = targeted_mutations(tile)
+            self.assertEqual(len(muts), library_size(tile))
+            self.assertTrue(all(m.aa in scheme_amino_acids(scheme) and
+                                m.aa != m.wt_aa for m in muts))
+
+    def testing_double_mutant_enrichment(self):
+        registry = make_registry([{self.a : 0, self.b : 0, self.c : 0}])
+        # Repeated pairs are summed.
+        ref = double_mutant_counts(len(registry), 100, [1, 1, 2, 1],
+                                   [3, 2, 3, 2], [20, 4, 1, 6])
+        self.assertEqual(list(ref.first), [1, 1, 2])
+        self.assertEqual(list(ref.second), [2, 3, 3])
+        self.assertEqual(list(ref.counts), [10, 20, 1])
+        sel = double_mutant_counts(len(registry), 50, [1], [2], [30])
+        params = default_params(min_ref_counts=5)
+        data = double_mutant_enrichment(params, registry, ref, sel)
+        self.assertEqual(list(data['first']), [1, 1])
+        self.assertEqual(list(data['second']), [2, 3])
+        self.assertEqual(list(data['sel_counts']), [30, params.pseudocount])
+        self.assertTrue(np.allclose(data['ER'],
+                                    np.log2([(30/50)/(10/100),
+                                             (params.pseudocount/50)/(20/100)])))
+
+if __name__ == '__main__':
+    unittest.main()
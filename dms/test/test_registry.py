@@ -0,0 +1,47 @@
+import unittest
+
+import numpy as np
+
+from dms.main import process_all_experiments
+from dms.mutation import AminoAcidMutation, WildType
+from dms.registry import make_registry
+from dms.test.test_main import default_params
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.a = AminoAcidMutation(2, 'A', 'G')
+        self.b = AminoAcidMutation(2, 'A', 'C')
+        self.c = AminoAcidMutation(10, 'K', 'R')
+        self.counts = {'1_Ref' : (100, {WildType : 50, self.c : 30,
+                                        self.a : 15, self.b : 5}),
+                       '1_Sel' : (80, {WildType : 20, self.a : 60})}
+
+    def testing_registry(self):
+        registry = make_registry([{self.c : 1, self.a : 2}, {self.b : 3}])
+        self.assertEqual(registry.variants,
+                         (WildType, self.b, self.a, self.c))
+        self.assertEqual(registry.ids[WildType], 0)
+        self.assertEqual(list(registry.vector({self.a : 4, WildType : 7})),
+                         [7, 0, 4, 0])
+        self.assertEqual(list(registry.names([3, 0, 1])),
+                         ['K10R', 'WT', 'A2C'])
+
+    def testing_process_all_experiments(self):
+        params = default_params(min_ref_counts=10)
+        registry = make_registry(c for (_, c) in self.counts.values())
+        data = process_all_experiments(params, {}, {},
+                                       {'1_A' : ('1_Ref', '1_Sel')},
+                                       self.counts, registry)['1_A']
+        self.assertEqual(list(registry.names(data['variant'])),
+                         ['WT', 'A2G', 'K10R'])
+        self.assertEqual(list(data['ref_counts']), [50, 15, 30])
+        # Variants missing from the selected sample get the pseudocount.
+        self.assertEqual(list(data['sel_counts']),
+                         [20, 60, params.pseudocount])
+        self.assertTrue(np.allclose(data['ER'],
+                                    np.log2([(20/80)/(50/100),
+                                             (60/80)/(15/100),
+                                             (params.pseudocount/80)/(30/100)])))
+
+if __name__ == '__main__':
+    unittest.main()
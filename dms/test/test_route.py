@@ -0,0 +1,132 @@
+import os
+import random
+import tempfile
+import unittest
+
+import mock
+import numpy as np
+
+from dms.dna import reverse_complement
+from dms.main import merge_filters, mutation_counts, process_all_samples
+from dms.route import make_barcode_lookup, make_tile_router
+from dms.test.test_checkpoint import WT_SEQ, random_seqs, write_fastq_pair
+from dms.test.test_main import default_params
+from dms.tile import Tile
+
+WT_SEQ2 = 'ATGAGCAAAGGAGAAGAACTTTTCACTGGAGTTGTCCCAATTCTT'
+
+def as_bytes(s):
+    return np.frombuffer(s.encode('ascii'), dtype=np.uint8)
+
+class TestRoute(unittest.TestCase):
+    def setUp(self):
+        self.tiles = [Tile(wt_seq=WT_SEQ, first_aa=1, cds_start=0, cds_end=45),
+                      Tile(wt_seq=WT_SEQ2, first_aa=16, cds_start=0, cds_end=45)]
+        self.router = make_tile_router(self.tiles)
+
+    def route(self, seq, read_len=30):
+        return self.router.route(as_bytes(seq[:read_len]),
+                                 as_bytes(reverse_complement(seq[-read_len:])))
+
+    def testing_route_prefixes(self):
+        self.assertEqual(self.route(WT_SEQ), 0)
+        self.assertEqual(self.route(WT_SEQ2), 1)
+
+    def testing_route_errors_at_start(self):
+        # Mismatches in the first bases of both reads fall back to k-mers.
+        seq = 'T' + WT_SEQ2[1:-1] + 'A'
+        self.assertEqual(self.route(seq), 1)
+
+    def testing_unroutable(self):
+        self.assertIsNone(self.route('ACGT' * 12))
+        # Reads that look like different tiles at each end are ambiguous.
+        self.assertIsNone(self.route(WT_SEQ[:22] + WT_SEQ2[22:]))
+
+    def testing_short_tile(self):
+        with self.assertRaises(ValueError):
+            make_tile_router([Tile(wt_seq='ATGGCT', first_aa=1, cds_start=0,
+                                   cds_end=6)])
+
+    def testing_barcode_lookup(self):
+        lookup = make_barcode_lookup(['ACGTAC', 'ACGTTC', 'GGCCAA'])
+        self.assertEqual(lookup[b'ACGTAC'], 'ACGTAC')
+        self.assertEqual(lookup[b'ACGTTC'], 'ACGTTC')
+        self.assertEqual(lookup[b'GGCNAA'], 'GGCCAA')
+        self.assertEqual(lookup[b'TGCCAA'], 'GGCCAA')
+        # One mismatch away from both of the first two barcodes.
+        self.assertNotIn(b'ACGTGC', lookup)
+        self.assertNotIn(b'TTCCAT', lookup)
+
+class TestRoutedSamples(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.tiles = {'T1' : Tile(wt_seq=WT_SEQ, first_aa=1, cds_start=0,
+                                  cds_end=45),
+                      'T2' : Tile(wt_seq=WT_SEQ2, first_aa=16, cds_start=0,
+                                  cds_end=45)}
+        self.seqs1 = random_seqs(150, seed=1)
+        self.seqs2 = [WT_SEQ2] * 80 + [WT_SEQ2[:3] + 'GCT' + WT_SEQ2[6:]] * 20
+        seqs = self.seqs1 + self.seqs2
+        random.Random(0).shuffle(seqs)
+        write_fastq_pair(os.path.join(self.dir.name, 'P_R1.fastq'),
+                         os.path.join(self.dir.name, 'P_R2.fastq'),
+                         seqs)
+        self.samples = {'1_Ref' : ('T1', ('P_R1.fastq', 'P_R2.fastq')),
+                        '2_Ref' : ('T2', ('P_R1.fastq', 'P_R2.fastq'))}
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testing_routed_counts(self):
+        params = default_params(fastq_file_dir=self.dir.name,
+                                output_dir=self.dir.name,
+                                route_tiles=True)
+        with mock.patch('dms.main.merge_filters',
+                        wraps=merge_filters) as filters:
+            stats, counts = process_all_samples(params, self.tiles,
+                                                self.samples)
+        # The reads of both samples are merged in one pass.
+        self.assertEqual(filters.call_count, 1)
+        self.assertEqual(stats['1_Ref'][0], len(self.seqs1))
+        self.assertEqual(stats['2_Ref'][0], len(self.seqs2))
+        expected = mutation_counts(self.seqs1, self.tiles['T1'])
+        self.assertEqual(sum(counts['1_Ref'][1].values()),
+                         sum(n for (muts, n) in expected.items() if len(muts) <= 1))
+        # Both samples are counted from a single checkpointed task.
+        checkpoints = os.listdir(os.path.join(self.dir.name, 'Checkpoints'))
+        self.assertEqual(len(checkpoints), 1)
+        self.assertTrue(checkpoints[0].startswith('1_Ref+2_Ref.'))
+
+    def testing_barcoded_counts(self):
+        # Prefix each read pair with the barcode of its sample, with a
+        # sequencing error in some of them and an unknown barcode in one.
+        seqs = (['ACGTAC' + s for s in self.seqs1] +
+                ['TGCATG' + s for s in self.seqs2[:50]] +
+                ['TGAATG' + s for s in self.seqs2[50:]] +
+                ['GGGGGG' + WT_SEQ])
+        random.Random(1).shuffle(seqs)
+        # The reverse reads don't reach the barcode.
+        write_fastq_pair(os.path.join(self.dir.name, 'B_R1.fastq'),
+                         os.path.join(self.dir.name, 'B_R2.fastq'),
+                         seqs)
+        samples = {'1_Ref' : ('T1', ('B_R1.fastq', 'B_R2.fastq'), 'ACGTAC'),
+                   '2_Ref' : ('T2', ('B_R1.fastq', 'B_R2.fastq'), 'TGCATG')}
+        params = default_params(fastq_file_dir=self.dir.name,
+                                output_dir=self.dir.name)
+        stats, counts = process_all_samples(params, self.tiles, samples)
+        self.assertEqual(stats['1_Ref'][0], len(self.seqs1))
+        self.assertEqual(stats['2_Ref'][0], len(self.seqs2))
+        expected = mutation_counts(self.seqs1, self.tiles['T1'])
+        self.assertEqual(sum(counts['1_Ref'][1].values()),
+                         sum(n for (muts, n) in expected.items() if len(muts) <= 1))
+
+    def testing_same_tile(self):
+        params = default_params(fastq_file_dir=self.dir.name,
+                                output_dir=self.dir.name,
+                                route_tiles=True)
+        self.samples['2_Ref'] = ('T1', ('P_R1.fastq', 'P_R2.fastq'))
+        with self.assertRaises(ValueError):
+            process_all_samples(params, self.tiles, self.samples)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import random
+import tempfile
+import unittest
+
+import mock
+
+from dms.main import process_all_samples, read_counts, seq_mutation_counts
+from dms.spill import SpillingCounter
+from dms.test.test_checkpoint import WT_SEQ, random_seqs
+from dms.test.test_main import default_params
+from dms.tile import Tile
+
+class TestSpill(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testing_spilled_counts(self):
+        seqs = random_seqs(500, seed=3)
+        # A tiny budget spills a run every few reads.
+        counter = SpillingCounter(max_bytes=2000, directory=self.dir.name)
+        for seq in seqs:
+            counter.add(seq)
+        self.assertGreater(len(counter.runs), 10)
+        tile = Tile(wt_seq=WT_SEQ, first_aa=1, cds_start=0, cds_end=45)
+        self.assertEqual(seq_mutation_counts(counter, tile),
+                         seq_mutation_counts(read_counts(seqs), tile))
+        # The runs are removed once merged.
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def testing_annotated_reads(self):
+        reads = [(seq, i % 3, 30 + i % 5)
+                 for (i, seq) in enumerate(random_seqs(300, seed=4))]
+        counter = SpillingCounter(max_bytes=1, directory=self.dir.name)
+        for read in reads:
+            counter.add(read)
+        self.assertEqual(dict(counter.items()), read_counts(reads))
+
+    def testing_failed_counts(self):
+        # Runs are written next to the checkpoints and removed when
+        # counting fails part way through a file.
+        rng = random.Random(5)
+        with open(os.path.join(self.dir.name, 'S.tsv'), 'wt') as f:
+            for _ in range(20000):
+                print(''.join(rng.choices('ACGT', k=len(WT_SEQ))) + '\t1',
+                      file=f)
+            print('not a count', file=f)
+        tile = Tile(wt_seq=WT_SEQ, first_aa=1, cds_start=0, cds_end=45)
+        params = default_params(fastq_file_dir=self.dir.name,
+                                output_dir=self.dir.name, max_memory=1)
+        with mock.patch.object(SpillingCounter, 'spill', autospec=True,
+                               side_effect=SpillingCounter.spill) as spill:
+            with self.assertRaises(ValueError):
+                process_all_samples(params, {'T1' : tile},
+                                    {'1_S' : ('T1', ('S.tsv',))})
+        self.assertGreater(spill.call_count, 0)
+        self.assertEqual(os.listdir(os.path.join(self.dir.name,
+                                                 'Checkpoints')), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from dms.main import process_all_samples
+from dms.test.test_checkpoint import WT_SEQ, random_seqs, write_fastq_pair
+from dms.test.test_main import default_params
+from dms.tile import Tile
+from dms.umi import UMICounter, UMISet, pack_umi, umi_extractor
+
+def as_bytes(s):
+    return np.frombuffer(s.encode('ascii'), dtype=np.uint8)
+
+def umi_set(*umis):
+    return UMISet(np.array(sorted(pack_umi(u) for u in umis), dtype=np.uint64))
+
+class TestUMI(unittest.TestCase):
+    def testing_pack_umi(self):
+        self.assertEqual(pack_umi('ACGT'), 0b100011011)
+        self.assertNotEqual(pack_umi('A'), pack_umi('AA'))
+        self.assertIsNone(pack_umi('ACNT'))
+        with self.assertRaises(ValueError):
+            pack_umi('A' * 17)
+
+    def testing_umi_extractor(self):
+        pair = (('@r1:AACC 1', as_bytes('GGTTACGT'), '+', as_bytes('IIIIIIII')),
+                ('@r1:AACC 2', as_bytes('ACGT'), '+', as_bytes('IIII')))
+        extract = umi_extractor(default_params(umi_regex=r':([ACGTN]+) '))
+        self.assertEqual(extract(pair), (pack_umi('AACC'), pair))
+        umi, trimmed = umi_extractor(default_params(umi_length=4))(pair)
+        self.assertEqual(umi, pack_umi('GGTT'))
+        self.assertEqual(trimmed[0][1].tobytes(), b'ACGT')
+        self.assertEqual(trimmed[0][3].tobytes(), b'IIII')
+
+    def testing_umi_clusters(self):
+        umis = umi_set('AAAA', 'AAAC', 'AACC', 'GGGG', 'GGG', 'TTTT')
+        self.assertEqual(umis.count(), 6)
+        # AAAA-AAAC-AACC are chained by single mismatches, while GGG has
+        # a different length from GGGG.
+        self.assertEqual(umis.count(1), 4)
+        self.assertEqual(umi_set('AAAA', 'CCCC') + umi_set('CCCC'),
+                         umi_set('AAAA', 'CCCC'))
+        self.assertEqual(UMISet.union([umi_set('AAAA', 'CCCC'),
+                                       umi_set('CCCC'), umi_set('GGGG')]),
+                         umi_set('AAAA', 'CCCC', 'GGGG'))
+
+    def testing_umi_counter(self):
+        counter = UMICounter(buffer_size=3)
+        for read, umi in [('x', 'AAAA'), ('y', 'AAAA'), ('x', 'AAAA'),
+                          ('x', 'CCCC'), ('x', 'AAAA'), ('y', 'AAAA')]:
+            counter.add(read, pack_umi(umi))
+        self.assertEqual(counter.read_umis(),
+                         {'x' : umi_set('AAAA', 'CCCC'), 'y' : umi_set('AAAA')})
+
+    def testing_umi_counter_memory(self):
+        # With many duplicates, the runs held between merges stay within
+        # twice the distinct pairs however many reads are added.
+        umis = ['AAAA', 'CCCC', 'GGGG', 'TTTT', 'ACGT']
+        pairs = [(read, umi) for read in 'abcdefghij' for umi in umis]
+        counter = UMICounter(buffer_size=4)
+        for _ in range(20):
+            for read, umi in pairs:
+                counter.add(read, pack_umi(umi))
+                self.assertLessEqual(sum(len(r) for r in counter.runs),
+                                     2 * len(pairs))
+        self.assertEqual(counter.read_umis(),
+                         {read : umi_set(*umis) for read in 'abcdefghij'})
+
+class TestUMICounts(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.tiles = {'T1' : Tile(wt_seq=WT_SEQ, first_aa=1, cds_start=0,
+                                  cds_end=45)}
+        self.samples = {'1_Ref' : ('T1', ('U_R1.fastq', 'U_R2.fastq'))}
+        # Three PCR duplicates of each molecule, one duplicate with an
+        # error in its UMI and one without a valid UMI.
+        self.seqs = random_seqs(100, seed=2)
+        rng = random.Random(2)
+        umis = [''.join(rng.choice('ACGT') for _ in range(8))
+                for _ in self.seqs]
+        reads = [umi + s for (umi, s) in zip(umis, self.seqs)] * 3
+        error = 'A' if umis[0][0] != 'A' else 'C'
+        reads += [error + umis[0][1:] + self.seqs[0], 'NNNNNNNN' + self.seqs[1]]
+        write_fastq_pair(os.path.join(self.dir.name, 'U_R1.fastq'),
+                         os.path.join(self.dir.name, 'U_R2.fastq'),
+                         reads)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testing_deduplicated_counts(self):
+        for mismatches, expected in [(0, 101), (1, 100)]:
+            params = default_params(fastq_file_dir=self.dir.name,
+                                    output_dir=self.dir.name,
+                                    umi_length=8, umi_mismatches=mismatches)
+            stats, counts = process_all_samples(params, self.tiles,
+                                                self.samples)
+            self.assertEqual(stats['1_Ref'][0], expected)
+
+    def testing_max_memory_rejected(self):
+        params = default_params(fastq_file_dir=self.dir.name,
+                                output_dir=self.dir.name, umi_length=8,
+                                max_memory=1)
+        with self.assertRaises(ValueError):
+            process_all_samples(params, self.tiles, self.samples)
+
+if __name__ == '__main__':
+    unittest.main()
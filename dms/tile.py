@@ -2,8 +2,10 @@ import dataclasses
 from dataclasses import dataclass
 from typing import List
 
+from dms.codons import (CODON_INDEX, CODON_SCHEMES, codon_scheme_mask,
+                        scheme_amino_acids)
 from dms.dna import is_dna_seq, translate_sequence
-from dms.mutation import Mutation, NontargetMutation
+from dms.mutation import Mutation, NontargetMutation, OffScheme
 
 @dataclass(frozen=True)
 class Tile:
@@ -13,6 +15,7 @@ class Tile:
     cds_end: int
     cds_length: int = dataclasses.field(init=False)
     positions: List[int] = None
+    codon_scheme: str = None
     def __post_init__(self):
         if not is_dna_seq(self.wt_seq):
             raise TypeError('wt_seq is not a DNA sequence.')
@@ -36,12 +39,17 @@ class Tile:
                     raise ValueError(f'Not a valid position: {p}')
         else:
             positions = tuple(sorted(wt_aa))
+        if self.codon_scheme is not None and \
+           self.codon_scheme not in CODON_SCHEMES:
+            raise ValueError(f'Not a valid codon scheme: {self.codon_scheme}')
         # Because this is frozen, we need to use object.__setattr__
         # instead of simple assignment.
         object.__setattr__(self, 'length', len(self.wt_seq))
         object.__setattr__(self, 'cds_length', self.cds_end - self.cds_start)
         object.__setattr__(self, 'wt_aa', wt_aa)
         object.__setattr__(self, 'positions', positions)
+        object.__setattr__(self, 'codon_mask',
+                           codon_scheme_mask(self.codon_scheme or 'NNN'))
 
 def mutations_in_seq(tile, seq):
     """Find all mutations contained in a given sequence.
@@ -82,3 +90,29 @@ def mutations_in_seq(tile, seq):
         if base != wt_base:
             muts.append(NontargetMutation(i, wt_base, base))
     return tuple(muts)
+
+def library_mutations_in_seq(tile, seq):
+    """Like mutations_in_seq, but if the tile has a codon scheme, returns
+    (OffScheme,) for a sequence with a codon change at one of the tile's
+    positions to a codon outside the scheme. Such sequences can only
+    come from sequencing or PCR errors, so they are tallied together
+    rather than as variants. The scheme says nothing about codons
+    outside the positions, so changes there are left as they are."""
+    muts = mutations_in_seq(tile, seq)
+    if tile.codon_scheme is not None and \
+       any(isinstance(m, Mutation) and not tile.codon_mask[CODON_INDEX[m.codon]]
+           and m.pos in tile.positions
+           for m in muts):
+        return (OffScheme,)
+    return muts
+
+def library_size(tile):
+    """Return the number of amino acid variants (including stops) that
+    the tile's library can contain, i.e. the number of non-wild type
+    amino acids its codon scheme encodes at each of its positions. A
+    tile without a codon scheme is assumed to target all 20 at each
+    position."""
+    if tile.codon_scheme is None:
+        return 20 * len(tile.positions)
+    aas = scheme_amino_acids(tile.codon_scheme)
+    return sum(len(aas - {tile.wt_aa[p]}) for p in tile.positions)
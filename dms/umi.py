@@ -0,0 +1,180 @@
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+# UMIs are packed two bits per base below a leading 1 bit, so that UMIs
+# of different lengths get different codes. Packed UMIs take the low
+# UMI_BITS bits of the 64-bit keys used to deduplicate reads, and the
+# index of the read the rest.
+MAX_UMI_LENGTH = 16
+UMI_BITS = 2 * MAX_UMI_LENGTH + 1
+UMI_MASK = (1 << UMI_BITS) - 1
+
+BASE_CODES = {'A' : 0, 'C' : 1, 'G' : 2, 'T' : 3}
+
+def pack_umi(umi):
+    """Pack a UMI sequence into an integer. Returns None if the UMI has
+    bases other than A, C, G and T."""
+    if len(umi) > MAX_UMI_LENGTH:
+        raise ValueError(f'UMIs longer than {MAX_UMI_LENGTH} bases are not'
+                         f' supported: {umi}')
+    code = 1
+    for base in umi:
+        if base not in BASE_CODES:
+            return None
+        code = (code << 2) | BASE_CODES[base]
+    return code
+
+def umi_lengths(codes):
+    """Return the lengths of the UMIs of an array of packed UMIs."""
+    lengths = np.zeros(len(codes), dtype=np.int64)
+    codes = codes.copy()
+    while np.any(codes > 1):
+        more = codes > 1
+        lengths[more] += 1
+        codes[more] >>= np.uint64(2)
+    return lengths
+
+def umi_extractor(params):
+    """Return a function that takes a pair of FASTQ records and returns
+    a tuple (umi, pair) of its packed UMI (None if the UMI is missing or
+    has an N) and the pair to merge, or None if params asks for no UMIs.
+
+    UMIs are taken from the forward read's header with the regular
+    expression params.umi_regex (its first group if it has one, or
+    else the whole match), or from the first params.umi_length bases of
+    the forward read, which are then trimmed off.
+    """
+    if params.umi_regex is not None:
+        pattern = re.compile(params.umi_regex)
+        def extract(pair):
+            match = pattern.search(pair[0][0])
+            if match is None:
+                return None, pair
+            return pack_umi(match.group(1 if pattern.groups else 0)), pair
+        return extract
+    if params.umi_length is not None:
+        length = params.umi_length
+        def extract(pair):
+            (id1, seq1, qual_id1, qual1), read2 = pair
+            umi = pack_umi(seq1[:length].tobytes().decode('ascii'))
+            return umi, ((id1, seq1[length:], qual_id1, qual1[length:]),
+                         read2)
+        return extract
+    return None
+
+@dataclass(frozen=True, eq=False)
+class UMISet:
+    """The distinct packed UMIs a variant was seen with, as a sorted
+    array. Adding UMISets takes their union, so raw counts made of them
+    can be merged with merge_counts."""
+    umis: np.ndarray
+
+    def __add__(self, other):
+        return UMISet(np.union1d(self.umis, other.umis))
+
+    def __eq__(self, other):
+        return isinstance(other, UMISet) and \
+            np.array_equal(self.umis, other.umis)
+
+    def __len__(self):
+        return len(self.umis)
+
+    @staticmethod
+    def union(umi_sets):
+        """Return the union of a list of UMISets, merging them all at
+        once rather than pairwise."""
+        if len(umi_sets) == 1:
+            return umi_sets[0]
+        return UMISet(np.unique(np.concatenate([u.umis for u in umi_sets])))
+
+    def count(self, mismatches=0):
+        """Return the number of distinct UMIs, or if mismatches is 1, the
+        number of groups of UMIs connected by single mismatches, which
+        are taken to be errors in the same UMI."""
+        if mismatches == 0 or len(self.umis) < 2:
+            return len(self.umis)
+        return umi_clusters(self.umis)
+
+def umi_clusters(umis):
+    """Return the number of connected components of a sorted array of
+    distinct packed UMIs, where UMIs of the same length with one base
+    different are connected."""
+    lengths = umi_lengths(umis)
+    shifts = np.arange(lengths.max(), dtype=np.uint64) * np.uint64(2)
+    flips = (np.arange(1, 4, dtype=np.uint64)[:, None] << shifts).ravel()
+    in_umi = (np.repeat(np.arange(len(shifts))[None, :], 3, axis=0).ravel()
+              < lengths[:, None])
+    # Find the UMIs that are a single base change from each UMI.
+    neighbours = umis[:, None] ^ flips[None, :]
+    i = np.minimum(np.searchsorted(umis, neighbours), len(umis) - 1)
+    edges = in_umi & (umis[i] == neighbours)
+    a = np.broadcast_to(np.arange(len(umis))[:, None], edges.shape)[edges]
+    b = i[edges]
+    # Label each component with the smallest index in it.
+    labels = np.arange(len(umis))
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, a, labels[b])
+        new = new[new]
+        if np.array_equal(new, labels):
+            return len(np.unique(labels))
+        labels = new
+
+class UMICounter:
+    """Collects the (read, UMI) pairs of a sample without duplicates.
+
+    Each pair is packed into a 64-bit key (see UMI_BITS) and buffered in
+    a fixed-size array, which is deduplicated whenever it fills up. The
+    deduplicated runs are merged into one sorted array of keys as soon
+    as they add up to as many keys as it holds, so that memory stays
+    within a few times the number of distinct pairs (plus the buffer and
+    the distinct reads themselves) rather than growing with the number
+    of reads, while each key is only merged a logarithmic number of
+    times.
+    """
+    def __init__(self, buffer_size=1 << 20):
+        self.reads = {}
+        self.buffer = np.empty(buffer_size, dtype=np.uint64)
+        self.n = 0
+        self.runs = []
+        self.unmerged = 0
+
+    def add(self, read, umi):
+        i = self.reads.setdefault(read, len(self.reads))
+        self.buffer[self.n] = (i << UMI_BITS) | umi
+        self.n += 1
+        if self.n == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.n > 0:
+            run = np.unique(self.buffer[:self.n])
+            self.n = 0
+            self.runs.append(run)
+            if len(self.runs) > 1:
+                self.unmerged += len(run)
+                if self.unmerged >= len(self.runs[0]):
+                    self.merge()
+
+    def merge(self):
+        if len(self.runs) > 1:
+            self.runs = [np.unique(np.concatenate(self.runs))]
+        self.unmerged = 0
+
+    def keys(self):
+        """Return the sorted array of distinct keys added so far."""
+        self.flush()
+        self.merge()
+        return self.runs[0] if self.runs else np.empty(0, dtype=np.uint64)
+
+    def read_umis(self):
+        """Return a dict mapping each distinct read to a UMISet of the
+        UMIs it was seen with."""
+        keys = self.keys()
+        read_ids = keys >> np.uint64(UMI_BITS)
+        umis = keys & np.uint64(UMI_MASK)
+        bounds = np.searchsorted(read_ids, np.arange(len(self.reads) + 1))
+        return {read : UMISet(umis[bounds[i]:bounds[i + 1]])
+                for (read, i) in self.reads.items()}